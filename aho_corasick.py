@@ -0,0 +1,163 @@
+"""
+    Count all the candidate strings of length m in a document with an Aho-Corasick
+    automaton
+
+    The automaton is built from the candidate strings one trie level at a time. Its goto
+    function is a sparse table of the trie edges, sorted keys state * NUM_SYMBOLS + byte,
+    so it takes O(number of trie nodes) memory whatever the alphabet. A byte with no edge
+    from a state follows the failure links of the state until a state with an edge or
+    the root is reached. A document is scanned once per round however many candidates
+    there are. Rounds with more than BLOCK_STRINGS candidates are counted one block of
+    candidates at a time so that the automaton and its matches fit in memory.
+
+    The scan of a document is split into NUM_SLICES slices that are stepped through in
+    lockstep so that each step is a vectorized lookup. Each slice starts m - 1 bytes early.
+    As all candidates are m bytes long, the automaton state after m - 1 bytes does not
+    depend on the bytes before them so no match is missed or counted twice. Slices are at
+    least m bytes long so that these extra bytes at most double the bytes scanned.
+
+    Counts are non-overlapping like str.count()
+"""
+from __future__ import division, print_function
+import numpy as np
+from kmers import KmerCounter, get_match_counts
+
+# Number of slices of a document that are scanned in lockstep
+NUM_SLICES = 64 * 1024
+
+# Largest number of candidates that are matched by one automaton
+BLOCK_STRINGS = 64 * 1024
+
+# Bytes are symbols 0..255. Symbol 256 is in no candidate so it resets the automaton
+NUM_SYMBOLS = 257
+RESET = 256
+
+
+class Automaton(object):
+    """Aho-Corasick automaton that matches the strings in the rows of a uint8 array
+        keys: sorted array of parent * NUM_SYMBOLS + byte of the trie edges
+        targets: targets[i] is the child of trie edge keys[i]
+        fail: fail[state] is the failure state of state. State 0 is the root
+        out: out[state] is the index of the string that ends at state, otherwise -1
+    """
+
+    def __init__(self, matrix):
+        num_strings, m = matrix.shape
+
+        # Trie nodes at depth k are the distinct k-byte prefixes of the lexically sorted
+        # strings. Row i starts a new trie node at depth k if it differs from row i - 1
+        # in its first k bytes
+        order = np.lexsort(matrix.T[::-1])
+        rows = matrix[order]
+        neq = rows[1:] != rows[:-1]
+        first = np.concatenate(([0], np.where(neq.any(axis=1), neq.argmax(axis=1), m)))
+        nodes = np.zeros((m + 1, num_strings), dtype=np.int64)
+        num_nodes = 1
+        for k in range(1, m + 1):
+            new = first < k
+            nodes[k] = num_nodes + np.cumsum(new) - 1
+            num_nodes += new.sum()
+
+        keys, targets = [], []
+        for k in range(m):
+            new = first < k + 1
+            keys.append(nodes[k][new] * NUM_SYMBOLS + rows[new, k])
+            targets.append(nodes[k + 1][new])
+        keys, targets = np.concatenate(keys), np.concatenate(targets)
+        sorted_keys = np.argsort(keys)
+        self.keys, self.targets = keys[sorted_keys], targets[sorted_keys]
+        del keys, targets, sorted_keys
+
+        # The failure state of a node at depth k + 1 is the state its parent's failure
+        # state goes to on its last byte. The parents' failure states are all at
+        # shallower depths so the levels are filled in order
+        self.fail = np.zeros(num_nodes, dtype=np.int64)
+        for k in range(1, m):
+            new = first < k + 1
+            parents, children = nodes[k][new], nodes[k + 1][new]
+            self.fail[children] = self.next_states(self.fail[parents], rows[new, k])
+
+        self.out = np.full(num_nodes, -1, dtype=np.int64)
+        self.out[nodes[m]] = order
+
+    def goto(self, states, symbols):
+        """Return array of the trie children of states on symbols, -1 where there are none"""
+        wanted = states * NUM_SYMBOLS + symbols
+        j = np.searchsorted(self.keys, wanted)
+        np.minimum(j, len(self.keys) - 1, out=j)
+        return np.where(self.keys[j] == wanted, self.targets[j], -1)
+
+    def next_states(self, states, symbols):
+        """Return array of the states that the automaton goes to from states on symbols"""
+        states = states.copy()
+        next_states = self.goto(states, symbols)
+        # Follow the failure links of the states with no edge for their symbols. The root
+        # goes to itself on symbols it has no edge for
+        missing = np.flatnonzero(next_states < 0)
+        while len(missing):
+            at_root = states[missing] == 0
+            next_states[missing[at_root]] = 0
+            missing = missing[~at_root]
+            states[missing] = self.fail[states[missing]]
+            next_states[missing] = self.goto(states[missing], symbols[missing])
+            missing = missing[next_states[missing] < 0]
+        return next_states
+
+
+def get_counts(text, matrix):
+    """Return array of non-overlapping counts in text of the strings in the rows of uint8
+        array matrix
+    """
+    num_strings = matrix.shape[0]
+    counts = np.zeros(num_strings, dtype=np.int64)
+    for start in range(0, num_strings, BLOCK_STRINGS):
+        stop = start + BLOCK_STRINGS
+        counts[start:stop] = get_block_counts(text, matrix[start:stop])
+    return counts
+
+
+def get_block_counts(text, matrix):
+    """Return array of non-overlapping counts in text of the strings in the rows of uint8
+        array matrix, counted with one automaton
+    """
+    num_strings, m = matrix.shape
+    data = np.frombuffer(text, dtype=np.uint8)
+    n = len(data)
+    if n < m or not num_strings:
+        return np.zeros(num_strings, dtype=np.int64)
+
+    automaton = Automaton(matrix)
+
+    slice_len = max(-(-n // NUM_SLICES), m)
+    num_slices = -(-n // slice_len)
+    # Slice i owns data[starts[i]:starts[i] + slice_len] and is scanned from m - 1 bytes
+    # before it. Offsets before the start and after the end of data are RESET
+    starts = np.arange(num_slices, dtype=np.int64) * slice_len - (m - 1)
+    states = np.zeros(num_slices, dtype=np.int64)
+    positions, indexes = [], []
+    for t in range(slice_len + m - 1):
+        offsets = starts + t
+        outside = (offsets < 0) | (offsets >= n)
+        symbols = data[np.clip(offsets, 0, n - 1)].astype(np.int64)
+        symbols[outside] = RESET
+        states = automaton.next_states(states, symbols)
+        found = automaton.out[states]
+        hit = np.flatnonzero(found >= 0)
+        if len(hit):
+            # The string ends at data[offsets]
+            positions.append(offsets[hit] - (m - 1))
+            indexes.append(found[hit])
+    if not positions:
+        return np.zeros(num_strings, dtype=np.int64)
+
+    pos = np.concatenate(positions)
+    idx = np.concatenate(indexes)
+    increasing = np.argsort(pos, kind='mergesort')
+    return get_match_counts(idx[increasing], pos[increasing], m, num_strings)
+
+
+class AhoCorasickCounter(KmerCounter):
+    """Counts candidate strings of length m in each document of a corpus with an
+        Aho-Corasick automaton built from the candidates
+    """
+    get_counts = staticmethod(get_counts)
@@ -0,0 +1,210 @@
+"""
+    Run find_repeats.analyze() on many corpora in a pool of worker processes
+
+    python batch.py -j 4 -d batch manifest.json
+
+    The manifest is a JSON list of the corpora to analyze, one object per corpus
+        pattern: file pattern of the documents of the corpus, as for find_repeats.py
+        name: name of the corpus. Default is corpus<i> for the i'th corpus. Names must be
+            distinct as they name the output files of the corpora
+        engine, growth, time_limit, max_candidates: options of find_repeats.analyze()
+            for the corpus. Defaults are the defaults of analyze()
+    e.g.
+        [{"name": "pdf", "pattern": "pdf/*repeats=*.pdf", "time_limit": 600},
+         {"name": "xps", "pattern": "xps/*repeats=*.xps", "engine": "kmer"}]
+
+    Each distinct document is loaded once, before the workers are started, and the workers
+    are forked from the process that loaded them so they share its pages. Large documents
+    are memory-mapped (mapped_text.read_text()) so they are read from the file system cache
+    as they are used. Where processes cannot be forked each worker loads the documents
+    itself.
+
+    The corpora are analyzed in increasing order of their bytes per repeat, the sum over
+    their documents of document size / numrepeats, so that cheap corpora finish first.
+    Each corpus writes its report to <directory>/<name>.txt and its metrics to
+    <directory>/<name>.jsonl (see metrics.py). The throughput of each corpus and of the
+    whole batch is written to stdout and <directory>/batch.json.
+"""
+from __future__ import division, print_function
+import json
+import multiprocessing
+import os
+import sys
+import time
+import find_repeats
+from find_repeats import get_files, get_numrepeats
+from format_output import read_metrics
+from mapped_text import read_text
+
+MBYTE = 1024 ** 2
+
+# {os.path.realpath(filename): text} of the documents of all the corpora
+_texts = None
+
+
+def get_cost(filenames, texts):
+    """Return bytes per repeat of the corpus of documents `filenames`"""
+    return sum(len(texts[os.path.realpath(filename)]) / get_numrepeats(filename)
+               for filename in filenames)
+
+
+def load_texts(filenames):
+    """Return {os.path.realpath(filename): text} of the distinct files in filenames"""
+    texts = {}
+    for filename in filenames:
+        path = os.path.realpath(filename)
+        if path not in texts:
+            texts[path] = read_text(filename)
+    return texts
+
+
+def get_tasks(manifest, directory):
+    """Return list of the tasks of the corpora in manifest, a list of corpus objects as
+        described above, and the distinct files of the corpora. Corpora that match no
+        files are left out
+        Raises ValueError if two corpora have the same name
+    """
+    names = [entry.get('name', 'corpus%d' % i) for i, entry in enumerate(manifest)]
+    duplicates = sorted(set(name for name in names if names.count(name) > 1))
+    if duplicates:
+        raise ValueError('Corpus names must be distinct. Duplicated: %s' % ', '.join(duplicates))
+
+    tasks, filenames = [], []
+    for name, entry in zip(names, manifest):
+        files = get_files(entry['pattern'])
+        if not files:
+            continue
+        options = dict((key, entry[key]) for key in ('engine', 'growth', 'time_limit',
+                                                     'max_candidates') if key in entry)
+        tasks.append((name, entry['pattern'], files, options, directory))
+        filenames.extend(files)
+    return tasks, filenames
+
+
+def _init_worker(filenames):
+    """Load the documents in a worker that was not forked from the process that loaded
+        them
+    """
+    global _texts
+    if _texts is None:
+        _texts = load_texts(filenames)
+
+
+def _analyze_corpus(task):
+    """Return name, result record of analyzing the corpus of `task`"""
+    name, pattern, _, options, directory = task
+    metrics_path = os.path.join(directory, '%s.jsonl' % name)
+    stdout = sys.stdout
+    start = time.time()
+    try:
+        with open(os.path.join(directory, '%s.txt' % name), 'wt') as f:
+            sys.stdout = f
+            find_repeats.analyze(pattern, metrics_path=metrics_path, texts=_texts, **options)
+    except Exception as e:
+        return name, {'error': '%s: %s' % (type(e).__name__, e)}
+    finally:
+        sys.stdout = stdout
+
+    run, rounds, _, total = read_metrics(metrics_path)
+    wall = total['wall'] if total else time.time() - start
+    valid_rounds = [r['m'] for r in rounds if r['surviving']]
+    return name, {
+        'num_docs': run.get('num_docs', 0),
+        'size': run.get('size', 0),
+        'wall': wall,
+        'cpu': total['cpu'] if total else None,
+        'rounds': len(rounds),
+        'longest': max(valid_rounds) if valid_rounds else None,
+        'mb_per_s': run.get('size', 0) / MBYTE / wall if wall else None,
+    }
+
+
+def run_batch(manifest, directory, jobs=1):
+    """Analyze the corpora in manifest, writing their reports and metrics to directory, and
+        return summary, results
+            summary: throughput of the whole batch
+            results: {name: result record} of each corpus
+    """
+    global _texts
+    start = time.time()
+    tasks, filenames = get_tasks(manifest, directory)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    _texts = load_texts(filenames)
+    load_time = time.time() - start
+    tasks.sort(key=lambda task: get_cost(task[2], _texts))
+
+    results = {}
+    if jobs <= 1:
+        for task in tasks:
+            name, result = _analyze_corpus(task)
+            results[name] = result
+            print('%-30s %s' % (name, 'FAILED' if 'error' in result else 'done'))
+    else:
+        pool = multiprocessing.Pool(jobs, _init_worker, (filenames,))
+        for name, result in pool.imap_unordered(_analyze_corpus, tasks):
+            results[name] = result
+            print('%-30s %s' % (name, 'FAILED' if 'error' in result else 'done'))
+            sys.stdout.flush()
+        pool.close()
+        pool.join()
+
+    wall = time.time() - start
+    size = sum(len(text) for text in _texts.values())
+    done = [result for result in results.values() if 'error' not in result]
+    summary = {
+        'corpora': len(tasks),
+        'failed': len(tasks) - len(done),
+        'files': len(_texts),
+        'size': size,
+        'load': load_time,
+        'wall': wall,
+        'mb_per_s': size / MBYTE / wall if wall else None,
+        'corpora_per_min': 60.0 * len(done) / wall if wall else None,
+        # Sum of the corpora's wall times / batch wall time
+        'concurrency': sum(result['wall'] for result in done) / wall if wall else None,
+    }
+    with open(os.path.join(directory, 'batch.json'), 'wt') as f:
+        json.dump({'summary': summary, 'results': results}, f, indent=4, sort_keys=True)
+    return summary, results
+
+
+def print_results(summary, results):
+    print('%-30s %5s %8s %9s %9s %7s %7s' % ('corpus', 'files', 'MB', 'wall', 'MB/s',
+          'rounds', 'longest'))
+    for name, result in sorted(results.items(), key=lambda x: x[1].get('wall', 0)):
+        if 'error' in result:
+            print('%-30s FAILED %s' % (name, result['error']))
+            continue
+        print('%-30s %5d %8.1f %9.2f %9s %7d %7s' % (name, result['num_docs'],
+              result['size'] / MBYTE, result['wall'],
+              '%.2f' % result['mb_per_s'] if result['mb_per_s'] else '-', result['rounds'],
+              '-' if result['longest'] is None else result['longest']))
+    print('=' * 80)
+    print('%d corpora (%d failed), %d files, %.1f MB in %.1f sec (%.1f sec loading): '
+          '%.2f MB/sec, %.1f corpora/min, concurrency %.2f'
+          % (summary['corpora'], summary['failed'], summary['files'],
+             summary['size'] / MBYTE, summary['wall'], summary['load'],
+             summary['mb_per_s'] or 0, summary['corpora_per_min'] or 0,
+             summary['concurrency'] or 0))
+
+
+if __name__ == '__main__':
+    import optparse
+
+    parser = optparse.OptionParser('python %s [options] <manifest>' % sys.argv[0])
+    parser.add_option('-j', '--jobs', dest='jobs', type=int, default=1,
+                      help='Number of corpora analyzed at a time')
+    parser.add_option('-d', '--directory', dest='directory', default='batch',
+                      help='Directory the reports and metrics of the corpora are written to')
+    options, args = parser.parse_args()
+    if not args:
+        parser.print_help()
+        exit()
+
+    with open(args[0], 'rt') as f:
+        manifest = json.load(f)
+    summary, results = run_batch(manifest, options.directory, options.jobs)
+    print('=' * 80)
+    print_results(summary, results)
+    exit(1 if summary['failed'] else 0)
@@ -0,0 +1,307 @@
+"""
+    Benchmark the find_repeats.py engines on generated corpora and compare the timings
+    with a stored baseline
+
+    python bench.py --save                 # run the default matrix and store the baseline
+    python bench.py                        # run it again and report regressions
+    python bench.py -s 1,10,100 -n 2,5 -u 1000,100000 -e count,kmer
+
+    Each case of the matrix is a corpus made by a make_repeats.make_repeats() method or
+    by make_repeats_simple.make_repeats_doc() ('simple') for a document size, a number of
+    documents and, for the methods that use it, a num_unique. Corpora are made with a
+    random seed derived from the case name so they are the same on every run, and are
+    kept in the benchmark directory so they are only made once.
+
+    Each engine is run on each corpus in its own process with a metrics file (see
+    metrics.py), and the results record
+        wall, cpu: seconds for the whole run
+        peak_rss: peak resident set size in bytes
+        mb_per_s: corpus MB / validation wall time
+        rounds: [m, corpus MB / wall time of the round] for each validation
+        longest: length of the longest valid strings
+        strings: sorted hex of the longest valid strings
+        exact: sorted hex of the longest exactly repeated strings
+        intercept: intercept of the exact strings, None if there are none
+    The strings are read from the pattern file (see count_units.py) that each run writes.
+    A case is a regression if its wall time or peak RSS is more than `tolerance` worse
+    than the baseline, or it finds different strings or a different intercept. A case is
+    a mismatch if the engines find different strings or intercepts.
+
+    Timings depend on the machine, so no baseline is kept in the repository. The baseline
+    is stored in results/baseline.json by running the default matrix with --save on the
+    machine that will be benchmarked, at the commit to compare against. Runs with --save
+    add their cases to an existing baseline.
+"""
+from __future__ import division, print_function
+import binascii
+import json
+import os
+import random
+import subprocess
+import sys
+import zlib
+from count_units import load_patterns
+from format_output import read_metrics
+import make_repeats
+import make_repeats_simple
+
+MBYTE = 1024 ** 2
+
+# The generators that make the documents of a corpus
+#   0-6, 11-15: make_repeats.make_repeats() methods
+#   simple: make_repeats_simple.make_repeats_doc()
+METHODS = [0, 1, 2, 3, 4, 5, 6, 11, 12, 13, 14, 15, 'simple']
+# Methods whose documents depend on num_unique
+UNIQUE_METHODS = [3, 4, 5, 6]
+
+# Default matrix
+SIZES = [1.0]
+NUM_DOCS = [2, 5]
+NUM_UNIQUES = [1000, 100000]
+ENGINES = ['count', 'index', 'kmer', 'aho', 'suffix']
+MIN_REPEATS = 11
+
+# A run is a regression if it is this much slower or bigger than the baseline
+TOLERANCE = 0.2
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results',
+                             'baseline.json')
+
+
+def get_case_name(method, size, num_docs, num_unique):
+    """Return name of corpus made by `method` with num_docs documents of size MB"""
+    name = 'method=%s_size=%g_docs=%d' % (method, size, num_docs)
+    if method in UNIQUE_METHODS:
+        name += '_unique=%d' % num_unique
+    return name
+
+
+def get_cases(methods, sizes, nums_docs, num_uniques):
+    """Return list of (name, method, size, num_docs, num_unique) for the cases of the
+        matrix. Methods that don't use num_unique have one case per size and num_docs
+    """
+    cases = []
+    for method in methods:
+        for size in sizes:
+            for num_docs in nums_docs:
+                for num_unique in (num_uniques if method in UNIQUE_METHODS else num_uniques[:1]):
+                    cases.append((get_case_name(method, size, num_docs, num_unique), method,
+                                  size, num_docs, num_unique))
+    return cases
+
+
+def make_corpus(directory, name, method, size, num_docs, num_unique):
+    """Make the documents of case `name` in directory/name unless they already exist and
+        return the file pattern that matches them
+    """
+    corpus_dir = os.path.join(directory, name)
+    pattern = os.path.join(corpus_dir, 'repeats=*.txt')
+    done_path = os.path.join(corpus_dir, 'done')
+    if os.path.exists(done_path):
+        return pattern
+    if not os.path.exists(corpus_dir):
+        os.makedirs(corpus_dir)
+
+    random.seed(zlib.crc32(name))
+    doc_size = int(size * MBYTE)
+    random_lists = None
+    if method == 5:
+        random_lists = make_repeats.make_random_lists(doc_size, num_unique, 0)
+    elif method == 6:
+        random_lists = make_repeats.make_random_lists(doc_size, num_unique,
+                                                      make_repeats.JOIN_SIZE)
+    for num_repeats in range(MIN_REPEATS, MIN_REPEATS + num_docs):
+        if method == 'simple':
+            doc = make_repeats_simple.make_repeats_doc(doc_size, num_repeats)
+            with open(os.path.join(corpus_dir, 'repeats=%d.txt' % num_repeats), 'wb') as f:
+                f.write(doc)
+        else:
+            make_repeats.make_repeats_file(corpus_dir, doc_size, num_repeats, method, num_unique,
+                                           random_lists, heading=name + '\n')
+    open(done_path, 'wt').close()
+    return pattern
+
+
+def run_engine(pattern, engine, metrics_path, patterns_path):
+    """Run find_repeats.py with `engine` on the files matching pattern and return its
+        result record, or None if it failed
+    """
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'find_repeats.py')
+    for path in (metrics_path, patterns_path):
+        if os.path.exists(path):
+            os.remove(path)
+    with open(os.devnull, 'wb') as devnull:
+        status = subprocess.call([sys.executable, script, '-e', engine, '-m', metrics_path,
+                                  '-p', patterns_path, pattern], stdout=devnull)
+    if status != 0 or not os.path.exists(metrics_path) or not os.path.exists(patterns_path):
+        return None
+    run, rounds, phases, total = read_metrics(metrics_path)
+    if not total:
+        return None
+
+    markers, intercept = load_patterns(patterns_path)
+    with open(patterns_path, 'rt') as f:
+        longest = [binascii.unhexlify(h) for h in json.load(f)['longest']]
+    exact = markers if intercept is not None else []
+
+    size_mb = run['size'] / MBYTE
+    validation = sum(p['wall'] for p in phases if p['phase'] in ('round 1', 'validation'))
+    return {
+        'wall': total['wall'],
+        'cpu': total['cpu'],
+        'peak_rss': total['peak_rss'],
+        'mb_per_s': size_mb / validation if validation else None,
+        'rounds': [[r['m'], size_mb / r['wall'] if r['wall'] else None] for r in rounds],
+        'longest': len(longest[0]) if longest else 0,
+        'strings': sorted(binascii.hexlify(s) for s in longest),
+        'exact': sorted(binascii.hexlify(s) for s in exact),
+        'intercept': intercept,
+    }
+
+
+def get_answer(result):
+    """Return the strings, exact strings and intercept found by the run of result record
+        `result`
+    """
+    return result['strings'], result['exact'], result['intercept']
+
+
+def describe_answer(result):
+    """Return a short description of the strings found by the run of result record
+        `result`
+    """
+    return '%d x %d-char strings, %d exact, intercept=%s' % (
+        len(result['strings']), result['longest'], len(result['exact']), result['intercept'])
+
+
+def compare(results, baseline, tolerance):
+    """Return list of (case, engine, message) for the regressions of results from baseline
+        results and baseline are {case: {engine: result record}}
+    """
+    regressions = []
+    for case in sorted(results):
+        for engine, result in sorted(results[case].items()):
+            base = baseline.get(case, {}).get(engine)
+            if not base:
+                continue
+            if result is None:
+                regressions.append((case, engine, 'failed'))
+                continue
+            # Baselines saved before the strings were recorded only have their lengths
+            if 'strings' in base and get_answer(result) != get_answer(base):
+                regressions.append((case, engine, '%s, baseline %s'
+                                    % (describe_answer(result), describe_answer(base))))
+            for key in ('wall', 'peak_rss'):
+                if result[key] and base[key] and result[key] > base[key] * (1.0 + tolerance):
+                    regressions.append((case, engine, '%s=%.3g, baseline=%.3g (+%.0f%%)'
+                                        % (key, result[key], base[key],
+                                           100.0 * (result[key] / base[key] - 1.0))))
+    return regressions
+
+
+def mismatches(results):
+    """Return list of (case, {engine: description}) for the cases where the engines found
+        different strings, exact strings or intercepts
+    """
+    bad = []
+    for case in sorted(results):
+        answers = dict((engine, get_answer(result))
+                       for engine, result in results[case].items() if result)
+        if len(set(json.dumps(answer) for answer in answers.values())) > 1:
+            bad.append((case, dict((engine, describe_answer(results[case][engine]))
+                                   for engine in answers)))
+    return bad
+
+
+def print_results(results):
+    print('%-40s %-7s %9s %9s %10s %9s %7s' % ('case', 'engine', 'wall', 'cpu', 'peak MB',
+          'MB/s', 'longest'))
+    for case in sorted(results):
+        for engine, result in sorted(results[case].items()):
+            if result is None:
+                print('%-40s %-7s FAILED' % (case, engine))
+                continue
+            print('%-40s %-7s %9.2f %9.2f %10.1f %9s %7s' % (case, engine, result['wall'],
+                  result['cpu'], (result['peak_rss'] or 0) / MBYTE,
+                  '%.2f' % result['mb_per_s'] if result['mb_per_s'] else '-',
+                  result['longest']))
+
+
+def to_list(value, convert):
+    return [convert(x) for x in value.split(',')] if value else []
+
+
+if __name__ == '__main__':
+    import optparse
+
+    parser = optparse.OptionParser('python %s [options]' % sys.argv[0])
+    parser.add_option('-d', '--directory', dest='directory', default='bench',
+                      help='Directory the corpora and metrics files are kept in')
+    parser.add_option('-m', '--methods', dest='methods', default=None,
+                      help='Comma-separated methods. Default %s' % METHODS)
+    parser.add_option('-s', '--sizes', dest='sizes', default=None,
+                      help='Comma-separated document sizes in MB. Default %s' % SIZES)
+    parser.add_option('-n', '--num-docs', dest='num_docs', default=None,
+                      help='Comma-separated numbers of documents. Default %s' % NUM_DOCS)
+    parser.add_option('-u', '--unique', dest='num_uniques', default=None,
+                      help='Comma-separated num_unique values. Default %s' % NUM_UNIQUES)
+    parser.add_option('-e', '--engines', dest='engines', default=None,
+                      help='Comma-separated engines. Default %s' % ENGINES)
+    parser.add_option('-b', '--baseline', dest='baseline', default=BASELINE_PATH,
+                      help='Baseline results file')
+    parser.add_option('--save', dest='save', action='store_true', default=False,
+                      help='Store the results as the baseline')
+    parser.add_option('-t', '--tolerance', dest='tolerance', type=float, default=TOLERANCE,
+                      help='Fraction a run can be slower or bigger than the baseline')
+    options, args = parser.parse_args()
+
+    methods = to_list(options.methods, lambda x: x if x == 'simple' else int(x)) or METHODS
+    cases = get_cases(methods,
+                      to_list(options.sizes, float) or SIZES,
+                      to_list(options.num_docs, int) or NUM_DOCS,
+                      to_list(options.num_uniques, int) or NUM_UNIQUES)
+    engines = to_list(options.engines, str) or ENGINES
+
+    results = {}
+    for name, method, size, num_docs, num_unique in cases:
+        pattern = make_corpus(options.directory, name, method, size, num_docs, num_unique)
+        results[name] = {}
+        for engine in engines:
+            metrics_path = os.path.join(options.directory, name, '%s.jsonl' % engine)
+            patterns_path = os.path.join(options.directory, name, '%s.patterns.json' % engine)
+            results[name][engine] = run_engine(pattern, engine, metrics_path, patterns_path)
+            print('%-40s %-7s %s' % (name, engine, 'done' if results[name][engine]
+                                     else 'FAILED'))
+            sys.stdout.flush()
+
+    print('=' * 80)
+    print_results(results)
+
+    bad = mismatches(results)
+    for case, longest in bad:
+        print('MISMATCH %s %s' % (case, longest))
+
+    if options.save:
+        baseline = {}
+        if os.path.exists(options.baseline):
+            with open(options.baseline, 'rt') as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(options.baseline, 'wt') as f:
+            json.dump(baseline, f, indent=4, sort_keys=True)
+        print('Saved baseline to %s' % options.baseline)
+        exit()
+
+    if not os.path.exists(options.baseline):
+        print('No baseline in %s. Run with --save to store one' % options.baseline)
+        exit(1 if bad else 0)
+
+    with open(options.baseline, 'rt') as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, options.tolerance)
+    print('=' * 80)
+    for case, engine, message in regressions:
+        print('REGRESSION %s %s %s' % (case, engine, message))
+    print('%d regressions in %d runs' % (len(regressions),
+          sum(len(r) for r in results.values())))
+    exit(1 if regressions or bad else 0)
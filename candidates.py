@@ -0,0 +1,219 @@
+"""
+    Generation and storage of the candidate strings of each round
+
+    A string of length m + 1 can only be repeated a sufficient number of times if both
+    its length m substrings are, so the candidates for m + 1 are the strings whose first m
+    bytes and last m bytes are valid strings of length m. They are found by joining the
+    valid strings on their m - 1 byte prefixes and suffixes.
+
+    More generally every length m substring of a valid string is valid, so the candidates
+    of any length longer than m are the strings whose length m substrings are all valid.
+    grow_strings() uses this to jump from length m to up to 2m in one validation.
+
+    All the strings of a round have the same length m so they are stored as the rows of
+    an n x m uint8 array in a CandidateSet, m bytes per string rather than the 50 or so
+    bytes of overhead of a Python string in a list.
+"""
+from __future__ import division, print_function
+import numpy as np
+
+# A jump stops extending its candidates when there are more than this many times as many
+# candidates as valid strings
+MAX_JUMP_GROWTH = 2
+
+
+def get_extensions(strings, base=None):
+    """Return list of the strings w + c for w in `strings` for which the last m bytes of
+        w + c are in base, a list of distinct strings of length m. base defaults to strings
+        `strings` is a list of distinct strings of the same length, at least m - 1
+        Strings in base are indexed by their m - 1 byte prefixes so the time taken is
+        proportional to the number of strings returned
+    """
+    if base is None:
+        base = strings
+    last_bytes = {}
+    for t in base:
+        last_bytes.setdefault(t[:-1], []).append(t[-1])
+    k = len(base[0]) - 1 if base else 0
+    return [s + c for s in strings for c in last_bytes.get(s[len(s) - k:], ())]
+
+
+def grow_strings(strings, valid, extend, max_len, doubling=False):
+    """Generate the valid strings of each length that is validated, in increasing length.
+        The last strings generated are all the longest valid strings up to max_len bytes
+            strings: all the valid strings of length m
+            valid: valid(candidates) returns the valid strings in candidates
+            extend: extend(candidates, strings) returns get_extensions(candidates, strings)
+            doubling: False: validate lengths m + 1, m + 2, ... until no string is valid
+                      True: jump from length m to up to 2m then binary search back down to
+                            the longest valid length when a jump has no valid strings. This
+                            takes O(log L) validations to find strings of length L
+    """
+    m = len(strings[0]) if strings else max_len
+    while m < max_len:
+        limit = min(2 * m if doubling else m + 1, max_len)
+        candidates, k = extend(strings, strings), m + 1
+        while k < limit and candidates and len(candidates) <= MAX_JUMP_GROWTH * len(strings):
+            candidates, k = extend(candidates, strings), k + 1
+        valid_strings = valid(candidates) if candidates else candidates
+        if valid_strings:
+            yield valid_strings
+            strings, m = valid_strings, k
+            continue
+
+        # No strings of length k are valid so the longest valid strings are shorter
+        lo, hi = m, k
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            candidates = strings
+            for _ in range(mid - lo):
+                candidates = extend(candidates, strings)
+            valid_strings = valid(candidates) if candidates else candidates
+            if valid_strings:
+                yield valid_strings
+                strings, lo = valid_strings, mid
+            else:
+                hi = mid
+        return
+
+
+def get_keys(matrix):
+    """Return 1-d array of the rows of uint8 array matrix as opaque keys
+        Keys sort in the byte order of the rows
+    """
+    matrix = np.ascontiguousarray(matrix)
+    return matrix.view(np.dtype((np.void, matrix.shape[1]))).ravel()
+
+
+class CandidateSet(object):
+    """Distinct strings of the same length m stored as the rows of an n x m uint8 array
+        Iterating and indexing give Python strings
+    """
+
+    def __init__(self, matrix):
+        self.matrix = np.ascontiguousarray(matrix, dtype=np.uint8)
+        # order, sorted keys of the rows for index()
+        self._sorted = None
+
+    @classmethod
+    def from_strings(cls, strings):
+        """Return CandidateSet of list of distinct strings of the same length"""
+        m = len(strings[0]) if strings else 0
+        return cls(np.frombuffer(''.join(strings), dtype=np.uint8).reshape(len(strings), m))
+
+    @property
+    def m(self):
+        """Length of the strings"""
+        return self.matrix.shape[1]
+
+    @property
+    def nbytes(self):
+        return self.matrix.nbytes
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def __iter__(self):
+        for row in self.matrix:
+            yield row.tostring()
+
+    def __getitem__(self, i):
+        """Return string i, or a CandidateSet of the strings in slice i"""
+        if isinstance(i, slice):
+            return CandidateSet(self.matrix[i])
+        return self.matrix[i].tostring()
+
+    def __repr__(self):
+        return repr(self.tolist())
+
+    def tolist(self):
+        return list(self)
+
+    def take(self, indexes):
+        """Return CandidateSet of the strings at `indexes`"""
+        return CandidateSet(self.matrix[indexes])
+
+    def indexes(self, matrix):
+        """Return array of the indexes of the strings in the rows of uint8 array matrix, -1
+            for strings that are not in the set
+        """
+        if matrix.shape[1] != self.m or not len(self):
+            return np.full(len(matrix), -1, dtype=np.int64)
+        if self._sorted is None:
+            keys = get_keys(self.matrix)
+            order = np.argsort(keys)
+            self._sorted = order, keys[order]
+        order, sorted_keys = self._sorted
+        keys = get_keys(matrix)
+        j = np.minimum(np.searchsorted(sorted_keys, keys), len(self) - 1)
+        return np.where(sorted_keys[j] == keys, order[j], -1)
+
+    def index(self, s):
+        """Return index of string s, or -1 if s is not in the set"""
+        return self.indexes(np.frombuffer(s, dtype=np.uint8).reshape(1, -1))[0]
+
+    def __contains__(self, s):
+        return self.index(s) >= 0
+
+    def _get_join_groups(self, base):
+        """Return suffix_groups, prefix_groups, group_sizes where strings whose base.m - 1
+            byte suffix is the base.m - 1 byte prefix of strings in CandidateSet base have
+            the same group
+                suffix_groups[i]: group of the suffix of string i
+                prefix_groups[j]: group of the prefix of base[j]
+                group_sizes[g]: number of strings in base whose prefix has group g
+        """
+        n, m = self.matrix.shape
+        k = base.m - 1
+        if k == 0:
+            # All prefixes are empty so every pair joins
+            groups = np.zeros(n + len(base), dtype=np.int64)
+        else:
+            keys = np.concatenate((get_keys(self.matrix[:, m - k:]),
+                                   get_keys(base.matrix[:, :-1])))
+            _, groups = np.unique(keys, return_inverse=True)
+        suffix_groups, prefix_groups = groups[:n], groups[n:]
+        return suffix_groups, prefix_groups, np.bincount(prefix_groups,
+                                                         minlength=groups.max() + 1)
+
+    def num_extensions(self, base=None):
+        """Return array of the number of strings in extensions(base) that extend each string
+            in the set, without making them
+        """
+        if base is None:
+            base = self
+        if not len(self) or not len(base):
+            return np.zeros(len(self), dtype=np.int64)
+        suffix_groups, _, group_sizes = self._get_join_groups(base)
+        return group_sizes[suffix_groups]
+
+    def extensions(self, base=None):
+        """Return CandidateSet of the strings w + c for w in the set for which the last
+            base.m bytes of w + c are in CandidateSet base, in the order get_extensions()
+            returns them. base defaults to this set
+            This is a vectorized join of the strings' base.m - 1 byte suffixes to the
+            base.m - 1 byte prefixes of base
+        """
+        if base is None:
+            base = self
+        n, m = self.matrix.shape
+        if not n or not len(base):
+            return CandidateSet(np.empty((0, m + 1), dtype=np.uint8))
+        k = base.m - 1
+        suffix_groups, prefix_groups, group_sizes = self._get_join_groups(base)
+
+        # The strings t that string s joins to are the strings whose prefix group is s's
+        # suffix group. They are contiguous in prefix_order
+        prefix_order = np.argsort(prefix_groups, kind='mergesort')
+        group_starts = np.cumsum(group_sizes) - group_sizes
+        num_joins = group_sizes[suffix_groups]
+        total = num_joins.sum()
+
+        s_idx = np.repeat(np.arange(n), num_joins)
+        rank = np.arange(total) - np.repeat(np.cumsum(num_joins) - num_joins, num_joins)
+        t_idx = prefix_order[np.repeat(group_starts[suffix_groups], num_joins) + rank]
+
+        matrix = np.empty((total, m + 1), dtype=np.uint8)
+        matrix[:, :m] = self.matrix[s_idx]
+        matrix[:, m] = base.matrix[t_idx, k]
+        return CandidateSet(matrix)
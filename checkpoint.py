@@ -0,0 +1,87 @@
+"""
+    Checkpoints of the state of a find_repeats.search() so that a run that is stopped can
+    be resumed from its last finished round
+
+    A checkpoint is one compressed .npz file that holds
+        manifest: JSON of index_store.get_manifest() of the corpus, so a checkpoint is only
+            resumed on documents with the same contents and numbers of repeats
+        nstrings: uint8 array of the valid strings of the last finished round, one per row
+        counts: counts[i, d] is the count of nstrings[i] in document d of the manifest
+        exact_nstrings: uint8 array of the longest exactly repeated strings found so far
+        intercept: their intercept, -1 if there are none. Their counts are
+            numrepeats + intercept in each document so they are not stored
+        complete: 1 if the search finished
+    It is written to a temporary file that is renamed over the checkpoint, so a run that is
+    killed while writing leaves the last checkpoint intact.
+"""
+from __future__ import division, print_function
+import json
+import os
+import time
+import numpy as np
+from candidates import CandidateSet
+from index_store import get_doc_order
+
+# Least number of seconds between checkpoints. The last round is always written
+CHECKPOINT_INTERVAL = 60.0
+
+
+class Checkpoint(object):
+    """The checkpoint file of a search of a corpus"""
+
+    def __init__(self, path, manifest, interval=CHECKPOINT_INTERVAL):
+        """path: name of the checkpoint file
+            manifest: index_store.get_manifest() of the corpus, in the order of the corpus
+            interval: least number of seconds between checkpoints
+        """
+        self.path = path
+        self.manifest = manifest
+        self.interval = interval
+        self.last_save = None
+
+    def save(self, nstrings, counts, exact_nstrings, intercept, complete=False, force=False):
+        """Write a checkpoint of the round of CandidateSet nstrings and array counts of
+            them in each document, and the longest exactly repeated strings found so far,
+            CandidateSet exact_nstrings, and their intercept. Checkpoints are written at
+            most every `interval` seconds unless `force` or `complete`
+            complete: the search has finished
+        """
+        now = time.time()
+        if not (force or complete) and self.last_save is not None and \
+                now - self.last_save < self.interval:
+            return
+        exact = (exact_nstrings.matrix if exact_nstrings
+                 else np.empty((0, 0), dtype=np.uint8))
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            np.savez_compressed(f, manifest=np.array(json.dumps(self.manifest)),
+                                nstrings=nstrings.matrix,
+                                counts=np.asarray(counts, dtype=np.int64),
+                                exact_nstrings=exact,
+                                intercept=np.array(-1 if intercept is None else intercept),
+                                complete=np.array(int(complete)))
+        os.rename(temp_path, self.path)
+        self.last_save = now
+
+    def load(self):
+        """Return nstrings, counts, exact_nstrings, intercept, complete from the checkpoint
+            file, or None if there is none. Counts are in the order of the corpus
+            Raises ValueError if the checkpoint is of a different corpus
+        """
+        if not os.path.exists(self.path):
+            return None
+        with np.load(self.path) as data:
+            manifest = json.loads(data['manifest'].item())
+            order = get_doc_order(manifest, self.manifest)
+            if order is None or len(manifest) != len(self.manifest):
+                raise ValueError('Checkpoint %s is of a different corpus' % self.path)
+            nstrings = CandidateSet(data['nstrings'])
+            counts = np.empty_like(data['counts'])
+            counts[:, order] = data['counts']
+            exact_nstrings = None
+            if data['exact_nstrings'].size:
+                exact_nstrings = CandidateSet(data['exact_nstrings'])
+            intercept = int(data['intercept'])
+            complete = bool(data['complete'])
+        return (nstrings, counts, exact_nstrings, None if intercept < 0 else intercept,
+                complete)
@@ -0,0 +1,243 @@
+"""
+    Collapse chains of shifted valid strings into maximal strings that are counted once
+
+    When a corpus contains a long marker, every round keeps all the shifted m-byte windows
+    of it and the counter counts each of them in every document in every round.
+
+    The valid strings of length m are the nodes of an overlap graph with an edge from u to
+    v when u[1:] == v[:-1], so the candidates of length m + 1 are its edges. A chain is a
+    path u_0 -> u_1 -> ... in which each edge is the only edge out of its source and the
+    only edge into its target. It spells a maximal string S = u_0 + u_1[-1] + u_2[-1] ...
+    whose m-byte windows are the nodes of the chain.
+
+    The offsets of the m-byte windows of S in each document are found in one scan of the
+    document for all new chains (kmers.get_matches()). S[a:a + j] occurs at offset p
+    exactly when windows a, a + 1, ... a + j - m of S occur at p, p + 1, ... so the counts
+    of the windows of S of every length from m to len(S) are computed from these offsets
+    without reading the documents again. CollapsingCounter counts the candidates that are
+    windows of chains this way and validates only the other candidates with the counter
+    it wraps, so the valid strings and their counts are the same as without it.
+"""
+from __future__ import division, print_function
+import numpy as np
+from candidates import CandidateSet
+from inverted_index import get_non_overlapping_count
+from kmers import get_matches
+
+# Least number of newly counted valid strings in a chain for it to be collapsed. Shorter
+#  chains are not worth a scan of the documents
+MIN_CHAIN_WINDOWS = 4
+
+
+def get_windows(string, m):
+    """Return uint8 array of the m-byte windows of uint8 array string, one per row"""
+    n = len(string) - m + 1
+    return string[np.arange(n)[:, np.newaxis] + np.arange(m)]
+
+
+def get_chains(strings):
+    """Return list of arrays of the indexes of the strings of the chains of CandidateSet
+        strings, in the order of the chain
+    """
+    n = len(strings)
+    if strings.m < 2 or n < 2:
+        return []
+    out_degrees = strings.num_extensions(strings)
+    # The predecessors of a string are the successors of its reverse in the reversed set
+    reverse = CandidateSet(strings.matrix[:, ::-1])
+    in_degrees = reverse.num_extensions(reverse)
+
+    single = np.flatnonzero(out_degrees == 1)
+    successors = strings.indexes(strings.take(single).extensions(strings).matrix[:, 1:])
+    linked = (in_degrees[successors] == 1) & (successors != single)
+    next_string = np.full(n, -1, dtype=np.int64)
+    next_string[single[linked]] = successors[linked]
+    has_prev = np.zeros(n, dtype=bool)
+    has_prev[successors[linked]] = True
+
+    # Chains start at strings with a successor and no predecessor. Cycles have no start
+    #  and are left to the counter
+    chains = []
+    for start in np.flatnonzero((next_string >= 0) & ~has_prev):
+        chain = [start]
+        while next_string[chain[-1]] >= 0:
+            chain.append(next_string[chain[-1]])
+        chains.append(np.array(chain))
+    return chains
+
+
+class Chain(object):
+    """A maximal string whose m-byte windows are valid strings, with the offsets of those
+        windows in each document of a corpus
+    """
+
+    def __init__(self, string, m):
+        """string: uint8 array of the maximal string"""
+        self.string = string
+        self.m = m
+        # offsets[d][i]: sorted offsets of window i in document d
+        # runs[d][i][k]: number of consecutive windows i, i + 1, ... that occur at
+        #  offsets[d][i][k], offsets[d][i][k] + 1, ...
+        self.offsets = []
+        self.runs = []
+
+    def add_doc(self, offsets):
+        """Add list of sorted offsets of each window in the next document"""
+        runs = [None] * len(offsets)
+        runs[-1] = np.ones(len(offsets[-1]), dtype=np.int64)
+        for i in range(len(offsets) - 2, -1, -1):
+            runs[i] = np.ones(len(offsets[i]), dtype=np.int64)
+            after = offsets[i + 1]
+            if not len(after) or not len(offsets[i]):
+                continue
+            j = np.minimum(np.searchsorted(after, offsets[i] + 1), len(after) - 1)
+            hit = after[j] == offsets[i] + 1
+            runs[i][hit] += runs[i + 1][j[hit]]
+        self.offsets.append(offsets)
+        self.runs.append(runs)
+
+    def counts(self, a, j):
+        """Return list of non-overlapping counts of string[a:a + j] in each document"""
+        need = j - self.m + 1
+        return [get_non_overlapping_count(offsets[a][runs[a] >= need], j)
+                for offsets, runs in zip(self.offsets, self.runs)]
+
+
+def make_chains(strings, chains, corpus):
+    """Return list of Chains of the chains of CandidateSet strings, arrays of the indexes
+        of the strings in each chain, with their offsets in each document of corpus. Each
+        document is scanned once
+    """
+    from find_repeats import findall
+
+    m = strings.m
+    new_chains = [Chain(np.concatenate((strings.matrix[chain[0]],
+                                        strings.matrix[chain[1:], -1])), m)
+                  for chain in chains]
+    nodes = np.concatenate(chains)
+    starts = np.cumsum([0] + [len(chain) for chain in chains])
+    matrix = strings.matrix[nodes]
+    for _, _, text in corpus:
+        pos, idx, shared = get_matches(text, matrix)
+        order = np.argsort(idx, kind='mergesort')
+        pos, idx = pos[order], idx[order]
+        bounds = np.searchsorted(idx, np.arange(len(nodes) + 1))
+        offsets = [pos[bounds[i]:bounds[i + 1]] for i in range(len(nodes))]
+        for i in shared:
+            offsets[i] = np.array(findall(text, matrix[i].tostring()), dtype=np.int64)
+        for c, chain in enumerate(new_chains):
+            chain.add_doc(offsets[starts[c]:starts[c + 1]])
+    return new_chains
+
+
+class CollapsingCounter(object):
+    """Wraps a counter so that candidates that are windows of the chains of earlier rounds'
+        valid strings are counted from the offsets of the chains' windows rather than by
+        the counter
+        The counter must validate any set of candidates of a round independently of the
+        others
+    """
+
+    def __init__(self, counter, corpus):
+        """counter: counter of corpus, a list of (filename, numrepeats, text)"""
+        self.counter = counter
+        self.corpus = corpus
+        self.nums = np.array([numrepeats for _, numrepeats, _ in corpus])
+        self.chains = []
+        self._valid_counts = None
+        # Number of bytes scanned in each document in the last call to valid()
+        self.bytes_scanned = None
+        # Number of candidates counted from chains in the last call to valid()
+        self.num_collapsed = 0
+
+    @property
+    def num_runs(self):
+        return getattr(self.counter, 'num_runs', 0)
+
+    def extend(self, candidates, strings):
+        if hasattr(self.counter, 'extend'):
+            return self.counter.extend(candidates, strings)
+        return candidates.extensions(strings)
+
+    def get_windows(self, m):
+        """Return CandidateSet of the m-byte windows of the chains and list of
+            (chain, offset in chain's string) of each of them
+        """
+        matrices, sources = [], []
+        for chain in self.chains:
+            if chain.m <= m <= len(chain.string):
+                matrices.append(get_windows(chain.string, m))
+                sources.extend((chain, a) for a in range(len(chain.string) - m + 1))
+        if not matrices:
+            return CandidateSet(np.empty((0, m), dtype=np.uint8)), sources
+        return CandidateSet(np.concatenate(matrices)), sources
+
+    def valid(self, strings):
+        """Return CandidateSet of the strings in `strings` that are repeated a sufficient
+            number of times in the test file corpus
+        """
+        num_docs = len(self.corpus)
+        self.num_collapsed = 0
+        if not isinstance(strings, CandidateSet):
+            valid_strings = self.counter.valid(strings)
+            self._valid_counts = None
+            self.bytes_scanned = getattr(self.counter, 'bytes_scanned', None)
+            return valid_strings
+
+        m = strings.m
+        windows, sources = self.get_windows(m)
+        where = windows.indexes(strings.matrix)
+        collapsed = np.flatnonzero(where >= 0)
+        counted = np.flatnonzero(where < 0)
+        self.num_collapsed = len(collapsed)
+
+        collapsed_counts = np.array([sources[i][0].counts(sources[i][1], m)
+                                     for i in where[collapsed]],
+                                    dtype=np.int64).reshape(len(collapsed), num_docs)
+        ok = (collapsed_counts >= self.nums).all(axis=1)
+        collapsed, collapsed_counts = collapsed[ok], collapsed_counts[ok]
+
+        bytes_scanned = np.zeros(num_docs, dtype=np.int64)
+        if len(counted):
+            counted_strings = strings.take(counted)
+            valid_counted = self.counter.valid(counted_strings)
+            counted_counts = np.asarray(self.counter.valid_counts(), dtype=np.int64)
+            counted = counted[counted_strings.indexes(valid_counted.matrix)]
+            scanned = getattr(self.counter, 'bytes_scanned', None)
+            bytes_scanned = None if scanned is None else bytes_scanned + scanned
+        else:
+            counted = counted[:0]
+            counted_counts = np.empty((0, num_docs), dtype=np.int64)
+
+        # The valid strings are in the order of `strings` as they would be from the counter
+        indexes = np.concatenate((collapsed, counted))
+        counts = np.concatenate((collapsed_counts, counted_counts))
+        order = np.argsort(indexes, kind='mergesort')
+        valid_strings = strings.take(indexes[order])
+        self._valid_counts = counts[order]
+
+        # Collapse the chains of strings that were counted. Chains that are shorter than
+        #  the next candidates are no longer needed
+        self.chains = [chain for chain in self.chains if len(chain.string) > m]
+        was_counted = np.zeros(len(valid_strings), dtype=bool)
+        was_counted[np.searchsorted(indexes[order], counted)] = True
+        chains = [chain for chain in get_chains(valid_strings)
+                  if was_counted[chain].sum() >= MIN_CHAIN_WINDOWS]
+        if chains:
+            self.chains.extend(make_chains(valid_strings, chains, self.corpus))
+            if bytes_scanned is not None:
+                bytes_scanned += [len(text) for _, _, text in self.corpus]
+        self.bytes_scanned = bytes_scanned
+        return valid_strings
+
+    def valid_counts(self):
+        """Return array counts where counts[i, d] is the number of occurrences of string i
+            returned by the last call to valid() in document d
+        """
+        if self._valid_counts is None:
+            return self.counter.valid_counts()
+        return self._valid_counts
+
+    def close(self):
+        if hasattr(self.counter, 'close'):
+            self.counter.close()
@@ -0,0 +1,214 @@
+"""
+    Count the sub-units of new documents with the markers that find_repeats.py found
+
+    python find_repeats.py -p markers.json "training/*repeats=*.txt"
+    python count_units.py markers.json "new/*.pdf" [more patterns ...]
+    find new -name "*.pdf" | python count_units.py -l - -j 8 -o counts.jsonl markers.json
+
+    The pattern file written by find_repeats.py -p holds the markers, the longest strings
+    that are repeated exactly numrepeats + intercept times in each training document, and
+    their intercept. A new document with n sub-units should contain each marker
+    n + intercept times.
+
+    All the markers have the same length so each document is counted for all of them in
+    one scan of its windows (kmers.get_matches()). Documents are memory-mapped when they
+    are large (mapped_text.read_text()) and counted by a pool of worker processes. One
+    JSON object per document is written, in the order of the input files
+        filename: name of the document
+        size: length of the document in bytes
+        counts: non-overlapping count of each marker, in the order of the pattern file
+        units: smallest count minus the intercept, or null if the markers were not
+            exactly repeated
+        offsets: with -f, the offsets of the counted occurrences of each marker
+        error: the error, in place of the counts, if the document could not be read
+    Counts are non-overlapping like str.count()
+"""
+from __future__ import division, print_function
+import binascii
+import glob
+import json
+import multiprocessing
+import sys
+import time
+import numpy as np
+from kmers import get_counts, get_matches
+from mapped_text import read_text, release_pages
+
+# Number of documents sent to a worker at a time
+CHUNK_SIZE = 16
+
+# The markers counted by this process: matrix, intercept, offsets
+_markers = None
+
+
+def MB(b):
+    return b / 1024.0 / 1024.0
+
+
+def save_patterns(path, markers, intercept, longest=None):
+    """Write pattern file path for list of strings `markers` of the same length
+        intercept: number of times the markers occur in a document with no sub-units,
+            None if the markers are not exactly repeated
+        longest: if not None, list of the longest repeated strings. These are not
+            counted, they are recorded so that runs can be compared
+    """
+    patterns = {'markers': [binascii.hexlify(s) for s in markers],
+                'length': len(markers[0]) if markers else 0,
+                'intercept': intercept}
+    if longest is not None:
+        patterns['longest'] = [binascii.hexlify(s) for s in longest]
+    with open(path, 'wt') as f:
+        json.dump(patterns, f, indent=4)
+
+
+def load_patterns(path):
+    """Return markers, intercept from pattern file path"""
+    with open(path, 'rt') as f:
+        patterns = json.load(f)
+    return ([binascii.unhexlify(h) for h in patterns['markers']],
+            None if patterns['intercept'] is None else int(patterns['intercept']))
+
+
+def get_non_overlapping_offsets(offsets, m):
+    """Return the offsets of the occurrences of a length m string at sorted `offsets` that
+        str.count() counts: leftmost match first, then the next match that starts after it
+        ends, and so on
+    """
+    if len(offsets) < 2 or np.diff(offsets).min() >= m:
+        return list(offsets)
+    counted = []
+    end = -1
+    for ofs in offsets:
+        if ofs >= end:
+            counted.append(ofs)
+            end = ofs + m
+    return counted
+
+
+def get_doc_counts(text, matrix, offsets=False):
+    """Return counts, marker_offsets for text and the markers in the rows of uint8 array
+        matrix
+            counts: list of non-overlapping counts of the markers in text
+            marker_offsets: if `offsets`, list of the offsets of the counted occurrences of
+                each marker, otherwise None
+    """
+    if not offsets:
+        return get_counts(text, matrix).tolist(), None
+
+    from find_repeats import findall
+
+    num_markers, m = matrix.shape
+    pos, idx, shared = get_matches(text, matrix)
+    order = np.argsort(idx, kind='mergesort')
+    pos, idx = pos[order], idx[order]
+    bounds = np.searchsorted(idx, np.arange(num_markers + 1))
+    marker_offsets = []
+    for i in range(num_markers):
+        if i in shared:
+            occurrences = findall(text, matrix[i].tostring())
+        else:
+            occurrences = pos[bounds[i]:bounds[i + 1]]
+        marker_offsets.append([int(ofs) for ofs in get_non_overlapping_offsets(occurrences, m)])
+    return [len(ofs_list) for ofs_list in marker_offsets], marker_offsets
+
+
+def _init_worker(markers):
+    global _markers
+    if _markers is None:
+        _markers = markers
+
+
+def _count_file(filename):
+    """Return the record of the counts of the markers in file filename"""
+    matrix, intercept, offsets = _markers
+    try:
+        text = read_text(filename)
+    except (IOError, OSError) as e:
+        return {'filename': filename, 'size': 0, 'error': str(e)}
+    counts, marker_offsets = get_doc_counts(text, matrix, offsets)
+    record = {'filename': filename, 'size': len(text), 'counts': counts,
+              'units': min(counts) - intercept if intercept is not None and counts else None}
+    if offsets:
+        record['offsets'] = marker_offsets
+    release_pages([text])
+    return record
+
+
+def count_units(filenames, markers, intercept, jobs=1, offsets=False):
+    """Generate the record of the counts of `markers` in each file in iterable filenames
+            markers: list of strings of the same length from load_patterns()
+            intercept: their intercept from load_patterns()
+            jobs: number of processes that count files
+            offsets: include the offsets of the counted occurrences in the records
+    """
+    global _markers
+    m = len(markers[0]) if markers else 0
+    matrix = np.frombuffer(''.join(markers), dtype=np.uint8).reshape(len(markers), m)
+    _markers = matrix, intercept, offsets
+    if jobs <= 1:
+        for filename in filenames:
+            yield _count_file(filename)
+        return
+
+    pool = multiprocessing.Pool(jobs, _init_worker, (_markers,))
+    try:
+        for record in pool.imap(_count_file, filenames, CHUNK_SIZE):
+            yield record
+    finally:
+        pool.close()
+        pool.join()
+
+
+def get_filenames(patterns, list_path):
+    """Generate the files that match glob patterns `patterns` and the files listed one per
+        line in file list_path, '-' for stdin
+    """
+    for pattern in patterns:
+        for filename in sorted(glob.glob(pattern)):
+            yield filename
+    if list_path:
+        f = sys.stdin if list_path == '-' else open(list_path, 'rt')
+        for line in f:
+            filename = line.rstrip('\r\n')
+            if filename:
+                yield filename
+
+
+if __name__ == '__main__':
+    import optparse
+
+    parser = optparse.OptionParser('python %s [options] <pattern file> [<file pattern> ...]'
+                                   % sys.argv[0])
+    parser.add_option('-l', '--list', dest='list_path', default=None,
+                      help='File with the names of the documents to count, one per line. '
+                           '"-" for stdin')
+    parser.add_option('-j', '--jobs', dest='jobs', type=int, default=1,
+                      help='Number of processes used to count documents')
+    parser.add_option('-f', '--offsets', dest='offsets', action='store_true', default=False,
+                      help='Write the offsets of the counted occurrences of the markers')
+    parser.add_option('-o', '--output', dest='output', default=None,
+                      help='File the counts are written to. Default is stdout')
+    options, args = parser.parse_args()
+    if not args or (len(args) < 2 and not options.list_path):
+        parser.print_help()
+        exit()
+
+    markers, intercept = load_patterns(args[0])
+    if not markers:
+        print('No markers in %s' % args[0], file=sys.stderr)
+        exit(1)
+
+    start = time.time()
+    num_files, size = 0, 0
+    f = open(options.output, 'wt') if options.output else sys.stdout
+    for record in count_units(get_filenames(args[1:], options.list_path), markers, intercept,
+                              options.jobs, options.offsets):
+        f.write(json.dumps(record, sort_keys=True) + '\n')
+        num_files += 1
+        size += record['size']
+    if options.output:
+        f.close()
+    duration = time.time() - start
+    print('%d files, %.1f MB in %.1f sec, %.0f files/min, %.1f MB/sec'
+          % (num_files, MB(size), duration, 60.0 * num_files / max(duration, 1e-6),
+             MB(size) / max(duration, 1e-6)), file=sys.stderr)
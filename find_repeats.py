@@ -1,5 +1,13 @@
 from __future__ import division, print_function
 import glob
+import os
+import sys
+import time
+import numpy as np
+from candidates import CandidateSet, grow_strings
+from histograms import get_bigram_counts, get_codes, get_suffix_byte_counts
+from mapped_text import read_text, release_pages
+from metrics import Metrics
 
 
 def MB(b):
@@ -49,110 +57,710 @@ def findall(text, pattern):
 
 def get_data(filename):
     """Return filename, numrepeats, text for filename
-        text is the compressed contents of the file
+        text is the compressed contents of the file. Large files are memory-mapped
     """
     numrepeats = get_numrepeats(filename)
-    text = file(filename, 'rb').read()
+    text = read_text(filename)
     return filename, numrepeats, text
 
 
-MAX_FILE_LEN = 999 * 1024 * 1024
+# Longest substring analyze() searches for
+MAX_SUBSTRING_LEN = 500
+# Most memory used by the counts kept by a CountCache
+MAX_CACHE_BYTES = 256 * 1024 * 1024
+# Number of bytes of a document that get_capped_count() counts between checks of whether
+#  a string can still be repeated enough times
+CAPPED_BLOCK_SIZE = 1024 * 1024
 
 
-def analyze(file_pattern):
+def get_capped_count(text, s, numrepeats, suffix_byte_counts):
+    """Return n, scanned where
+            n: text.count(s) if it is numrepeats or more, otherwise some count < numrepeats
+            scanned: number of bytes of text that were counted
+        text is counted in blocks and counting stops when the occurrences of the bytes of s
+        in the rest of text are too few for s to occur numrepeats times
+        suffix_byte_counts: get_suffix_byte_counts(text, CAPPED_BLOCK_SIZE)
+    """
+    m = len(s)
+    size = len(text)
+    if size <= CAPPED_BLOCK_SIZE:
+        return text.count(s), size
+    codes, repeats = np.unique(np.frombuffer(s, dtype=np.uint8), return_counts=True)
+    n = 0
+    start = 0
+    while start < size:
+        # Blocks end where no occurrence of s crosses the block boundary so the counts of
+        #  the blocks add up, as in MappedText.count()
+        stop = min(start + CAPPED_BLOCK_SIZE, size)
+        while stop < size:
+            ofs = text.find(s, max(stop - m + 1, start), stop + m - 1)
+            if ofs < 0 or ofs >= stop:
+                break
+            stop = ofs + m
+        n += text.count(s, start, stop)
+        start = stop
+        # Each occurrence of s after `start` contains repeats[j] of byte codes[j]
+        most = (suffix_byte_counts[start // CAPPED_BLOCK_SIZE, codes] // repeats).min()
+        if n + most < numrepeats:
+            break
+    return n, start
+
+
+class TextCounter(object):
+    """Counts strings in the documents of a corpus with str.count
+        This is the default engine. Strings of length 1 and 2 are counted from tables
+        built in one pass over each document. Longer strings are counted with scans of
+        each document that stop at the first document the string is not repeated enough
+        times in, and stop scanning that document as soon as that is certain.
+        The documents are scanned in decreasing order of the number of strings they
+        rejected per byte scanned in the last round, so that most strings are rejected
+        after scanning few bytes
+    """
+    # Each candidate is counted in a separate scan of a document
+    SHARD_CANDIDATES = True
+
+    def __init__(self, corpus):
+        """corpus is a list of (filename, numrepeats, text)"""
+        self.corpus = list(corpus)
+        nums = np.array([[numrepeats] for _, numrepeats, _ in self.corpus])
+        self._valid = None
+        self._valid_counts = None
+        self.suffix_byte_counts = [get_suffix_byte_counts(text, CAPPED_BLOCK_SIZE)
+                                   for _, _, text in self.corpus]
+        self.byte_counts = np.array([counts[0] for counts in self.suffix_byte_counts])
+        self.bigram_counts = np.array([get_bigram_counts(text) for _, _, text in self.corpus])
+        self.byte_valid = (self.byte_counts >= nums).all(axis=0)
+        self.bigram_valid = (self.bigram_counts >= nums).all(axis=0)
+        # Number of strings rejected per byte scanned for each document. These start as
+        #  numrepeats per byte, the order the corpus is sorted in
+        self.rejection_rates = np.array([numrepeats / max(len(text), 1)
+                                         for _, numrepeats, text in self.corpus])
+        # Indexes of the documents in the order they are scanned
+        self.order = list(np.argsort(-self.rejection_rates, kind='mergesort'))
+        # Number of bytes scanned in each document in the last round
+        self.bytes_scanned = np.zeros(len(self.corpus), dtype=np.int64)
+
+    def valid(self, strings):
+        """Return CandidateSet of the strings in CandidateSet `strings` that are repeated a
+            sufficient number of times in the test file corpus
+        """
+        if strings.m <= 2:
+            table = self.byte_valid if strings.m == 1 else self.bigram_valid
+            self._valid = strings.take(np.flatnonzero(table[get_codes(strings.matrix)]))
+            self.bytes_scanned = np.zeros(len(self.corpus), dtype=np.int64)
+            return self._valid
+
+        num_docs = len(self.corpus)
+        rejections = np.zeros(num_docs, dtype=np.int64)
+        self.bytes_scanned = np.zeros(num_docs, dtype=np.int64)
+        indexes, valid_counts = [], []
+        for i, s in enumerate(strings):
+            counts = [0] * num_docs
+            for d in self.order:
+                _, numrepeats, text = self.corpus[d]
+                counts[d], scanned = get_capped_count(text, s, numrepeats,
+                                                      self.suffix_byte_counts[d])
+                self.bytes_scanned[d] += scanned
+                if counts[d] < numrepeats:
+                    rejections[d] += 1
+                    break
+            else:
+                indexes.append(i)
+                valid_counts.append(counts)
+        self._valid = strings.take(np.array(indexes, dtype=np.int64))
+        self._valid_counts = np.array(valid_counts, dtype=np.int64).reshape(len(indexes),
+                                                                            num_docs)
+
+        # Documents that were not scanned keep their last rejection rates
+        scanned = self.bytes_scanned > 0
+        self.rejection_rates[scanned] = rejections[scanned] / self.bytes_scanned[scanned]
+        self.order = sorted(self.order, key=lambda d: -self.rejection_rates[d])
+        return self._valid
+
+    def get_text_counts(self, text, strings):
+        """Return list of number of occurrences of each string in `strings` in text"""
+        return [text.count(s) for s in strings]
+
+    def valid_counts(self):
+        """Return array counts where counts[i, d] is the number of occurrences of string i
+            returned by the last call to valid() in document d
+        """
+        if self._valid.m <= 2:
+            table = self.byte_counts if self._valid.m == 1 else self.bigram_counts
+            return table[:, get_codes(self._valid.matrix)].T
+        return self._valid_counts
+
+
+class CountCache(object):
+    """Counts of the valid strings of each round in each document of a corpus
+        The counts of a round are read from the counter once, when the round is validated,
+        and the intercept search, exact match detection and report read them from here.
+        The shortest strings' rounds are evicted when the cache uses more than max_bytes.
+        Strings that are not in the cache are counted with str.count
+    """
 
+    def __init__(self, corpus, max_bytes=MAX_CACHE_BYTES):
+        """corpus is a list of (filename, numrepeats, text)"""
+        self.corpus = corpus
+        self.max_bytes = max_bytes
+        # {m: (strings, counts)} where counts[i, d] is count of strings[i] in document d for
+        #  the CandidateSet of valid strings of length m
+        self.rounds = {}
+
+    def add(self, strings, counts):
+        """Add array counts where counts[i, d] is count of strings[i] in document d
+            strings: CandidateSet
+        """
+        self.rounds[strings.m] = strings, counts
+        while len(self.rounds) > 1 and self.nbytes() > self.max_bytes:
+            del self.rounds[min(self.rounds)]
+
+    def nbytes(self):
+        """Return number of bytes used by the cached strings and counts"""
+        return sum(strings.nbytes + counts.nbytes for strings, counts in self.rounds.values())
+
+    def counts(self, s):
+        """Return list of number of occurrences of s in each document"""
+        if len(s) in self.rounds:
+            strings, counts = self.rounds[len(s)]
+            i = strings.index(s)
+            if i >= 0:
+                return counts[i].tolist()
+        return [text.count(s) for _, _, text in self.corpus]
+
+
+def make_counter(engine, corpus):
+    """Return the counter for `engine` on corpus
+        engine is one of ENGINES
+    """
+    if engine == 'count':
+        return TextCounter(corpus)
+    if engine == 'index':
+        from inverted_index import InvertedIndex
+        return InvertedIndex(corpus)
+    if engine == 'kmer':
+        from kmers import KmerCounter
+        return KmerCounter(corpus)
+    if engine == 'aho':
+        from aho_corasick import AhoCorasickCounter
+        return AhoCorasickCounter(corpus)
+    raise ValueError('Unknown engine "%s". Valid engines are %s' % (engine, ENGINES))
+
+
+# The engines that analyze() can use to count strings
+#   count: str.count over each whole document for every string
+#   index: inverted index of offsets of each valid string (inverted_index.py)
+#   kmer: keys of every m-byte window of each document matched to the candidates (kmers.py)
+#   aho: one Aho-Corasick scan of each document for all candidates (aho_corasick.py)
+#   suffix: one pass over the LCP intervals of a suffix array of the corpus (suffix_array.py)
+ENGINES = ['count', 'index', 'kmer', 'aho', 'suffix']
+# Engines that search in rounds of candidates. Only these can validate in several processes,
+#  store rounds in an index directory or stop at a time limit or candidate budget
+ROUND_ENGINES = ['count', 'index', 'kmer', 'aho']
+
+# How analyze() grows the candidate strings. See grow_strings() in candidates.py
+#   linear: one byte per round
+#   doubling: up to double the length per round, then binary search back
+GROWTH_MODES = ['linear', 'doubling']
+# Engines that can validate strings that don't extend the last valid strings by one byte
+DOUBLING_ENGINES = ['count', 'kmer', 'aho']
+# Engines that can validate the candidates of a round in slices
+SPILL_ENGINES = ['count', 'kmer', 'aho']
+# Engines whose counters can resume from the valid strings of a round. The index engine
+#  also needs the postings of the round
+CHECKPOINT_ENGINES = ['count', 'kmer', 'aho']
+# Engines whose counters can validate some of the candidates of a round without the others
+COLLAPSE_ENGINES = ['count', 'kmer', 'aho']
+
+
+def get_corpus(file_pattern, texts=None):
+    """Return list of (filename, numrepeats, text) for the files matching file_pattern in
+        increasing order of bytes per repeat, or None if there are none
+            texts: if not None, {os.path.realpath(filename): text} of the files, which have
+                already been loaded
+    """
     files = get_files(file_pattern)
     if not files:
-        return
-
-    corpus = [get_data(filename) for filename in files]
+        return None
+    if texts is None:
+        corpus = [get_data(filename) for filename in files]
+    else:
+        corpus = [(filename, get_numrepeats(filename), texts[os.path.realpath(filename)])
+                  for filename in files]
     corpus.sort(key=lambda x: len(x[2]) / x[1])
-    corpus = [x for x in corpus if len(x[2]) <= MAX_FILE_LEN]
+    return corpus
+
+
+class SearchLimit(Exception):
+    """Raised in search() when its deadline or candidate budget is reached"""
+
+
+def search(corpus, counter, cache=None, metrics=None, engine='count', growth='linear',
+           index_dir=None, deadline=None, max_candidates=None, checkpoint=None, resume=False):
+    """Generate round, nstrings, exact_nstrings, intercept after each round of the search
+        for the longest strings that are repeated the number of times given in corpus. The
+        last values generated are the results of the search
+            round: number of rounds so far
+            nstrings: CandidateSet of the longest valid strings found so far
+            exact_nstrings: CandidateSet of the longest strings found so far that are
+                repeated numrepeats + intercept times in each document for the smallest
+                intercept in 0..19, or None if there are none
+            intercept: the intercept of exact_nstrings, or None
+        corpus: list of (filename, numrepeats, text) from get_corpus()
+        counter: make_counter() counter of corpus, which may be wrapped in a
+            ParallelCounter, SpillingCounter or CollapsingCounter
+        cache: CountCache of corpus that the counts of each round are added to
+        metrics: Metrics that the round and phase records are added to
+        engine, growth, index_dir: as in analyze(). engine is the engine of counter
+        deadline: if not None, the search stops when a round is generated or validated
+            after time.time() passes deadline
+        max_candidates: if not None, the search stops before it validates more than this
+            many candidates in total
+        checkpoint: if not None, a checkpoint.Checkpoint that the state of the search is
+            saved to after rounds, when it stops early and when it finishes
+        resume: start from the state saved in checkpoint if there is one
+        A search that stops early does not mark its IndexStore as complete
+    """
+    if cache is None:
+        cache = CountCache(corpus)
+    if metrics is None:
+        metrics = Metrics()
+    nums = np.array([numrepeats for _, numrepeats, _ in corpus])
+    # Number of candidates validated so far
+    num_candidates = [0]
+
+    def update_exact_nstrings(nstrings, counts, exact_nstrings, intercept):
+        """Return the strings in nstrings that are repeated numrepeats + i times in each test
+            file for the smallest intercept i in 0..19 and i, or exact_nstrings, intercept
+            if there are none
+            counts: counts[i, d] is count of nstrings[i] in document d
+        """
+        diffs = counts - nums
+        exact = (diffs == diffs[:, :1]).all(axis=1) & (diffs[:, 0] >= 0) & (diffs[:, 0] < 20)
+        if not exact.any():
+            return exact_nstrings, intercept
+        intercept = int(diffs[exact, 0].min())
+        return nstrings.take(np.flatnonzero(exact & (diffs[:, 0] == intercept))), intercept
+
+    def check_limits(num_new):
+        """Raise SearchLimit if the deadline has passed or validating num_new more
+            candidates would exceed the candidate budget
+        """
+        if deadline is not None and time.time() >= deadline:
+            raise SearchLimit('deadline reached')
+        if max_candidates is not None and num_candidates[0] + num_new > max_candidates:
+            raise SearchLimit('%d candidates validated, budget is %d' % (num_candidates[0],
+                              max_candidates))
+
+    def get_valid(base_strings):
+        """Return CandidateSet of strings in base_strings that repeated a sufficient number of
+            times in the test file corpus
+        """
+        check_limits(len(base_strings))
+        num_candidates[0] += len(base_strings)
+        with metrics.phase('validation' if base_strings.m > 1 else 'round 1'):
+            valid_strings = counter.valid(base_strings)
+            release_pages(text for _, _, text in corpus)
+        bytes_scanned = getattr(counter, 'bytes_scanned', None)
+        num_runs = getattr(counter, 'num_runs', 0)
+        if num_runs:
+            print('-' * 40, '%d-char candidates spilled to %d runs' % (base_strings.m,
+                  num_runs))
+        num_collapsed = getattr(counter, 'num_collapsed', 0)
+        if num_collapsed:
+            print('-' * 40, '%d of %d %d-char candidates counted from collapsed chains'
+                  % (num_collapsed, len(base_strings), base_strings.m))
+        metrics.add_round(base_strings.m, len(base_strings), len(valid_strings),
+                          None if bytes_scanned is None else int(np.sum(bytes_scanned)),
+                          num_runs, num_collapsed)
+        return valid_strings
+
+    def extend(candidates, strings):
+        """Return CandidateSet of the extensions of candidates whose last len(strings[0])
+            bytes are in strings
+        """
+        check_limits(0)
+        with metrics.phase('generation'):
+            if hasattr(counter, 'extend'):
+                return counter.extend(candidates, strings)
+            return candidates.extensions(strings)
+
+    # Longest strings that can be valid
+    max_len = MAX_SUBSTRING_LEN
+    num_rounds = 0
+    # {m: valid strings of length m} for the lengths validated with doubling growth
+    validated = {}
+    doubling = growth == 'doubling'
+    resumed = checkpoint.load() if checkpoint is not None and resume else None
+    if resumed:
+        nstrings, counts, exact_nstrings, intercept, complete = resumed
+        print('-' * 40, 'Resuming from %d x %2d-char strings in %s' % (len(nstrings),
+              nstrings.m, checkpoint.path))
+        cache.add(nstrings, counts)
+        if exact_nstrings:
+            cache.add(exact_nstrings, np.tile(nums + intercept, (len(exact_nstrings), 1)))
+        if complete:
+            max_len = nstrings.m
+        num_rounds += 1
+        yield num_rounds, nstrings, exact_nstrings, intercept
+        if doubling:
+            validated[nstrings.m] = nstrings
+        if doubling and not complete:
+            # The lengths that were skipped before the checkpoint are validated from the
+            #  valid bytes
+            try:
+                base_unistrings = CandidateSet.from_strings([chr(i) for i in range(256)])
+                validated[1] = get_valid(base_unistrings)
+            except SearchLimit as e:
+                print('-' * 40, 'Stopped: %s' % e)
+                return
+    else:
+        try:
+            base_unistrings = CandidateSet.from_strings([chr(i) for i in range(256)])
+            unistrings = get_valid(base_unistrings)
+        except SearchLimit as e:
+            print('-' * 40, 'Stopped: %s' % e)
+            return
+        counts = counter.valid_counts()
+        if unistrings:
+            cache.add(unistrings, counts)
+            num_rounds += 1
+            yield num_rounds, unistrings, None, None
+        nstrings = unistrings
+        exact_nstrings, intercept = None, None
+        if doubling and unistrings:
+            validated[1] = unistrings
+
+    store = None
+    start_strings = nstrings
+    if index_dir:
+        with metrics.phase('store'):
+            from index_store import IndexStore, get_manifest, find_subset_store, get_added_rounds
+            manifest = checkpoint.manifest if checkpoint is not None else get_manifest(corpus)
+            store = IndexStore.create(index_dir, manifest)
+            # The index engine extends the postings of the last round so it can only start
+            #  from a round whose postings were stored. A resumed search starts from its
+            #  checkpoint
+            lengths = [] if resumed else store.lengths(postings=engine == 'index')
+            for m in lengths:
+                nstrings, counts = store.load(m)
+                cache.add(nstrings, counts)
+                exact_nstrings, intercept = update_exact_nstrings(nstrings, counts,
+                                                                  exact_nstrings, intercept)
+                if doubling:
+                    validated[m] = nstrings
+            if lengths:
+                print('-' * 40, 'Resuming from %d x %2d-char strings in %s' % (len(nstrings),
+                      nstrings.m, store.path))
+                if engine == 'index':
+                    counter.set_terms(store.load_postings(nstrings.m))
+                if store.is_complete(MAX_SUBSTRING_LEN):
+                    max_len = nstrings.m
+
+            subset = None
+            if not lengths and not resumed and engine != 'index':
+                subset = find_subset_store(index_dir, manifest)
+            if subset:
+                stored, order = subset
+                added_corpus = [doc for d, doc in enumerate(corpus) if d not in order]
+                print('-' * 40, 'Validating %d rounds of %s against %d added files'
+                      % (len(stored.lengths()), stored.path, len(added_corpus)))
+                added_counter = make_counter(engine, added_corpus)
+                for n1strings, counts in get_added_rounds(stored, order, len(corpus),
+                                                          added_counter):
+                    print('-' * 40, '%2d x %2d-char strings' % (len(n1strings), n1strings.m))
+                    nstrings = n1strings
+                    cache.add(nstrings, counts)
+                    exact_nstrings, intercept = update_exact_nstrings(nstrings, counts,
+                                                                      exact_nstrings, intercept)
+                    store.save(nstrings, counts)
+                    if doubling:
+                        validated[nstrings.m] = nstrings
+                # Adding documents does not make any longer strings valid
+                stored_lengths = stored.lengths()
+                if nstrings.m < stored_lengths[-1]:
+                    max_len = min(m for m in stored_lengths if m > nstrings.m) - 1
+                elif stored.is_complete(MAX_SUBSTRING_LEN):
+                    max_len = nstrings.m
+        if nstrings is not start_strings:
+            num_rounds += 1
+            yield num_rounds, nstrings, exact_nstrings, intercept
+
+    # n1strings must contain valid nstrings so the candidates are the strings whose
+    #  substrings of length len(nstrings[0]) are all in nstrings
+    try:
+        for n1strings in grow_strings(nstrings, get_valid, extend, max_len, doubling):
+            print('-' * 40, '%2d x %2d-char strings from %2d x %2d' % (len(n1strings),
+                  len(n1strings[0]), len(nstrings), len(nstrings[0])))
+            print(n1strings)
+
+            nstrings = n1strings
+            counts = counter.valid_counts()
+            cache.add(nstrings, counts)
+            exact_nstrings, intercept = update_exact_nstrings(nstrings, counts,
+                                                              exact_nstrings, intercept)
+            if doubling:
+                validated[nstrings.m] = nstrings
+            if store:
+                with metrics.phase('store'):
+                    store.save(nstrings, counts,
+                               counter.get_postings_map() if engine == 'index' else None)
+            if checkpoint is not None:
+                checkpoint.save(nstrings, counts, exact_nstrings, intercept)
+            num_rounds += 1
+            yield num_rounds, nstrings, exact_nstrings, intercept
+
+        # Doubling skips lengths that may have longer exactly repeated strings than the
+        #  validated lengths. The skipped lengths between each pair of validated lengths are
+        #  validated linearly, longest pair first, until no skipped length is longer than
+        #  the exact strings
+        lengths = sorted(validated)
+        for lo, hi in reversed(list(zip(lengths[:-1], lengths[1:]))):
+            if exact_nstrings and exact_nstrings.m >= hi:
+                break
+            for mstrings in grow_strings(validated[lo], get_valid, extend, hi - 1):
+                print('-' * 40, '%2d x %2d-char strings skipped by doubling' % (len(mstrings),
+                      mstrings.m))
+                mcounts = counter.valid_counts()
+                cache.add(mstrings, mcounts)
+                exact_nstrings, intercept = update_exact_nstrings(mstrings, mcounts,
+                                                                  exact_nstrings, intercept)
+                if store:
+                    with metrics.phase('store'):
+                        store.save(mstrings, mcounts)
+                if checkpoint is not None:
+                    checkpoint.save(nstrings, counts, exact_nstrings, intercept)
+                num_rounds += 1
+                yield num_rounds, nstrings, exact_nstrings, intercept
+    except SearchLimit as e:
+        print('-' * 40, 'Stopped: %s' % e)
+        if checkpoint is not None:
+            checkpoint.save(nstrings, counts, exact_nstrings, intercept, force=True)
+        return
+    if store:
+        store.set_complete(MAX_SUBSTRING_LEN)
+    if checkpoint is not None:
+        checkpoint.save(nstrings, counts, exact_nstrings, intercept, complete=True)
+
+def analyze(file_pattern, engine='count', jobs=1, growth='linear', index_dir=None,
+            metrics_path=None, memory_limit=None, patterns_path=None, time_limit=None,
+            max_candidates=None, checkpoint_path=None, resume=False, texts=None,
+            collapse=False):
+    """Find the longest strings that are repeated the number of times given by the names of
+        the files matching file_pattern
+            engine: one of ENGINES
+            jobs: number of processes that validate candidate strings
+            growth: one of GROWTH_MODES
+            index_dir: if not None, the valid strings of each round are stored in an
+                IndexStore in this directory and later runs on the same corpus start from
+                the deepest stored round. Their exact matches are looked for in the stored
+                rounds. If no rounds are stored for the corpus but some are stored for a
+                corpus of some of its documents, those rounds are re-validated against the
+                added documents only, reusing the stored counts of the other documents
+            metrics_path: if not None, the round and phase records described in metrics.py
+                are written to this file. The suffix engine has no rounds so only its
+                phases are written
+            memory_limit: if not None, rounds whose candidates would use more than this many
+                MB are generated and validated in slices whose valid strings are spilled
+                to disk. See spill.py
+            patterns_path: if not None, the longest exactly repeated strings and their
+                intercept, or the longest strings if none are exactly repeated, are
+                written to this pattern file for count_units.py
+            time_limit: if not None, the search stops after this many seconds and the best
+                strings found so far are reported
+            max_candidates: if not None, the search stops before it validates more than
+                this many candidates and the best strings found so far are reported
+            checkpoint_path: if not None, the state of the search is saved to this
+                checkpoint file as described in checkpoint.py
+            resume: continue from the last finished round saved in checkpoint_path. The
+                checkpoint must be of documents with the same contents
+            texts: if not None, {os.path.realpath(filename): text} of the files matching
+                file_pattern, which have already been loaded
+            collapse: collapse chains of shifted valid strings into maximal strings whose
+                substrings are counted without validating them. See collapse.py
+    """
+    round_options = [name for name, used in [('jobs', jobs > 1), ('index_dir', index_dir),
+                                              ('time_limit', time_limit is not None),
+                                              ('max_candidates', max_candidates is not None)]
+                     if used]
+    if round_options and engine not in ROUND_ENGINES:
+        raise ValueError('Engine "%s" cannot be used with %s. Engines are %s'
+                         % (engine, ', '.join(round_options), ROUND_ENGINES))
+    if growth == 'doubling' and engine not in DOUBLING_ENGINES:
+        raise ValueError('Engine "%s" cannot be used with doubling growth. Engines are %s'
+                         % (engine, DOUBLING_ENGINES))
+    if memory_limit is not None and engine not in SPILL_ENGINES:
+        raise ValueError('Engine "%s" cannot be used with a memory limit. Engines are %s'
+                         % (engine, SPILL_ENGINES))
+    if checkpoint_path is not None and engine not in CHECKPOINT_ENGINES:
+        raise ValueError('Engine "%s" cannot be checkpointed. Engines are %s'
+                         % (engine, CHECKPOINT_ENGINES))
+    if collapse and engine not in COLLAPSE_ENGINES:
+        raise ValueError('Engine "%s" cannot collapse chains. Engines are %s'
+                         % (engine, COLLAPSE_ENGINES))
+    if resume and checkpoint_path is None:
+        raise ValueError('A checkpoint file is needed to resume')
+
+    metrics = Metrics(metrics_path)
+    with metrics.phase('load'):
+        corpus = get_corpus(file_pattern, texts)
+        if not corpus:
+            metrics.close()
+            return
 
     for i, (filename, numrepeats, text) in enumerate(corpus):
         print('%40s, text = %5.1f mb, numrepeats = %6d, %3.3f mb/repeat'
               % (filename, MB(len(text)), numrepeats, MB(len(text) / numrepeats)))
+    metrics.add_run(file_pattern=file_pattern, engine=engine, jobs=jobs, growth=growth,
+                    memory_limit=memory_limit, collapse=collapse, num_docs=len(corpus),
+                    size=sum(len(text) for _, _, text in corpus))
+
+    if engine == 'suffix':
+        from suffix_array import get_repeats
+        with metrics.phase('validation'):
+            nstrings, exact_nstrings = get_repeats(corpus, MAX_SUBSTRING_LEN)
+        with metrics.phase('reporting'):
+            report(corpus, nstrings, exact_nstrings, CountCache(corpus))
+            if patterns_path:
+                save_markers(patterns_path, corpus, nstrings, exact_nstrings,
+                             CountCache(corpus))
+        report_metrics(metrics)
+        return
 
-    def sufficient(s):
-        """Return True if s is repeated numrepeats or more times in each test file"""
-        return all([text.count(s) >= numrepeats for _, numrepeats, text in corpus])
-
-    def exact_match(s, intercept):
-        """Return True if s is repeated numrepeats times in each test file"""
-        return all([text.count(s) == numrepeats + intercept for _, numrepeats, text in corpus])
-
-    def update_exact_nstrings(nstrings, exact_nstrings):
-        for i in range(20):
-            exact = [s for s in nstrings if exact_match(s, i)]
-            if exact:
-                exact_nstrings = exact
-                break
-        return exact_nstrings
-
-    def get_valid(base_strings):
-        """Return list of strings in base_strings that repeated a sufficient number of times
-            in the test file corpus
-            Also prints out some progress information
-        """
-        return [s for s in base_strings if sufficient(s)]
-
-    base_unistrings = [chr(i) for i in range(256)]
-    unistrings = get_valid(base_unistrings)
-    nstrings = unistrings
-    exact_nstrings = None
+    with metrics.phase('round 1'):
+        counter = make_counter(engine, corpus)
+        if jobs > 1:
+            from parallel import ParallelCounter
+            counter = ParallelCounter(counter, jobs, engine,
+                                      [filename for filename, _, _ in corpus])
+        if memory_limit is not None:
+            from spill import SpillingCounter
+            counter = SpillingCounter(counter, int(memory_limit * 1024 * 1024), len(corpus))
+        if collapse:
+            from collapse import CollapsingCounter
+            counter = CollapsingCounter(counter, corpus)
+    cache = CountCache(corpus)
+    deadline = None if time_limit is None else metrics.start[0] + time_limit
+    checkpoint = None
+    if checkpoint_path is not None:
+        from checkpoint import Checkpoint
+        from index_store import get_manifest
+        checkpoint = Checkpoint(checkpoint_path, get_manifest(corpus))
+
+    nstrings, exact_nstrings = CandidateSet(np.empty((0, 1), dtype=np.uint8)), None
+    for _, nstrings, exact_nstrings, _ in search(corpus, counter, cache, metrics, engine,
+                                                 growth, index_dir, deadline, max_candidates,
+                                                 checkpoint, resume):
+        pass
+
+    with metrics.phase('reporting'):
+        report(corpus, nstrings, exact_nstrings, cache)
+        if patterns_path:
+            save_markers(patterns_path, corpus, nstrings, exact_nstrings, cache)
+    # The spilled strings are read until the report is written
+    if jobs > 1 or memory_limit is not None or collapse:
+        counter.close()
+    report_metrics(metrics)
+
+
+def report_metrics(metrics):
+    """Write out the time spent in each phase of the run of Metrics metrics and close it"""
+    metrics.close()
+    print('=' * 80)
+    for line in metrics.phase_table():
+        print(line)
 
-    while True:
-        # n1strings must contain valid nstrings. There are two possible ways to
-        #  construct n1strings from nstrings
-        base_n1strings = set([s + c for s in nstrings for c in unistrings] +
-                             [c + s for s in nstrings for c in unistrings])
-        base_n1strings = [w for w in base_n1strings if w[1:] in nstrings and w[:-1] in nstrings]
-        # Filter down to the valid nstrings
-        n1strings = get_valid(base_n1strings)
-
-        # Stop when there are no n1strings
-        if not n1strings or len(n1strings[0]) > 500:
-            break
 
-        print('-' * 40, '%2d x %2d-char strings from %2d x %2d' % (len(n1strings),
-              len(n1strings[0]), len(nstrings), len(nstrings[0])))
-        print(n1strings)
+def save_markers(path, corpus, nstrings, exact_nstrings, cache):
+    """Write the markers that count_units.py counts to pattern file path. These are
+        exact_nstrings and their intercept, or nstrings with no intercept if no strings are
+        exactly repeated. The longest strings, nstrings, are recorded too
+    """
+    from count_units import save_patterns
+    if exact_nstrings:
+        intercept = cache.counts(exact_nstrings[0])[0] - corpus[0][1]
+        save_patterns(path, list(exact_nstrings), int(intercept), list(nstrings))
+    else:
+        save_patterns(path, list(nstrings), None, list(nstrings))
 
-        nstrings = n1strings
-        exact_nstrings = update_exact_nstrings(nstrings, exact_nstrings)
 
+def report(corpus, nstrings, exact_nstrings, cache):
+    """Write out the counts of the longest strings, nstrings, and the longest exactly
+        repeated strings, exact_nstrings, in each document in corpus
+        cache: CountCache of corpus that the counts are read from
+    """
     # Sort corpus to a nice order for viewing
-    corpus.sort(key=lambda x: (x[1], len(x[2])))
+    order = sorted(range(len(corpus)), key=lambda d: (corpus[d][1], len(corpus[d][2])))
     # Write out full counts
     for j, s in enumerate(nstrings):
         print('%2d %s %s' % (j, H(s), '-' * (60 - len(s))))
-        for i, (filename, numrepeats, text) in enumerate(corpus):
-            detected = text.count(s)
+        counts = cache.counts(s)
+        for i, d in enumerate(order):
+            filename, numrepeats, _ = corpus[d]
+            detected = counts[d]
             warning = ' ***' if detected != numrepeats else ''
             print('%2d: %40s, expected=%3d, detected=%3d %s' % (i, filename,
                   numrepeats, detected, warning))
 
     print('=' * 80)
     if exact_nstrings:
-        print('EXACT MATCHES. Length=%d. Intercept=%d' % (len(exact_nstrings[0]), i))
+        intercept = cache.counts(exact_nstrings[0])[0] - corpus[0][1]
+        print('EXACT MATCHES. Length=%d. Intercept=%d' % (len(exact_nstrings[0]), intercept))
         for j, s in enumerate(exact_nstrings):
             print('%2d %s %s' % (j, H(s), '-' * (60 - len(s))))
-            for i, (filename, numrepeats, text) in enumerate(corpus):
-                detected = text.count(s)
+            counts = cache.counts(s)
+            for i, d in enumerate(order):
+                filename, numrepeats, _ = corpus[d]
+                detected = counts[d]
                 warning = ' ***' if detected != numrepeats else ''
                 print('%2d: %40s, expected=%3d, detected=%3d %s' % (i, filename,
                       numrepeats, detected, warning))
 
 
 if __name__ == '__main__':
-    import sys
-    import time
-
-    if len(sys.argv) <= 1:
-        print('Usage: python %s <filename>' % sys.argv[0])
+    import optparse
+
+    parser = optparse.OptionParser('python %s [options] <file pattern>' % sys.argv[0])
+    parser.add_option('-e', '--engine', dest='engine', default='count', choices=ENGINES,
+                      help='Engine used to count strings: %s' % ', '.join(ENGINES))
+    parser.add_option('-j', '--jobs', dest='jobs', type=int, default=1,
+                      help='Number of processes used to validate strings')
+    parser.add_option('-g', '--growth', dest='growth', default='linear', choices=GROWTH_MODES,
+                      help='How candidate strings grow each round: %s' % ', '.join(GROWTH_MODES))
+    parser.add_option('-i', '--index-dir', dest='index_dir', default=None,
+                      help='Directory where the valid strings of each round are stored and '
+                           'resumed from')
+    parser.add_option('-m', '--metrics', dest='metrics_path', default=None,
+                      help='File that the performance records of each round are written to')
+    parser.add_option('-M', '--memory-limit', dest='memory_limit', type=float, default=None,
+                      help='MB of memory a round can use before its candidates are validated '
+                           'in slices spilled to disk')
+    parser.add_option('-p', '--patterns', dest='patterns_path', default=None,
+                      help='Pattern file that the markers for count_units.py are written to')
+    parser.add_option('-t', '--time-limit', dest='time_limit', type=float, default=None,
+                      help='Seconds after which the search stops and reports the best strings '
+                           'found so far')
+    parser.add_option('-c', '--max-candidates', dest='max_candidates', type=int, default=None,
+                      help='Number of candidates after which the search stops and reports the '
+                           'best strings found so far')
+    parser.add_option('-k', '--checkpoint', dest='checkpoint_path', default=None,
+                      help='File that the state of the search is checkpointed to')
+    parser.add_option('-r', '--resume', dest='resume', action='store_true', default=False,
+                      help='Continue from the last round saved in the checkpoint file')
+    parser.add_option('-C', '--collapse', dest='collapse', action='store_true', default=False,
+                      help='Count chains of shifted valid strings as maximal strings')
+
+    options, args = parser.parse_args()
+    if not args:
+        parser.print_help()
         exit()
-
-    start = time.clock()
-    analyze(sys.argv[1])
-    duration = time.clock() - start
+    if options.resume and not options.checkpoint_path:
+        parser.error('--resume needs a --checkpoint file')
+
+    start = time.time()
+    analyze(args[0], options.engine, options.jobs, options.growth, options.index_dir,
+            options.metrics_path, options.memory_limit, options.patterns_path,
+            options.time_limit, options.max_candidates, options.checkpoint_path,
+            options.resume, collapse=options.collapse)
+    duration = time.time() - start
     print('duration = %.1f' % duration)
@@ -1,34 +1,67 @@
 from __future__ import division, print_function
 import glob
+import multiprocessing
+import optparse
 import re
 import sys
+import numpy as np
+from candidates import get_extensions, grow_strings
+from histograms import get_byte_counts, get_bigram_counts
+from mapped_text import read_text, release_pages
+from parallel import get_shards, SHARDS_PER_JOB
 
 PATTERN = r'repeats=(\d+)'
 
-assert len(sys.argv) > 1, 'Usage: python %s <file pattern>' % sys.argv[0]
-file_pattern = sys.argv[1]
+parser = optparse.OptionParser('python %s [options] <file pattern>' % sys.argv[0])
+parser.add_option('-j', '--jobs', dest='jobs', type=int, default=1,
+                  help='Number of processes used to validate strings')
+parser.add_option('-g', '--growth', dest='growth', default='linear',
+                  choices=['linear', 'doubling'],
+                  help='How strings grow each round: linear (one byte) or doubling')
+options, args = parser.parse_args()
+assert args, parser.get_usage()
+file_pattern = args[0]
 files = [fn for fn in glob.glob(file_pattern) if re.search(PATTERN, fn)]
 assert files, r'No files in "%s" matching "%s"' % (file_pattern, PATTERN)
 
 # Each corpus element is (R, file contents) for file in file name repeats=<R>
-corpus = [(int(re.search(PATTERN, fn).group(1)), file(fn, 'rb').read()) for fn in files]
+# Large files are memory-mapped
+corpus = [(int(re.search(PATTERN, fn).group(1)), read_text(fn)) for fn in files]
 
 # Small repeat sizes should filter strings faster so move them to start of list
 corpus.sort(key=lambda x: -len(x[1]) / x[0])
 
 
-def valid(words):
+def valid_shard(words):
     return [w for w in words if all(text.count(w) >= n for (n, text) in corpus)]
 
+# Workers are forked after the corpus is read so they share it without copying
+pool = multiprocessing.Pool(options.jobs) if options.jobs > 1 else None
+
+
+def valid(words):
+    if not pool:
+        words = valid_shard(words)
+    else:
+        words = sum(pool.map(valid_shard, get_shards(words, options.jobs * SHARDS_PER_JOB)), [])
+    release_pages(text for (_, text) in corpus)
+    return words
+
+
+def valid_codes(counts):
+    """Return codes of strings whose counts[d][code] are >= R for all files"""
+    return np.flatnonzero((np.array(counts) >= [[n] for (n, _) in corpus]).all(axis=0))
+
 # words = strings that are repeated >= M times in file name repeats=<M>
-words = chars = valid([chr(i) for i in range(256)])
-while True:
-    words1 = set([w + c for w in words for c in chars] +
-                 [c + w for w in words for c in chars])
-    words1 = valid([w for w in words1 if w[1:] in words and w[:-1] in words])
-    if not words1:
-        break
-    words = words1
+# Strings of 1 and 2 bytes are counted in one pass over each file
+chars = [chr(b) for b in valid_codes([get_byte_counts(text) for (_, text) in corpus])]
+words2 = [chr(ab // 256) + chr(ab % 256)
+          for ab in valid_codes([get_bigram_counts(text) for (_, text) in corpus])]
+words = words2 or chars
+if words2:
+    for words in grow_strings(words2, valid, get_extensions, sys.maxsize,
+                              options.growth == 'doubling'):
+        pass
 
 
 # exact_words = strings that are repeated exactly R times in file name repeats=<R>
@@ -0,0 +1,94 @@
+"""
+    Single-byte and two-byte occurrence tables of documents
+
+    These replace the 256 str.count scans of each document for strings of length 1 and
+    the up to 65,536 scans for strings of length 2 with one vectorized pass per document.
+
+    The counts are the same as str.count(), i.e. non-overlapping counts.
+"""
+from __future__ import division, print_function
+import numpy as np
+
+# Number of bytes of a document that are counted at a time. np.bincount() makes an 8 byte
+# copy of each byte it counts
+BLOCK_SIZE = 1024 * 1024
+
+# bigram_counts[BIGRAM_XX[b]] is the count of chr(b) + chr(b)
+BIGRAM_XX = np.arange(256) * 257
+
+
+def get_byte_counts(text):
+    """Return array of number of occurrences of each byte in text"""
+    data = np.frombuffer(text, dtype=np.uint8)
+    counts = np.zeros(256, dtype=np.int64)
+    for start in range(0, len(data), BLOCK_SIZE):
+        counts += np.bincount(data[start:start + BLOCK_SIZE], minlength=256)
+    return counts
+
+
+def get_bigram_counts(text):
+    """Return array counts where counts[256 * a + b] is text.count(chr(a) + chr(b))"""
+    data = np.frombuffer(text, dtype=np.uint8)
+    counts = np.zeros(256 * 256, dtype=np.int64)
+    # Occurrences of chr(b) + chr(b) overlap in runs of b. str.count() counts
+    # run length // 2 of them in each run. A run of k equal byte pairs is a run of k + 1
+    # bytes. run_byte, run_pairs is the run of equal pairs at the end of the last block
+    xx_counts = np.zeros(256, dtype=np.int64)
+    run_byte, run_pairs = 0, 0
+    for start in range(0, len(data) - 1, BLOCK_SIZE):
+        block = data[start:start + BLOCK_SIZE + 1]
+        pairs = (block[:-1].astype(np.uint16) << 8) | block[1:]
+        counts += np.bincount(pairs, minlength=256 * 256)
+        del pairs
+
+        # The block's pairs are in segments of equal and unequal pairs
+        same = block[1:] == block[:-1]
+        bounds = np.concatenate(([0], np.flatnonzero(same[1:] != same[:-1]) + 1, [len(same)]))
+        is_run = same[bounds[:-1]]
+        run_starts = bounds[:-1][is_run]
+        lengths = bounds[1:][is_run] - run_starts
+        run_bytes = block[run_starts]
+        at_end = len(run_starts) and run_starts[-1] + lengths[-1] == len(same)
+        del same, bounds
+        if run_pairs and len(run_starts) and run_starts[0] == 0:
+            lengths[0] += run_pairs
+        elif run_pairs:
+            xx_counts[run_byte] += (run_pairs + 1) // 2
+        run_pairs = 0
+        if at_end:
+            run_byte, run_pairs = run_bytes[-1], lengths[-1]
+            run_bytes, lengths = run_bytes[:-1], lengths[:-1]
+        xx_counts += np.bincount(run_bytes, weights=(lengths + 1) // 2,
+                                 minlength=256).astype(np.int64)
+    if run_pairs:
+        xx_counts[run_byte] += (run_pairs + 1) // 2
+    counts[BIGRAM_XX] = xx_counts
+    return counts
+
+
+def get_code(s):
+    """Return index of string s of length 1 or 2 in the arrays returned by
+        get_byte_counts() and get_bigram_counts()
+    """
+    return ord(s) if len(s) == 1 else 256 * ord(s[0]) + ord(s[1])
+
+
+def get_codes(matrix):
+    """Return array of get_code() of the strings of length 1 or 2 in the rows of uint8
+        array matrix
+    """
+    if matrix.shape[1] == 1:
+        return matrix[:, 0].astype(np.int64)
+    return 256 * matrix[:, 0].astype(np.int64) + matrix[:, 1]
+
+
+def get_suffix_byte_counts(text, block_size):
+    """Return array counts where counts[b] is get_byte_counts(text[b * block_size:]) for
+        each block b of text and the empty suffix after the last block
+    """
+    data = np.frombuffer(text, dtype=np.uint8)
+    num_blocks = -(-len(data) // block_size)
+    counts = np.zeros((num_blocks + 1, 256), dtype=np.int64)
+    for b in range(num_blocks):
+        counts[b] = np.bincount(data[b * block_size:(b + 1) * block_size], minlength=256)
+    return np.cumsum(counts[::-1], axis=0)[::-1]
@@ -0,0 +1,250 @@
+"""
+    Persistent store of the valid strings of each round of find_repeats.analyze()
+
+    The valid strings of a corpus depend only on the contents of its documents and their
+    numbers of repeats so a run can start from the deepest round that an earlier run on
+    the same corpus stored.
+
+    Each corpus has a directory named by a hash of the content hashes and numbers of
+    repeats of its documents. The directory holds a .npy file per array of each round m
+        strings_<m>.npy: uint8 array of the valid strings of length m, one per row
+        counts_<m>.npy: counts[i, j] is the non-overlapping count of string i in document j
+        offsets_<m>_<j>.npy, starts_<m>_<j>.npy: postings of the strings in document j for
+            the index engine. offsets[starts[i]:starts[i + 1]] are the sorted offsets of
+            string i, as in InvertedIndex._postings_map
+    corpus.json lists the documents in the order they are numbered in the store. This need
+    not be the order of the corpus in a later run.
+    Arrays are memory-mapped when they are loaded so they are read from disk as they are
+    used.
+
+    Adding documents to a corpus can only remove valid strings, so the valid strings of
+    a corpus with added documents are the stored valid strings of the original corpus
+    that are repeated enough times in the added documents. get_added_rounds() finds
+    these by counting the stored strings in the added documents only.
+"""
+from __future__ import division, print_function
+import hashlib
+import json
+import os
+import numpy as np
+from candidates import CandidateSet
+
+# Number of bytes of a document that are hashed at a time
+HASH_BLOCK_SIZE = 16 * 1024 * 1024
+
+
+def get_content_hash(text):
+    """Return SHA-1 hex digest of the bytes of document text"""
+    h = hashlib.sha1()
+    for start in range(0, len(text), HASH_BLOCK_SIZE):
+        h.update(text[start:start + HASH_BLOCK_SIZE])
+    return h.hexdigest()
+
+
+def get_manifest(corpus):
+    """Return list of {'filename', 'numrepeats', 'sha1'} for the documents of corpus, a list
+        of (filename, numrepeats, text)
+    """
+    return [{'filename': filename, 'numrepeats': numrepeats, 'sha1': get_content_hash(text)}
+            for filename, numrepeats, text in corpus]
+
+
+def get_doc_keys(manifest):
+    """Return list of the keys that identify the documents of manifest for their valid
+        strings. Documents are identified by their contents so renamed files have the
+        same key
+    """
+    return ['%s %d' % (doc['sha1'], doc['numrepeats']) for doc in manifest]
+
+
+def get_corpus_key(manifest):
+    """Return key that identifies the valid strings of the corpus of manifest"""
+    h = hashlib.sha1()
+    for key in sorted(get_doc_keys(manifest)):
+        h.update(key + '\n')
+    return h.hexdigest()
+
+
+def get_doc_order(manifest, corpus_manifest):
+    """Return list order where order[j] is the index in corpus_manifest of document j of
+        manifest, matching documents by get_doc_keys(), or None if some document of
+        manifest is not in corpus_manifest
+    """
+    indexes = {}
+    for d, key in enumerate(get_doc_keys(corpus_manifest)):
+        indexes.setdefault(key, []).append(d)
+    order = []
+    for key in get_doc_keys(manifest):
+        if not indexes.get(key):
+            return None
+        order.append(indexes[key].pop(0))
+    return order
+
+
+def save_array(path, array):
+    """Write array to .npy file path so that path is never partly written"""
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        np.save(f, np.asarray(array))
+    os.rename(temp_path, path)
+
+
+class IndexStore(object):
+    """The rounds stored for a corpus in directory path
+        Counts and postings are loaded and saved in the order of the corpus that the store
+        was opened for
+    """
+
+    def __init__(self, path, corpus_manifest):
+        """corpus_manifest: get_manifest() of the corpus. The store's documents must be the
+            documents of the corpus
+        """
+        self.path = path
+        manifest_path = os.path.join(path, 'corpus.json')
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'rt') as f:
+                self.manifest = json.load(f)
+        else:
+            if not os.path.exists(path):
+                os.makedirs(path)
+            self.manifest = corpus_manifest
+            with open(manifest_path, 'wt') as f:
+                json.dump(self.manifest, f, indent=4)
+        self.num_docs = len(self.manifest)
+        # order[j] is the index in the corpus of stored document j
+        self.order = get_doc_order(self.manifest, corpus_manifest)
+        assert self.order is not None and self.num_docs == len(corpus_manifest), path
+
+    @classmethod
+    def create(cls, directory, corpus_manifest):
+        """Return the IndexStore of the corpus of corpus_manifest in `directory`. Its rounds
+            are those stored by earlier runs on the corpus
+        """
+        return cls(os.path.join(directory, get_corpus_key(corpus_manifest)), corpus_manifest)
+
+    def _file(self, name, m, j=None):
+        if j is None:
+            return os.path.join(self.path, '%s_%d.npy' % (name, m))
+        return os.path.join(self.path, '%s_%d_%d.npy' % (name, m, j))
+
+    def lengths(self, postings=False):
+        """Return sorted list of lengths of the stored rounds
+            postings: only return rounds whose postings are stored
+        """
+        names = os.listdir(self.path)
+        lengths = sorted(int(name[len('counts_'):-len('.npy')]) for name in names
+                         if name.startswith('counts_') and name.endswith('.npy'))
+        if postings:
+            lengths = [m for m in lengths
+                       if all(os.path.exists(self._file('starts', m, j))
+                              for j in range(self.num_docs))]
+        return lengths
+
+    def set_complete(self, max_len):
+        """Record that all the valid strings up to max_len bytes long are stored"""
+        with open(os.path.join(self.path, 'complete.json'), 'wt') as f:
+            json.dump({'max_len': max_len}, f)
+
+    def is_complete(self, max_len):
+        """Return True if all the valid strings up to max_len bytes long are stored"""
+        complete_path = os.path.join(self.path, 'complete.json')
+        if not os.path.exists(complete_path):
+            return False
+        with open(complete_path, 'rt') as f:
+            stored_max_len = json.load(f)['max_len']
+        lengths = self.lengths()
+        # A run that stopped before its max_len found no longer valid strings
+        return max_len <= stored_max_len or bool(lengths and lengths[-1] < stored_max_len)
+
+    def save(self, strings, counts, postings_map=None):
+        """Store round of CandidateSet strings with array counts where counts[i, d] is the
+            count of strings[i] in document d
+            postings_map: {s: list of offsets of s in each document} for the strings
+        """
+        m = strings.m
+        if postings_map is not None:
+            for j, d in enumerate(self.order):
+                offsets_list = [postings_map[s][d] for s in strings]
+                starts = np.cumsum([0] + [len(offsets) for offsets in offsets_list])
+                offsets = (np.concatenate(offsets_list) if offsets_list
+                           else np.empty(0, dtype=np.uint32))
+                save_array(self._file('offsets', m, j), offsets)
+                save_array(self._file('starts', m, j), starts)
+        save_array(self._file('strings', m), strings.matrix)
+        # counts is written last as lengths() looks for it
+        save_array(self._file('counts', m), np.asarray(counts)[:, self.order])
+
+    def load(self, m):
+        """Return CandidateSet strings, array counts of stored round m"""
+        strings = CandidateSet(np.load(self._file('strings', m), mmap_mode='r'))
+        counts = np.load(self._file('counts', m), mmap_mode='r')
+        if self.order != list(range(self.num_docs)):
+            counts = counts[:, np.argsort(self.order)]
+        return strings, counts
+
+    def load_postings(self, m):
+        """Return {s: list of offsets of s in each document} for the strings of stored
+            round m
+        """
+        strings, _ = self.load(m)
+        postings = [(np.load(self._file('offsets', m, j), mmap_mode='r'),
+                     np.load(self._file('starts', m, j)))
+                    for j in np.argsort(self.order)]
+        return {s: [offsets[starts[i]:starts[i + 1]] for offsets, starts in postings]
+                for i, s in enumerate(strings)}
+
+
+def find_subset_store(directory, corpus_manifest):
+    """Return stored, order for the corpus stored in `directory` with the most documents
+        that are all in the corpus of corpus_manifest, and some but not all of them, or
+        None if there is none
+            stored: IndexStore of the stored corpus
+            order: order[j] is the index in the corpus of document j of the stored corpus
+    """
+    if not os.path.isdir(directory):
+        return None
+    best = None
+    for name in os.listdir(directory):
+        manifest_path = os.path.join(directory, name, 'corpus.json')
+        if not os.path.exists(manifest_path):
+            continue
+        with open(manifest_path, 'rt') as f:
+            manifest = json.load(f)
+        if len(manifest) >= len(corpus_manifest) or (best and len(manifest) <= len(best[1])):
+            continue
+        order = get_doc_order(manifest, corpus_manifest)
+        if order is None:
+            continue
+        stored = IndexStore(os.path.join(directory, name), manifest)
+        if stored.lengths():
+            best = stored, order
+    return best
+
+
+def get_added_rounds(stored, order, num_docs, counter):
+    """Generate strings, counts for the rounds of IndexStore stored for a corpus of
+        num_docs documents that are its documents and some added documents
+            strings: CandidateSet of the valid strings of length m of the corpus
+            counts: counts[i, d] is the count of strings[i] in document d of the corpus
+        order: order[j] is the index in the corpus of document j of stored
+        counter: counter of the added documents, in their order in the corpus
+        The stored counts are reused and only the added documents are counted
+    """
+    added = sorted(set(range(num_docs)) - set(order))
+    last = None
+    for m in stored.lengths():
+        strings, stored_counts = stored.load(m)
+        # The substrings of the valid strings of length m in the last round must be valid
+        keep = np.arange(len(strings))
+        if last is not None and last.m == m - 1:
+            keep = np.flatnonzero((last.indexes(strings.matrix[:, 1:]) >= 0) &
+                                  (last.indexes(strings.matrix[:, :-1]) >= 0))
+        strings = strings.take(keep)
+        valid_strings = counter.valid(strings)
+        if not valid_strings:
+            return
+        counts = np.empty((len(valid_strings), num_docs), dtype=np.int64)
+        counts[:, order] = stored_counts[keep[strings.indexes(valid_strings.matrix)]]
+        counts[:, added] = counter.valid_counts()
+        yield valid_strings, counts
+        last = valid_strings
@@ -0,0 +1,169 @@
+"""
+    Python/NumPy version of the inverted index in repeats/inverted_index.cpp
+
+    Use an inverted index to find the longest substring(s) that is repeated
+    a specified number of times in a corpus of documents.
+
+    inverted_index._postings_map[s][d] is a sorted NumPy array of the offsets
+    of substring s in document number d
+
+    Documentation in https://github.com/peterwilliams97/repeats
+"""
+from __future__ import division, print_function
+import numpy as np
+
+
+def get_offset_type(size):
+    """Return the smallest NumPy type that can hold offsets into a document of `size` bytes"""
+    return np.uint32 if size < 2 ** 32 else np.uint64
+
+
+def get_byte_offsets(text):
+    """Return dict {b: sorted offsets of byte b in text} for all bytes b in text
+        This is the inverted index of strings of length 1 and is built in one pass
+    """
+    data = np.frombuffer(text, dtype=np.uint8)
+    counts = np.bincount(data, minlength=256)
+    # A stable sort keeps the offsets of each byte in increasing order
+    order = np.argsort(data, kind='mergesort').astype(get_offset_type(len(data)))
+    ends = np.cumsum(counts)
+    return {chr(b): order[ends[b] - counts[b]:ends[b]] for b in range(256) if counts[b]}
+
+
+def get_sb_offsets(strings, m, bytes):
+    """Return ordered array of offsets of strings s+b in a document where
+            strings is ordered array of offsets of strings s in document
+            bytes is ordered array of offsets of strings b in document
+            m is length of s
+
+        THIS IS THE INNER LOOP
+
+        This is the vectorized equivalent of the merge in get_sb_offsets() in
+        inverted_index.cpp. Each s offset is binary searched in the byte offsets
+        which is the INNER_LOOP == 4 case.
+    """
+    if not len(strings) or not len(bytes):
+        return strings[:0]
+    ends = strings + m
+    idx = np.searchsorted(bytes, ends)
+    np.minimum(idx, len(bytes) - 1, out=idx)
+    return strings[bytes[idx] == ends]
+
+
+def get_non_overlapping_count(offsets, m):
+    """Return number of non-overlapping length `m` strings starting at sorted `offsets`
+        This is the count str.count() returns: leftmost match first, then the next
+        match that starts after it ends, and so on
+    """
+    n = len(offsets)
+    if n < 2 or np.diff(offsets).min() >= m:
+        return n
+    # Some occurrences overlap so the count is the number of jumps from the first
+    # occurrence to the end, where each occurrence jumps to the next occurrence that starts
+    # after it ends. The jumps are doubled until the first occurrence reaches the end so
+    # this takes O(n log count) vectorized steps
+    jumps = np.append(np.searchsorted(offsets, offsets + m), n)
+    counts = np.ones(n + 1, dtype=np.int64)
+    counts[n] = 0
+    while jumps[0] < n:
+        counts += counts[jumps]
+        jumps = jumps[jumps]
+    return int(counts[0])
+
+
+class InvertedIndex(object):
+    """An InvertedIndex is a map of postings of a set of terms across all documents
+        in a corpus.
+
+        _postings_map[term][d] stores all the offsets of term in document d
+        _bytes_map[b][d] stores all the offsets of byte b in document d
+
+        Typical usage is to construct an initial InvertedIndex whose terms are all
+        bytes that occur in the corpus then to replace these with each string that
+        occurs in the corpus. This is done bottom-up, replacing _postings_map[s] with
+        _postings_map[s+b] for all bytes b to get from terms of length m to terms of
+        length m+1
+    """
+
+    def __init__(self, corpus):
+        """corpus is a list of (filename, numrepeats, text)"""
+        self._nums = [numrepeats for _, numrepeats, _ in corpus]
+        self._bytes_map = {}
+        for d, (_, numrepeats, text) in enumerate(corpus):
+            term_offsets = get_byte_offsets(text)
+            # Only keep bytes that occur sufficient numbers of times in all documents
+            allowed = [b for b, offsets in term_offsets.items() if len(offsets) >= numrepeats]
+            if d == 0:
+                self._bytes_map = {b: [term_offsets[b]] for b in allowed}
+            else:
+                self._bytes_map = {b: self._bytes_map[b] + [term_offsets[b]]
+                                   for b in allowed if b in self._bytes_map}
+        self._postings_map = dict(self._bytes_map)
+        self._valid = []
+
+    def get_sb_postings(self, s, b):
+        """Return postings for s + b if s + b exists sufficient numbers of times in each
+            document, otherwise None
+            s must be in _postings_map
+        """
+        m = len(s)
+        s_postings = self._postings_map[s]
+        b_postings = self._bytes_map[b]
+        sb_postings = []
+        for strings, bytes, num in zip(s_postings, b_postings, self._nums):
+            sb_offsets = get_sb_offsets(strings, m, bytes)
+            # Only count non-overlapping offsets when checking validity. See
+            # get_sb_postings() in inverted_index.cpp
+            if get_non_overlapping_count(sb_offsets, m + 1) < num:
+                return None
+            sb_postings.append(sb_offsets)
+        return sb_postings
+
+    def valid(self, strings):
+        """Return CandidateSet of the strings in CandidateSet `strings` that are repeated a
+            sufficient number of times in the corpus and make them the terms of the
+            inverted index.
+            If the strings are longer than 1 byte they must start with a term of the
+            inverted index
+        """
+        if strings.m == 1:
+            indexes = [i for i, b in enumerate(strings) if b in self._bytes_map]
+            postings_map = {b: self._bytes_map[b] for b in strings.take(indexes)}
+        else:
+            indexes = []
+            postings_map = {}
+            for i, w in enumerate(strings):
+                if w[-1] not in self._bytes_map:
+                    continue
+                postings = self.get_sb_postings(w[:-1], w[-1])
+                if postings is not None:
+                    postings_map[w] = postings
+                    indexes.append(i)
+        self._valid = strings.take(np.array(indexes, dtype=np.int64))
+        # Keep the last terms if nothing is valid so that their counts can still be read
+        if indexes:
+            self._postings_map = postings_map
+        return self._valid
+
+    def counts(self, s):
+        """Return list of number of non-overlapping occurrences of term s in each document"""
+        return [get_non_overlapping_count(offsets, len(s)) for offsets in self._postings_map[s]]
+
+    def get_postings_map(self):
+        """Return {term: list of offsets of term in each document} for the terms of the
+            inverted index
+        """
+        return self._postings_map
+
+    def set_terms(self, postings_map):
+        """Make the strings in postings_map, {s: list of offsets of s in each document},
+            the terms of the inverted index
+        """
+        self._postings_map = postings_map
+
+    def valid_counts(self):
+        """Return array counts where counts[i, d] is the number of occurrences of string i
+            returned by the last call to valid() in document d
+        """
+        counts = np.array([self.counts(s) for s in self._valid], dtype=np.int64)
+        return counts.reshape(len(self._valid), len(self._nums))
@@ -0,0 +1,200 @@
+"""
+    Count all the candidate strings of length m in a document in one pass
+
+    Every m-byte window of a document is converted to a 64 bit key
+        m <= PACK_LEN: the bytes of the window packed into the key, so keys are exact
+        m > PACK_LEN: a polynomial rolling hash of the window, so windows whose hash
+            matches a candidate's are compared with the candidate byte by byte
+    The window keys are binary searched in the sorted candidate keys so each round costs
+    O(n log(number of candidates)) per document regardless of the number of candidates.
+
+    Counts are non-overlapping like str.count()
+"""
+from __future__ import division, print_function
+import numpy as np
+from inverted_index import get_non_overlapping_count
+
+# Longest window that is packed exactly into a 64 bit key
+PACK_LEN = 8
+
+# Number of windows whose keys are computed at a time
+BLOCK_SIZE = 4 * 1024 * 1024
+
+MASK64 = 2 ** 64 - 1
+# Odd so that it has an inverse mod 2^64
+HASH_BASE = 0x9E3779B97F4A7C15
+
+
+def _inverse64(a):
+    """Return inverse of odd a mod 2^64 by Newton's iteration"""
+    x = a
+    for _ in range(6):
+        x = (x * (2 - a * x)) & MASK64
+    return x
+
+HASH_BASE_INV = _inverse64(HASH_BASE)
+
+
+def get_powers(base, n):
+    """Return array of base ** i mod 2^64 for i in 0..n-1"""
+    powers = np.empty(n, dtype=np.uint64)
+    powers[0] = 1
+    powers[1:] = base
+    return np.cumprod(powers, dtype=np.uint64)
+
+
+def get_window_keys(data, m):
+    """Return keys of all m-byte windows of uint8 array data"""
+    n = len(data) - m + 1
+    if m <= PACK_LEN:
+        keys = np.zeros(n, dtype=np.uint64)
+        for j in range(m):
+            keys <<= np.uint64(8)
+            keys |= data[j:j + n]
+        return keys
+
+    # hash(i) = sum(data[i + j] * B^(m - 1 - j)) = (S[i + m] - S[i]) * B^(i + m - 1)
+    #  where S[k] = sum(data[:k] * B^-k)
+    # The hash of a window does not depend on where data starts
+    sums = np.zeros(len(data) + 1, dtype=np.uint64)
+    np.cumsum(data.astype(np.uint64) * get_powers(HASH_BASE_INV, len(data)), out=sums[1:])
+    return (sums[m:] - sums[:-m]) * get_powers(HASH_BASE, len(data))[m - 1:]
+
+
+def get_string_keys(matrix):
+    """Return keys of the strings in the rows of uint8 array matrix as computed by
+        get_window_keys()
+    """
+    m = matrix.shape[1]
+    keys = np.zeros(matrix.shape[0], dtype=np.uint64)
+    for j in range(m):
+        if m <= PACK_LEN:
+            keys <<= np.uint64(8)
+        else:
+            keys *= np.uint64(HASH_BASE)
+        keys += matrix[:, j]
+    return keys
+
+
+def get_matches(text, matrix):
+    """Return pos, idx, shared for the occurrences in text of the strings in the rows of
+        uint8 array matrix
+            pos: increasing offsets of the occurrences
+            idx: idx[i] is the index of the string that occurs at pos[i]
+            shared: indexes of the strings whose keys are the same as another string's.
+                Their occurrences in pos, idx are not reliable
+    """
+    num_strings, m = matrix.shape
+    data = np.frombuffer(text, dtype=np.uint8)
+    if len(data) < m or not num_strings:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), []
+
+    keys = get_string_keys(matrix)
+    order = np.argsort(keys)
+    sorted_keys = keys[order]
+
+    # Find the windows whose keys are candidate keys. idx is the candidate index of
+    # each of these windows
+    positions, indexes = [], []
+    num_windows = len(data) - m + 1
+    for start in range(0, num_windows, BLOCK_SIZE):
+        stop = min(start + BLOCK_SIZE, num_windows)
+        window_keys = get_window_keys(data[start:stop + m - 1], m)
+        j = np.searchsorted(sorted_keys, window_keys)
+        np.minimum(j, num_strings - 1, out=j)
+        hit = sorted_keys[j] == window_keys
+        positions.append(np.flatnonzero(hit) + start)
+        indexes.append(order[j[hit]])
+    pos = np.concatenate(positions)
+    idx = np.concatenate(indexes)
+
+    if m > PACK_LEN:
+        # Hashes can collide so check the matching windows byte by byte. Candidates with
+        # the same hash share their windows
+        same = np.flatnonzero(sorted_keys[1:] == sorted_keys[:-1])
+        shared = np.union1d(order[same], order[same + 1])
+        ok = np.ones(len(pos), dtype=bool)
+        for j in range(m):
+            ok &= data[pos + j] == matrix[idx, j]
+        pos, idx = pos[ok], idx[ok]
+    else:
+        shared = []
+    return pos, idx, shared
+
+
+def get_counts(text, matrix):
+    """Return array of non-overlapping counts in text of the strings in the rows of uint8
+        array matrix
+    """
+    num_strings, m = matrix.shape
+    pos, idx, shared = get_matches(text, matrix)
+    counts = get_match_counts(idx, pos, m, num_strings)
+    for i in shared:
+        counts[i] = text.count(matrix[i].tostring())
+    return counts
+
+
+def get_match_counts(idx, pos, m, num_strings):
+    """Return array of non-overlapping counts of strings 0..num_strings-1 of length m
+        where the string with index idx[i] occurs at offset pos[i]
+        pos must be increasing
+    """
+    counts = np.bincount(idx, minlength=num_strings)
+
+    # Occurrences of a string can only overlap if they are less than m bytes apart.
+    # These are the only counts that need to be corrected to non-overlapping counts
+    grouped = np.argsort(idx, kind='mergesort')
+    idx, pos = idx[grouped], pos[grouped]
+    close = (idx[1:] == idx[:-1]) & (np.diff(pos) < m)
+    for i in np.unique(idx[1:][close]):
+        lo, hi = np.searchsorted(idx, [i, i + 1])
+        counts[i] = get_non_overlapping_count(pos[lo:hi], m)
+    return counts
+
+
+class KmerCounter(object):
+    """Counts candidate strings of length m in each document of a corpus by counting the
+        keys of all m-byte windows of the document
+        Subclasses count with other get_counts(text, matrix) functions
+    """
+    get_counts = staticmethod(get_counts)
+
+    # All candidates are counted in one scan of a document
+    SHARD_CANDIDATES = False
+
+    def __init__(self, corpus):
+        """corpus is a list of (filename, numrepeats, text)"""
+        self.corpus = list(corpus)
+        self._valid_counts = None
+        # Number of bytes scanned in each document in the last call to valid()
+        self.bytes_scanned = np.zeros(len(self.corpus), dtype=np.int64)
+
+    def valid(self, strings):
+        """Return CandidateSet of the strings in CandidateSet `strings` that are repeated a
+            sufficient number of times in the test file corpus
+        """
+        matrix = strings.matrix
+        counts = np.zeros((len(self.corpus), len(strings)), dtype=np.int64)
+        alive = np.arange(len(strings))
+        self.bytes_scanned = np.zeros(len(self.corpus), dtype=np.int64)
+        for d, (_, numrepeats, text) in enumerate(self.corpus):
+            counts[d, alive] = self.get_counts(text, matrix[alive])
+            self.bytes_scanned[d] = len(text)
+            alive = alive[counts[d, alive] >= numrepeats]
+            if not len(alive):
+                break
+
+        self._valid_counts = counts[:, alive].T
+        return strings.take(alive)
+
+    def get_text_counts(self, text, strings):
+        """Return array of number of occurrences of each string in CandidateSet `strings` in
+            text
+        """
+        return self.get_counts(text, strings.matrix)
+
+    def valid_counts(self):
+        """Return array counts where counts[i, d] is the number of occurrences of string i
+            returned by the last call to valid() in document d
+        """
+        return self._valid_counts
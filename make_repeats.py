@@ -7,6 +7,7 @@ from __future__ import division, print_function
 import random
 import os
 import sys
+import numpy as np
 
 
 def make_random_string(size):
@@ -57,180 +58,284 @@ def make_payload():
 def make_random_lists(size, num_unique, gap):
     """Make `num_unique` random lists of sufficient size to fill a string of
         `size` bytes
+        Returns a num_unique x unique_size uint8 array whose rows are the lists. Its
+        seed is drawn from `random` so the lists are reproducible from random.seed()
     """
     unique_size = len(REPEATED_STRING) // 4 - gap
-
-    def make_list():
-        return [random.randint(0, 255) for _ in range(unique_size)]
-
-    return [make_list() for _ in range(num_unique)]
+    rng = np.random.RandomState(random.randint(0, MAX_SEED))
+    return rng.randint(0, 256, size=(num_unique, unique_size)).astype(np.uint8)
 
 # Gap between unique strings
 JOIN_SIZE = 5
 
+# Largest seed of a numpy RandomState
+MAX_SEED = 2 ** 32 - 1
 
-def make_repeats(size, num_repeats, method, num_unique, random_lists):
-    """Make a string of length `size` containing REPEATED_STRING
-        `num_repeats` times, and other data to test the repeated
-        string finding code.
-        `method` sets the difficulty of string finding
-            0: All bytes the same. Worst case for some string finding algos
-            1: Random bytes of all bytes value. Worst case for other string
-                finding algos
+# Number of bytes generated at a time
+BLOCK_SIZE = 16 * 1024 * 1024
+
+
+def get_heading():
+    """Return the heading written at the start of each document"""
+    return 'THIS IS A FILE FOR TESTING FINDING REPEATED STRINGS\n' + ' '.join(sys.argv) + '\n'
+
+
+def get_be_bytes(r):
+    """Return n x 4 array of the bytes of the numbers in array r, most significant first,
+        as written by the methods that write numbers
+    """
+    return np.column_stack([(r // 0x1000000) % 0xff, (r // 0x10000) % 0xff,
+                            (r // 0x100) % 0xff, r % 0xff])
+
+
+def get_groups(size, num_repeats, method, num_unique, random_lists):
+    """Return group_size, num_groups, make_groups, patches for document made by `method`
+        The document is num_groups groups of group_size bytes
+            make_groups(rng, i0, i1): returns (i1 - i0) x group_size array of groups i0..i1-1
+                Random groups are drawn from rng so groups must be made in order
+            patches: list of (offset, string) that overwrite the document at offset
     """
     repeat_size = size // num_repeats
-    data = []
+    patches = []
+
+    def randint(rng, lo, hi, n):
+        # Bytes lo..hi-1
+        return rng.randint(lo, hi, size=n)
 
     if method == 0:
         # All bytes same
         X = ord(' ')  # ord('')
-        data = [X for _ in xrange(size)]
+        return 1, size, lambda rng, i0, i1: np.full((i1 - i0, 1), X, dtype=np.uint8), patches
 
     elif method == 1:
         # Random bytes
-        data = [random.randint(0, 255) for _ in xrange(size)]
+        return 1, size, lambda rng, i0, i1: randint(rng, 0, 256, (i1 - i0, 1)), patches
 
     elif method == 2:
         # Maximize number of strings that are repeated num_repeats times
         # Also many repeats of 2 and 3 bytes strings
-        for r in xrange(repeat_size // 4):
-            for _ in xrange(num_repeats):
-                data.append((r // 0x1000000) % 0xff)
-                data.append((r // 0x10000) % 0xff)
-                data.append((r // 0x100) % 0xff)
-                data.append(r % 0xff)
+        return (4, (repeat_size // 4) * num_repeats,
+                lambda rng, i0, i1: get_be_bytes(np.arange(i0, i1) // num_repeats), patches)
 
     elif method == 3:
         # num_unique unique strings ordered
-        for i in range(size // 4):
-            r = i % num_unique
-            data.append((r // 0x1000000) % 0xff)
-            data.append((r // 0x10000) % 0xff)
-            data.append((r // 0x100) % 0xff)
-            data.append(r % 0xff)
+        return (4, size // 4, lambda rng, i0, i1: get_be_bytes(np.arange(i0, i1) % num_unique),
+                patches)
 
     elif method == 4:
         # num_unique unique strings unordered
-        for _ in xrange(size // 4):
-            r = random.randint(1, num_unique)
-            data.append((r // 0x1000000) % 0xff)
-            data.append((r // 0x10000) % 0xff)
-            data.append((r // 0x100) % 0xff)
-            data.append(r % 0xff)
+        return (4, size // 4,
+                lambda rng, i0, i1: get_be_bytes(randint(rng, 1, num_unique + 1, i1 - i0)),
+                patches)
 
     elif method == 5:
         # num_unique truly unique strings
         assert num_unique == len(random_lists)
-        unique_size = len(random_lists[0])
-        for _ in range(size // unique_size):
-            data += random_lists[random.randint(0, num_unique - 1)]
+        unique_size = random_lists.shape[1]
+        return (unique_size, size // unique_size,
+                lambda rng, i0, i1: random_lists[randint(rng, 0, num_unique, i1 - i0)],
+                patches)
 
     elif method == 6:
         # Like 5 but no repeated string constructed from
         #  adjoining unique strings
         # num_unique truly unique strings
         assert num_unique == len(random_lists)
-        unique_size = len(random_lists[0])
-        for _ in range(size // (unique_size + JOIN_SIZE)):
-            data += random_lists[random.randint(0, num_unique - 1)] + get_random_list(JOIN_SIZE)
-        assert len(data) <= size, 'data=%d, size=%d' % (len(data), size)
+        unique_size = random_lists.shape[1]
+
+        def make_groups(rng, i0, i1):
+            lists = random_lists[randint(rng, 0, num_unique, i1 - i0)]
+            return np.hstack([lists, randint(rng, ord('0'), ord('9') + 1, (i1 - i0, JOIN_SIZE))])
+
+        return unique_size + JOIN_SIZE, size // (unique_size + JOIN_SIZE), make_groups, patches
 
     elif method == 11:
         # Random letters
-        for _ in range(size):
-            data.append(random.randint(ord('a'), ord('z')))
+        return 1, size, lambda rng, i0, i1: randint(rng, ord('a'), ord('z') + 1, (i1 - i0, 1)), \
+            patches
 
     elif method == 12:
         # All variants of '[a-z][A-Z]\d.'
-        for _ in range(size // 4):
-            data.append(random.randint(ord('a'), ord('z')))
-            data.append(random.randint(ord('A'), ord('Z')))
-            data.append(random.randint(ord('0'), ord('9')))
-            data.append(random.randint(0, 255))
+        ranges = [(ord('a'), ord('z') + 1), (ord('A'), ord('Z') + 1), (ord('0'), ord('9') + 1),
+                  (0, 256)]
+        return (4, size // 4,
+                lambda rng, i0, i1: np.column_stack([randint(rng, lo, hi, i1 - i0)
+                                                     for lo, hi in ranges]),
+                patches)
 
     elif method == 13:
         # All variants of '[a-z][A-Z]\d'
-        for _ in range(size // 3):
-            data.append(random.randint(ord('a'), ord('z')))
-            data.append(random.randint(ord('A'), ord('Z')))
-            data.append(random.randint(ord('0'), ord('9')))
+        ranges = [(ord('a'), ord('z') + 1), (ord('A'), ord('Z') + 1), (ord('0'), ord('9') + 1)]
+        return (3, size // 3,
+                lambda rng, i0, i1: np.column_stack([randint(rng, lo, hi, i1 - i0)
+                                                     for lo, hi in ranges]),
+                patches)
 
     elif method == 14:
         # Random upper-case letters
-        for _ in range(size):
-            data.append(random.randint(ord('A'), ord('Z')))
+        return 1, size, lambda rng, i0, i1: randint(rng, ord('A'), ord('Z') + 1, (i1 - i0, 1)), \
+            patches
 
     elif method == 15:
         # num_unique unique strings ordered
-        _0 = ord('0')
-        _a = ord('a')
+        # Groups are 8 digit numbers of the group followed by '_'
+        powers = 10 ** np.arange(7, -1, -1)
+
+        def make_groups(rng, i0, i1):
+            digits = ord('0') + (np.arange(i0, i1)[:, None] // powers) % 10
+            return np.hstack([digits, np.full((i1 - i0, 1), ord('_'))])
 
-        for i in xrange((size + 7) // 8):
-            for j in range(8):
-                data.append(_0 + ((i // (10 ** (7 - j))) % 10))
-            data.append(ord('_'))
         num_repeats2 = num_repeats + 2
         repeat_size2 = size // num_repeats2
+        alphabet = ''.join(chr(ord('a') + j) for j in xrange(26))
         for i in xrange(num_repeats2):
-            start = int((i + 0.5) * repeat_size2)
-            for j in xrange(26):
-                data[start + j] = _a + j
+            patches.append((int((i + 0.5) * repeat_size2), alphabet))
+        return 9, (size + 7) // 8, make_groups, patches
 
     else:
         assert False, 'Bad method: %d' % method
 
 
-    # Apply confounders for all methods
-    if False:
-        for _ in range(num_repeats * 10):
-            for cnfd in CONFOUNDING_PREFIXES:
-                n = random.randint(0, size - len(cnfd) - 1)
-                for i in range(len(cnfd)):
-                    data[n + i] = cnfd[i]
-
-    # Put a heading at the start
-    for i, c in enumerate('THIS IS A FILE FOR TESTING FINDING REPEATED STRINGS\n' + ' '.join(sys.argv) + '\n'):
-        data[i] = ord(c)
-
-    if False:
-        # Add the repeated strings payload once per repeat
-        for i in range(num_repeats):
-            # Payload is random value that differs on each call
-            payload = make_payload()
-            offset = max(0, (repeat_size - len(payload)) // 2)
-            for j in range(len(payload)):
-                #assert i*repeat_size+j < len(data), 'i=%d repeat_size=%d j=%d i*repeat_size+j=%d len(data)=%d' % (
-                #        i, repeat_size, j, i*repeat_size+j, len(data))
-                data[i * repeat_size + offset + j] = ord(payload[j])
-
-    # Convert list to string and return string
-    result = ''.join([chr(x) for x in data])
-    #assert result.count(REPEATED_STRING) == num_repeats
-    return result
-
-
-def make_suffix_file(repeats_doc, suffix_size, suffix_path):
-    with open(suffix_path, 'wt') as f:
-        for i in xrange(len(repeats_doc) - suffix_size):
-            line = repeats_doc[i:i + suffix_size].replace('\n', '|')
-            assert len(line) == suffix_size, (suffix_path, i)
-            f.write(line + '\n')
+def generate_repeats(size, num_repeats, method, num_unique, random_lists, seed, heading=None):
+    """Generate a document of about `size` bytes containing strings repeated num_repeats
+        times, in blocks of about BLOCK_SIZE bytes. Each block is a uint8 array
+        `method` and `num_unique` are as in make_repeats(). The random bytes are drawn from
+        a RandomState seeded with `seed` so a document depends only on its arguments
+        heading: string written at the start of the document. Default get_heading()
+    """
+    group_size, num_groups, make_groups, patches = get_groups(size, num_repeats, method,
+                                                              num_unique, random_lists)
+    # Put a heading at the start, over any other patches
+    patches = patches + [(0, get_heading() if heading is None else heading)]
+    rng = np.random.RandomState(seed)
+    groups_per_block = max(1, BLOCK_SIZE // group_size)
+
+    for i0 in xrange(0, num_groups, groups_per_block):
+        i1 = min(i0 + groups_per_block, num_groups)
+        block = make_groups(rng, i0, i1).astype(np.uint8).ravel()
+        start, stop = i0 * group_size, i1 * group_size
+        for offset, patch in patches:
+            lo, hi = max(offset, start), min(offset + len(patch), stop)
+            if lo < hi:
+                block[lo - start:hi - start] = np.frombuffer(patch[lo - offset:hi - offset],
+                                                             dtype=np.uint8)
+        yield block
+
+
+def make_repeats(size, num_repeats, method, num_unique, random_lists, seed=None, heading=None):
+    """Make a string of length `size` containing REPEATED_STRING
+        `num_repeats` times, and other data to test the repeated
+        string finding code.
+        `method` sets the difficulty of string finding
+            0: All bytes the same. Worst case for some string finding algos
+            1: Random bytes of all bytes value. Worst case for other string
+                finding algos
+        seed: seed of the random bytes. Default is drawn from `random` so documents are
+            reproducible from random.seed()
+    """
+    if seed is None:
+        seed = random.randint(0, MAX_SEED)
+    return ''.join(block.tostring() for block in generate_repeats(size, num_repeats, method,
+                   num_unique, random_lists, seed, heading))
+
+
+# Formats of the suffix files written by make_suffix_file(). They are .npy files that can
+#  be memory-mapped with np.load(path, mmap_mode='r')
+#   sa: <doc>.sa.npy, the offsets of the suffixes of the document sorted by their first
+#       suffix_size or more bytes, and optionally <doc>.lcp.npy, the length of the common
+#       prefix of each suffix and the one before it, up to suffix_size
+#   windows: <doc>.suffix.npy, an n x suffix_size uint8 array whose row i is the
+#       suffix_size bytes at offset i of the document
+SUFFIX_FORMATS = ['sa', 'windows']
+
+
+def get_window_lcp(data, sa, k):
+    """Return lcp where lcp[i] is length of the common prefix of the suffixes of uint8
+        array data at offsets sa[i - 1] and sa[i], up to k, and lcp[0] = 0
+        lcp has the smallest unsigned dtype that holds k
+    """
+    n = len(data)
+    dtype = np.uint8 if k < 2 ** 8 else np.uint16 if k < 2 ** 16 else np.uint32
+    lcp = np.zeros(len(sa), dtype=dtype)
+    pairs_per_block = max(1, BLOCK_SIZE // k)
+    for start in xrange(1, len(sa), pairs_per_block):
+        stop = min(start + pairs_per_block, len(sa))
+        p, q = sa[start - 1:stop - 1].astype(np.int64), sa[start:stop].astype(np.int64)
+        # Suffixes are compared a byte at a time while they match
+        alive = np.ones(stop - start, dtype=bool)
+        for j in xrange(k):
+            alive &= (p + j < n) & (q + j < n)
+            alive[alive] = data[p[alive] + j] == data[q[alive] + j]
+            if not alive.any():
+                break
+            lcp[start:stop] += alive.astype(dtype)
+    return lcp
+
+
+def make_suffix_file(path, suffix_size, suffix_format='sa', lcp=False):
+    """Write the suffix file of the document in file `path` in `suffix_format`, one of
+        SUFFIX_FORMATS, and return the list of the files written
+        lcp: also write the LCP array for suffix_format 'sa'
+        The document is memory-mapped and the files are written in blocks
+    """
+    from suffix_array import get_suffix_array, get_tokens
+
+    data = np.memmap(path, dtype=np.uint8, mode='r') if os.path.getsize(path) else \
+        np.zeros(0, dtype=np.uint8)
+    if suffix_format == 'windows':
+        suffix_path = path + '.suffix.npy'
+        num_rows = max(0, len(data) - suffix_size)
+        rows_per_block = max(1, BLOCK_SIZE // suffix_size)
+        with open(suffix_path, 'wb') as f:
+            np.lib.format.write_array_header_1_0(f, {'descr': '|u1', 'fortran_order': False,
+                                                     'shape': (num_rows, suffix_size)})
+            for start in xrange(0, num_rows, rows_per_block):
+                stop = min(start + rows_per_block, num_rows)
+                windows = np.lib.stride_tricks.as_strided(data[start:],
+                                                          shape=(stop - start, suffix_size),
+                                                          strides=(1, 1))
+                f.write(np.ascontiguousarray(windows).tostring())
+        return [suffix_path]
+
+    assert suffix_format == 'sa', 'Bad suffix format: %s' % suffix_format
+    tokens, _ = get_tokens([data])
+    sa = get_suffix_array(tokens, [len(data)], suffix_size)
+    # Drop the suffix that is the separator at the end of the tokens
+    sa = sa[sa < len(data)]
+    del tokens
+    sa_path = path + '.sa.npy'
+    np.save(sa_path, sa)
+    paths = [sa_path]
+    if lcp:
+        lcp_path = path + '.lcp.npy'
+        np.save(lcp_path, get_window_lcp(data, sa, suffix_size))
+        paths.append(lcp_path)
+    return paths
 
 
 def make_repeats_file(directory, size, num_repeats, method, num_unique, random_lists,
-                      suffix_size=None):
+                      suffix_size=None, seed=None, heading=None, suffix_format='sa', lcp=False):
     path = os.path.join(directory, 'repeats=%d.txt' % num_repeats)
     path = os.path.abspath(path)
     #print 'make_repeats_file(%d, %d) name="%s"' % (size, num_repeats, path)
-    repeats_doc = make_repeats(size, num_repeats, method, num_unique, random_lists)
-    file(path, 'wb').write(repeats_doc)
+    if seed is None:
+        seed = random.randint(0, MAX_SEED)
+    # The document is written a block at a time so it is never all in memory
+    with open(path, 'wb') as f:
+        for block in generate_repeats(size, num_repeats, method, num_unique, random_lists,
+                                      seed, heading):
+            f.write(block.tostring())
 
     if suffix_size is not None:
-        suffix_path = path + '.suffix'
-        make_suffix_file(repeats_doc, suffix_size, suffix_path)
+        make_suffix_file(path, suffix_size, suffix_format, lcp)
 
     return path
 
+
+def _make_repeats_file(args):
+    """make_repeats_file() for multiprocessing.Pool.map()"""
+    return make_repeats_file(*args)
+
 KBYTE = 1024
 MBYTE = KBYTE ** 2
 GBYTE = KBYTE ** 3
@@ -245,7 +350,12 @@ def main():
     parser = optparse.OptionParser('python ' + sys.argv[0] + ' [options]')
     parser.add_option('-r', '--min-repeats', dest='min', default='11', help='min num of repeats')
     parser.add_option('-f', '--suffix-size', dest='suffix_size', type=int, default=None,
-                      help='min num of repeats')
+                      help='Write a suffix file of each document sorted on this many bytes')
+    parser.add_option('--suffix-format', dest='suffix_format', default='sa',
+                      choices=SUFFIX_FORMATS,
+                      help='Format of the suffix files: %s' % ', '.join(SUFFIX_FORMATS))
+    parser.add_option('--lcp', dest='lcp', action='store_true', default=False,
+                      help='Also write the LCP array of each suffix array')
     parser.add_option('-n', '--number', dest='num', default='5', help='number of documents')
     parser.add_option('-s', '--size', dest='size', default='1.0',
                       help='size of each document in MBytes')
@@ -255,6 +365,8 @@ def main():
                       help='Number of unique substrings')
     parser.add_option('-d', '--directory', dest='directory', default='.',
                       help='Directory to create file in')
+    parser.add_option('-j', '--jobs', dest='jobs', type=int, default=1,
+                      help='Number of processes that make documents')
 
     options, args = parser.parse_args()
 
@@ -280,10 +392,23 @@ def main():
     elif method == 6:
         random_lists = make_random_lists(size, num_unique, JOIN_SIZE)
 
-    for num_repeats in xrange(min_repeats, min_repeats + num_documents):
-        path = make_repeats_file(directory, size, num_repeats, method, num_unique, random_lists,
-                                 options.suffix_size)
-        print('%s  # %2d repeats' % (path, num_repeats))
+    # The seeds are drawn before the documents are made so the documents don't depend on
+    #  the order the processes make them in
+    tasks = [(directory, size, num_repeats, method, num_unique, random_lists,
+              options.suffix_size, random.randint(0, MAX_SEED), get_heading(),
+              options.suffix_format, options.lcp)
+             for num_repeats in xrange(min_repeats, min_repeats + num_documents)]
+    if options.jobs > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(options.jobs)
+        paths = pool.map(_make_repeats_file, tasks)
+        pool.close()
+        pool.join()
+    else:
+        paths = [_make_repeats_file(task) for task in tasks]
 
-main()
+    for path, task in zip(paths, tasks):
+        print('%s  # %2d repeats' % (path, task[2]))
 
+if __name__ == '__main__':
+    main()
@@ -92,5 +92,5 @@ def main():
         path = make_repeats_file(directory, doc_size, n_repeats)
         print('%s  # %2d repeats' % (path, n_repeats))
 
-main()
-
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+    Memory-mapped documents
+
+    Large files are mapped read-only rather than read into Python strings so they are not
+    copied into memory when they are loaded and are never held twice. A mapped document
+    can be used where the code uses a string document
+        len(text), text[i:j], text.find(s), text.rfind(s)  mmap methods
+        np.frombuffer(text, dtype=np.uint8)  a zero-copy view of the file
+        text.count(s, start, end)  the non-overlapping count that str.count() returns
+
+    The pages that a round touches can be released with release_pages() when the round is
+    done. They are read back from the file system cache when they are next used.
+"""
+from __future__ import division, print_function
+import ctypes
+import mmap
+import numpy as np
+
+# Files at least this long are memory-mapped
+MIN_MAPPED_SIZE = 16 * 1024 * 1024
+
+# Number of bytes of a mapped document that are counted at a time
+BLOCK_SIZE = 16 * 1024 * 1024
+
+# madvise() advice that drops the pages of a mapping from the resident set
+MADV_DONTNEED = 4
+
+try:
+    _madvise = ctypes.CDLL(None, use_errno=True).madvise
+    _madvise.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int]
+except (AttributeError, OSError):
+    _madvise = None
+
+
+class MappedText(mmap.mmap):
+    """A document that is a read-only memory-mapped file"""
+
+    def count(self, sub, start=0, end=None):
+        """Return number of non-overlapping occurrences of sub in [start:end] like
+            str.count()
+            The document is counted in blocks that end where no occurrence of sub crosses
+            the block boundary so the counts of the blocks add up
+        """
+        m = len(sub)
+        size = len(self) if end is None else min(end, len(self))
+        n = 0
+        while start < size:
+            stop = min(start + BLOCK_SIZE, size)
+            while stop < size:
+                ofs = self.find(sub, max(stop - m + 1, start), min(stop + m - 1, size))
+                if ofs < 0 or ofs >= stop:
+                    break
+                stop = ofs + m
+            n += self[start:stop].count(sub)
+            start = stop
+        return n
+
+    def release(self):
+        """Drop the pages of the document from the resident set of this process"""
+        if _madvise is None or not len(self):
+            return
+        _madvise(np.frombuffer(self, dtype=np.uint8).ctypes.data, len(self), MADV_DONTNEED)
+
+
+def read_text(filename):
+    """Return contents of file filename
+        Files of MIN_MAPPED_SIZE bytes or more are returned as MappedText
+    """
+    with open(filename, 'rb') as f:
+        f.seek(0, 2)
+        if f.tell() < MIN_MAPPED_SIZE:
+            f.seek(0)
+            return f.read()
+        return MappedText(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def release_pages(texts):
+    """Release the resident pages of the mapped documents in texts"""
+    for text in texts:
+        if isinstance(text, MappedText):
+            text.release()
@@ -0,0 +1,138 @@
+"""
+    Performance records of find_repeats.analyze() runs
+
+    A run writes one JSON object per line to its metrics file
+        {"type": "run", ...}    the corpus and options of the run
+        {"type": "round", ...}  one per validation of a set of candidate strings
+            m: length of the candidates
+            generated: number of candidates
+            surviving: number of candidates that are valid
+            bytes_scanned: number of document bytes read to validate them, or null for
+                engines that don't read the documents
+            wall, cpu: seconds since the last record
+            peak_rss: peak resident set size of the process in bytes, or null where it
+                can't be measured
+            spilled: number of runs the surviving candidates were spilled to disk in when
+                the round was over the memory limit, 0 if it was validated in memory
+            collapsed: number of candidates counted from collapsed chains rather than
+                validated (collapse.py)
+        {"type": "phase", ...}  wall and CPU seconds spent in each phase of the run
+            load: reading the corpus
+            round 1: building the counter and validating the strings of length 1
+            generation: generating candidates from the valid strings of the last round
+            validation: validating candidates
+            store: loading and saving rounds of an IndexStore
+            reporting: writing out the results
+        {"type": "total", ...}  wall and CPU seconds and peak RSS of the whole run
+
+    format_output.py turns these records into timing tables.
+"""
+from __future__ import division, print_function
+from contextlib import contextmanager
+import json
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# The phases of a run in the order they happen
+PHASES = ['load', 'round 1', 'generation', 'validation', 'store', 'reporting']
+
+
+def get_times():
+    """Return wall, cpu where wall is wall clock time and cpu is user + system CPU time of
+        this process in seconds
+    """
+    t = os.times()
+    return time.time(), t[0] + t[1]
+
+
+def get_peak_rss():
+    """Return peak resident set size of this process in bytes, or None if it can't be
+        measured
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on OS X and kilobytes on Linux
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+class Metrics(object):
+    """Collects the round and phase records of a run and writes them to a metrics file"""
+
+    def __init__(self, path=None):
+        """path: name of the file the records are written to. If None they are only
+            collected
+        """
+        self.f = open(path, 'wt') if path else None
+        self.records = []
+        # {phase: [wall, cpu]}
+        self.phases = {}
+        self.start = get_times()
+        self.last = self.start
+
+    def write(self, record):
+        self.records.append(record)
+        if self.f:
+            self.f.write(json.dumps(record, sort_keys=True) + '\n')
+            self.f.flush()
+
+    @contextmanager
+    def phase(self, name):
+        """Add the time spent in the with block to phase `name`"""
+        wall, cpu = get_times()
+        try:
+            yield
+        finally:
+            wall1, cpu1 = get_times()
+            totals = self.phases.setdefault(name, [0.0, 0.0])
+            totals[0] += wall1 - wall
+            totals[1] += cpu1 - cpu
+
+    def add_run(self, **kwargs):
+        """Write the record of the corpus and options of the run"""
+        record = {'type': 'run'}
+        record.update(kwargs)
+        self.write(record)
+
+    def add_round(self, m, generated, surviving, bytes_scanned, spilled=0, collapsed=0):
+        """Write the record of a validation of `generated` candidates of length m of which
+            `surviving` were valid after reading bytes_scanned bytes of the documents
+            spilled: number of runs the survivors were spilled to disk in
+            collapsed: number of the candidates counted from collapsed chains
+        """
+        now = get_times()
+        self.write({'type': 'round', 'm': m, 'generated': generated, 'surviving': surviving,
+                    'bytes_scanned': bytes_scanned,
+                    'wall': now[0] - self.last[0], 'cpu': now[1] - self.last[1],
+                    'peak_rss': get_peak_rss(), 'spilled': spilled,
+                    'collapsed': collapsed})
+        self.last = now
+
+    def close(self):
+        """Write the phase and total records and close the metrics file"""
+        names = [name for name in PHASES if name in self.phases]
+        names.extend(sorted(set(self.phases) - set(PHASES)))
+        for name in names:
+            wall, cpu = self.phases[name]
+            self.write({'type': 'phase', 'phase': name, 'wall': wall, 'cpu': cpu})
+        now = get_times()
+        self.write({'type': 'total', 'wall': now[0] - self.start[0],
+                    'cpu': now[1] - self.start[1], 'peak_rss': get_peak_rss()})
+        if self.f:
+            self.f.close()
+            self.f = None
+
+    def phase_table(self):
+        """Return list of lines of a table of the time spent in each phase"""
+        lines = ['%-12s %9s %9s' % ('phase', 'wall', 'cpu')]
+        for record in self.records:
+            if record['type'] in ('phase', 'total'):
+                lines.append('%-12s %9.2f %9.2f' % (record.get('phase', 'total'),
+                                                    record['wall'], record['cpu']))
+        return lines
@@ -0,0 +1,178 @@
+"""
+    Validate the candidate strings of a round in worker processes
+
+    Each document is split into slices and the candidates into contiguous shards. Each
+    worker counts a shard of candidates in a slice of a document. The slices overlap by
+    m - 1 bytes so that each occurrence of a length m string is in exactly one slice:
+    the one its first byte is in. Results are joined in order so that they are the same
+    as validating in one process. As in the single process engines, a document is only
+    counted for the candidates that are valid in the documents before it.
+
+    Workers count slices with the counter's get_text_counts(). For the count engine that
+    is plain str.count(), so with --jobs the count engine does not reject candidates part
+    way through a document, cap counts or reorder the documents the way its single
+    process valid() does. Documents are counted in corpus order.
+
+    The worker processes are forked after the corpus has been loaded so they share its
+    pages with the parent process. The corpus is never pickled. Where processes cannot be
+    forked each worker loads the corpus files itself.
+"""
+from __future__ import division, print_function
+import multiprocessing
+import numpy as np
+
+# Number of shards per worker in each round. More shards balance the load better
+SHARDS_PER_JOB = 4
+
+# Rounds with fewer candidates than this are validated in the parent process
+MIN_PARALLEL = 256
+
+# Smallest slice of a document that is counted by a worker
+MIN_SLICE_SIZE = 1024 * 1024
+
+# Engines whose counters keep no state between rounds so can be copied to workers
+PARALLEL_ENGINES = ['count', 'kmer', 'aho']
+
+# The counter used by this process
+_counter = None
+
+
+def _init_worker(engine, filenames):
+    """Create the counter in a worker that was not forked from the process that made it"""
+    global _counter
+    if _counter is None:
+        from find_repeats import get_data, make_counter
+        _counter = make_counter(engine, [get_data(filename) for filename in filenames])
+
+
+def _valid_counts(strings):
+    """Return CandidateSet of valid strings in CandidateSet `strings` and array of their
+        counts in each document
+    """
+    valid_strings = _counter.valid(strings)
+    return valid_strings, _counter.valid_counts()
+
+
+def _slice_counts(task):
+    """Return counts of CandidateSet strings in the slice of document d that starts with
+        the windows at offsets start..stop-1
+    """
+    d, start, stop, strings = task
+    text = _counter.corpus[d][2][start:stop + strings.m - 1]
+    return _counter.get_text_counts(text, strings)
+
+
+def get_shards(items, num_shards):
+    """Return list of up to num_shards contiguous slices of list or CandidateSet items"""
+    size = max(1, -(-len(items) // num_shards))
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def get_slices(size, m, num_slices):
+    """Return list of start, stop of up to num_slices slices of the windows of length m
+        in a document of `size` bytes. Slices are at least MIN_SLICE_SIZE long
+    """
+    num_windows = max(size - m + 1, 0)
+    num_slices = max(1, min(num_slices, num_windows // MIN_SLICE_SIZE))
+    bounds = [num_windows * i // num_slices for i in range(num_slices + 1)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def get_straddling_strings(text, boundary, m):
+    """Return set of strings of length m that have overlapping occurrences in text on both
+        sides of offset boundary
+        Occurrences of these strings in a slice can change which occurrences str.count()
+        counts in the next slice, so their counts in the slices do not add up
+    """
+    offsets = {}
+    for ofs in range(max(boundary - m + 1, 0), boundary + m - 1):
+        offsets.setdefault(text[ofs:ofs + m], []).append(ofs)
+    return {s for s, ofs_list in offsets.items()
+            if len(s) == m and
+            any(0 < o2 - o1 < m and o1 < boundary <= o2 for o1 in ofs_list for o2 in ofs_list)}
+
+
+class ParallelCounter(object):
+    """Validates strings with `jobs` copies of a counter in worker processes"""
+
+    def __init__(self, counter, jobs, engine, filenames):
+        """counter: counter for engine on the corpus of `filenames` in that order"""
+        global _counter
+        if engine not in PARALLEL_ENGINES:
+            raise ValueError('Engine "%s" cannot be run in parallel. Parallel engines are %s'
+                             % (engine, PARALLEL_ENGINES))
+        _counter = counter
+        self.jobs = jobs
+        self.pool = multiprocessing.Pool(jobs, _init_worker, (engine, filenames))
+        self._valid_counts = None
+        # Number of bytes scanned in each document in the last call to valid()
+        self.bytes_scanned = None
+
+    def valid(self, strings):
+        """Return CandidateSet of the strings in CandidateSet `strings` that are repeated a
+            sufficient number of times in the test file corpus
+        """
+        if not len(strings) or strings.m <= 2:
+            valid_strings, self._valid_counts = _valid_counts(strings)
+            self.bytes_scanned = getattr(_counter, 'bytes_scanned', None)
+            return valid_strings
+
+        counts = self.get_corpus_counts(strings)
+        alive = np.flatnonzero((counts >= [[numrepeats] for _, numrepeats, _
+                                           in _counter.corpus]).all(axis=0))
+        self._valid_counts = counts[:, alive].T
+        return strings.take(alive)
+
+    def get_corpus_counts(self, strings):
+        """Return array counts where counts[d, i] is the number of occurrences of strings[i]
+            in document d. Documents after the first document in which strings[i] does not
+            occur sufficient times are not counted
+        """
+        m = strings.m
+        num_tasks = self.jobs * SHARDS_PER_JOB
+        counts = np.zeros((len(_counter.corpus), len(strings)), dtype=np.int64)
+        alive = np.arange(len(strings))
+        self.bytes_scanned = np.zeros(len(_counter.corpus), dtype=np.int64)
+        for d, (_, numrepeats, text) in enumerate(_counter.corpus):
+            alive_strings = strings.take(alive)
+            # Engines that shard the candidates scan the document once per candidate
+            self.bytes_scanned[d] = len(text) * (len(alive) if _counter.SHARD_CANDIDATES else 1)
+            slices = get_slices(len(text), m, num_tasks)
+            # Engines that scan once per candidate are sped up by sharding the candidates.
+            # Engines that scan once for all candidates are not
+            num_shards = 1
+            if _counter.SHARD_CANDIDATES:
+                num_shards = max(1, num_tasks // len(slices))
+            if len(slices) * num_shards == 1 or len(alive_strings) < MIN_PARALLEL:
+                doc_counts = np.array(_counter.get_text_counts(text, alive_strings))
+            else:
+                shards = get_shards(alive_strings, num_shards)
+                tasks = [(d, start, stop, shard) for start, stop in slices for shard in shards]
+                results = self.pool.map(_slice_counts, tasks)
+                doc_counts = np.zeros(len(alive_strings), dtype=np.int64)
+                for j in range(len(slices)):
+                    slice_results = results[j * len(shards):(j + 1) * len(shards)]
+                    doc_counts += np.concatenate([np.asarray(r) for r in slice_results])
+
+                # Recount strings whose occurrences overlap across slice boundaries
+                for _, boundary in slices[:-1]:
+                    for s in get_straddling_strings(text, boundary, m):
+                        i = alive_strings.index(s)
+                        if i >= 0:
+                            doc_counts[i] = text.count(s)
+
+            counts[d, alive] = doc_counts
+            alive = alive[doc_counts >= numrepeats]
+            if not len(alive):
+                break
+        return counts
+
+    def valid_counts(self):
+        """Return array counts where counts[i, d] is the number of occurrences of string i
+            returned by the last call to valid() in document d
+        """
+        return self._valid_counts
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
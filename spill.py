@@ -0,0 +1,237 @@
+"""
+    Validation of rounds whose candidates don't fit in a memory budget
+
+    The candidates of a round are the extensions of the valid strings of the last round,
+    and the extensions of a string depend only on that string, so the candidates can be
+    generated and validated a slice of the valid strings at a time. SpillingCounter does
+    this when a round would use more than its memory budget
+        1) The number of candidates each valid string extends to is counted without
+           making the candidates (CandidateSet.num_extensions()) and the valid strings are
+           cut into slices whose candidates fit in the budget (ChunkedCandidates)
+        2) The candidates of each slice are made, validated, and the surviving strings and
+           their counts are written to a run of .npy files in the spill directory
+        3) The runs are merged into one pair of .npy files that are memory-mapped as the
+           valid strings and counts of the round
+        4) When a later round is validated, the files of the earlier spilled rounds whose
+           strings and counts are no longer referenced, by the search or its CountCache,
+           are deleted
+
+    Candidates are generated in sorted order from sorted valid strings, and the slices are
+    contiguous, so the runs are sorted and don't overlap and the merge of the runs is a
+    streaming concatenation of them. The survivors are the same, in the same order, as
+    validating all the candidates at once.
+"""
+from __future__ import division, print_function
+import os
+import shutil
+import tempfile
+import weakref
+import numpy as np
+from candidates import CandidateSet
+
+# Bytes of working memory used per candidate besides its string and counts: the join
+#  indexes of CandidateSet.extensions() and the keys and sort orders of the counters
+CANDIDATE_OVERHEAD = 64
+
+
+def get_candidate_bytes(m, num_docs):
+    """Return estimated bytes of memory used to generate and validate a candidate of length
+        m in a corpus of num_docs documents
+    """
+    return m + 8 * num_docs + CANDIDATE_OVERHEAD
+
+
+def get_chunk_bounds(num_extensions, max_rows):
+    """Return list of (start, stop) of slices of strings whose numbers of extensions add up
+        to about max_rows. A slice has more than max_rows extensions only if it is a single
+        string
+            num_extensions: num_extensions[i] is the number of extensions of string i
+    """
+    ends = np.cumsum(num_extensions)
+    chunks = (ends - num_extensions) // max_rows
+    starts = [0] + list(np.flatnonzero(np.diff(chunks)) + 1)
+    return list(zip(starts, starts[1:] + [len(num_extensions)]))
+
+
+class ChunkedCandidates(object):
+    """The candidates base.extensions(chain[0]).extensions(chain[1])... made a slice of
+        CandidateSet base at a time
+    """
+
+    def __init__(self, base, chain, bounds):
+        """base: CandidateSet that the candidates extend
+            chain: list of CandidateSets that base is extended by
+            bounds: list of (start, stop) of the slices of base, from get_chunk_bounds()
+        """
+        self.base = base
+        self.chain = chain
+        self.bounds = bounds
+        self._len = None
+
+    @property
+    def m(self):
+        """Length of the strings"""
+        return self.base.m + len(self.chain)
+
+    def extensions(self, strings):
+        """Return ChunkedCandidates of the extensions of the candidates by CandidateSet
+            strings
+        """
+        return ChunkedCandidates(self.base, self.chain + [strings], self.bounds)
+
+    def chunks(self):
+        """Generate the CandidateSets of the candidates made from each slice of base"""
+        for start, stop in self.bounds:
+            candidates = self.base[start:stop]
+            for strings in self.chain:
+                candidates = candidates.extensions(strings)
+            yield candidates
+
+    def __len__(self):
+        if self._len is None:
+            n = 0
+            for start, stop in self.bounds:
+                candidates = self.base[start:stop]
+                for strings in self.chain[:-1]:
+                    candidates = candidates.extensions(strings)
+                n += candidates.num_extensions(self.chain[-1]).sum()
+            self._len = int(n)
+        return self._len
+
+
+def merge_runs(paths, path, shape, dtype):
+    """Write the concatenation of the arrays in .npy files `paths` to .npy file path one run
+        at a time, delete the runs and return the memory-mapped result
+            shape: shape of the result when there are no runs
+    """
+    runs = [np.load(p, mmap_mode='r') for p in paths]
+    if runs:
+        shape = (sum(len(run) for run in runs),) + runs[0].shape[1:]
+    merged = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+    start = 0
+    for run in runs:
+        merged[start:start + len(run)] = run
+        start += len(run)
+    merged.flush()
+    del merged, runs
+    for p in paths:
+        os.remove(p)
+    return np.load(path, mmap_mode='r')
+
+
+class SpillingCounter(object):
+    """Wraps a counter so that rounds whose candidates would use more than a memory budget
+        are generated and validated in slices whose survivors are spilled to disk
+        The counter must validate any set of candidates of a round independently of the
+        others, so the index engine, whose valid() extends the postings of the whole last
+        round, can't be wrapped
+    """
+
+    def __init__(self, counter, max_bytes, num_docs, directory=None):
+        """counter: counter whose valid(), valid_counts() validate the candidates
+            max_bytes: memory budget of a round in bytes
+            num_docs: number of documents in the corpus
+            directory: directory that the spill directory is made in. Default is the
+                system temporary directory
+        """
+        self.counter = counter
+        self.max_bytes = max_bytes
+        self.num_docs = num_docs
+        self.directory = tempfile.mkdtemp(prefix='repeats-spill-', dir=directory)
+        self._valid_counts = None
+        # Number of rounds spilled to disk, which numbers their files
+        self.num_spilled = 0
+        # [(weak references to the memory-mapped arrays of a spilled round, their paths)]
+        #  for the spilled rounds whose files have not been deleted
+        self._spilled = []
+        # Number of runs spilled to disk in the last call to valid()
+        self.num_runs = 0
+        # Number of bytes scanned in each document in the last call to valid()
+        self.bytes_scanned = None
+
+    def extend(self, candidates, strings):
+        """Return the extensions of candidates by CandidateSet strings, as a CandidateSet if
+            they fit in the memory budget, otherwise as a ChunkedCandidates
+        """
+        if isinstance(candidates, ChunkedCandidates):
+            return candidates.extensions(strings)
+        num_extensions = candidates.num_extensions(strings)
+        max_rows = max(1, self.max_bytes // get_candidate_bytes(candidates.m + 1,
+                                                                 self.num_docs))
+        if num_extensions.sum() <= max_rows:
+            return candidates.extensions(strings)
+        return ChunkedCandidates(candidates, [strings],
+                                 get_chunk_bounds(num_extensions, max_rows))
+
+    def delete_unused(self):
+        """Delete the files of the spilled rounds whose memory-mapped strings and counts
+            are no longer referenced
+        """
+        spilled = []
+        for refs, paths in self._spilled:
+            if any(ref() is not None for ref in refs):
+                spilled.append((refs, paths))
+                continue
+            for path in paths:
+                os.remove(path)
+        self._spilled = spilled
+
+    def valid(self, strings):
+        """Return CandidateSet of the strings in `strings`, a CandidateSet or a
+            ChunkedCandidates, that are repeated a sufficient number of times in the test
+            file corpus
+        """
+        # The counts of the last round are no longer returned by valid_counts()
+        self._valid_counts = None
+        self.delete_unused()
+        if not isinstance(strings, ChunkedCandidates):
+            valid_strings = self.counter.valid(strings)
+            self.num_runs = 0
+            self.bytes_scanned = getattr(self.counter, 'bytes_scanned', None)
+            return valid_strings
+
+        m = strings.m
+        self.num_spilled += 1
+        name = '%d_%d' % (self.num_spilled, m)
+        string_paths, count_paths = [], []
+        bytes_scanned = np.zeros(self.num_docs, dtype=np.int64)
+        for i, candidates in enumerate(strings.chunks()):
+            valid_strings = self.counter.valid(candidates)
+            scanned = getattr(self.counter, 'bytes_scanned', None)
+            if scanned is None:
+                bytes_scanned = None
+            elif bytes_scanned is not None:
+                bytes_scanned += scanned
+            if not len(valid_strings):
+                continue
+            string_paths.append(os.path.join(self.directory, 'strings_%s_%d.npy' % (name, i)))
+            count_paths.append(os.path.join(self.directory, 'counts_%s_%d.npy' % (name, i)))
+            np.save(string_paths[-1], valid_strings.matrix)
+            np.save(count_paths[-1], np.asarray(self.counter.valid_counts(), dtype=np.int64))
+
+        self.num_runs = len(string_paths)
+        self.bytes_scanned = bytes_scanned
+        counts_path = os.path.join(self.directory, 'counts_%s.npy' % name)
+        strings_path = os.path.join(self.directory, 'strings_%s.npy' % name)
+        self._valid_counts = merge_runs(count_paths, counts_path, (0, self.num_docs), np.int64)
+        matrix = merge_runs(string_paths, strings_path, (0, m), np.uint8)
+        self._spilled.append(([weakref.ref(self._valid_counts), weakref.ref(matrix)],
+                              [counts_path, strings_path]))
+        return CandidateSet(matrix)
+
+    def get_text_counts(self, text, strings):
+        return self.counter.get_text_counts(text, strings)
+
+    def valid_counts(self):
+        """Return array counts where counts[i, d] is the number of occurrences of string i
+            returned by the last call to valid() in document d
+        """
+        if self._valid_counts is None:
+            return self.counter.valid_counts()
+        return self._valid_counts
+
+    def close(self):
+        """Close the wrapped counter and delete the spill directory"""
+        if hasattr(self.counter, 'close'):
+            self.counter.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
@@ -0,0 +1,415 @@
+"""
+    Generalized suffix array solution. See suffix.md
+
+    Find the longest substring that occurs num[d] times in documents doc[d] for d = 1..D
+
+    The suffix array of all documents joined with unique separators plays the part of the
+    generalized suffix tree in suffix.md. Each internal node of the suffix tree is an LCP
+    interval of the suffix array: a range of suffixes that share a common prefix. Finding
+    the LCP intervals and counting the suffixes from each document in each interval finds
+    all substrings that occur num[d] or more times in one pass.
+
+    All the steps are vectorized NumPy passes over int32 arrays of the suffixes so the
+    engine uses about 20 bytes per corpus byte.
+
+    The suffix tree counts overlapping occurrences and find_repeats.py counts
+    non-overlapping occurrences (str.count) so the offsets of each interval that passes
+    the overlapping count test are checked with a non-overlapping count.
+
+    Documentation in https://github.com/peterwilliams97/repeats
+"""
+from __future__ import division, print_function
+import numpy as np
+from inverted_index import get_non_overlapping_count
+
+# Number of suffixes whose lcp values are computed at a time
+CHUNK_SIZE = 1024 * 1024
+
+# Bytes of the suffixes compared at a time by get_lcp_array()
+WORD_LEN = 8
+# A WORD_LEN byte big-endian word x has i leading zero bytes if
+#  searchsorted(BYTE_LIMITS, x, side='right') == WORD_LEN - i
+BYTE_LIMITS = np.array([256 ** i for i in range(WORD_LEN)], dtype=np.uint64)
+
+
+def get_tokens(texts):
+    """Return tokens, starts for texts joined with separators
+        tokens is a uint8 array of the texts, each followed by a 0 byte separator, and
+        WORD_LEN bytes of padding
+        starts[d] is offset of text d in tokens
+        get_suffix_array() treats the separator at the end of text d as a token 256 + d
+        that is unique to text d so that no common prefix extends past the end of a text
+    """
+    n = sum(len(text) + 1 for text in texts)
+    tokens = np.zeros(n + WORD_LEN, dtype=np.uint8)
+    starts = []
+    start = 0
+    for text in texts:
+        starts.append(start)
+        end = start + len(text)
+        tokens[start:end] = np.frombuffer(text, dtype=np.uint8)
+        start = end + 1
+    return tokens, starts
+
+
+def get_nonzero(mask):
+    """Return int32 array of the indexes of the True values of bool array mask
+        This is np.flatnonzero() without its int64 copy of the indexes
+    """
+    indexes = np.empty(np.count_nonzero(mask), dtype=np.int32)
+    i = 0
+    for base in range(0, len(mask), CHUNK_SIZE):
+        chunk = np.flatnonzero(mask[base:base + CHUNK_SIZE]) + base
+        indexes[i:i + len(chunk)] = chunk
+        i += len(chunk)
+    return indexes
+
+
+def get_group_start(levels, start):
+    """Return the position of the first group start at or after `start` in the levels of
+        sort_suffixes(), or len(levels) if there is none
+    """
+    for base in range(start, len(levels), CHUNK_SIZE):
+        found = np.flatnonzero(levels[base:base + CHUNK_SIZE])
+        if len(found):
+            return base + found[0]
+    return len(levels)
+
+
+def get_groups(levels, positions):
+    """Return the rank of the suffixes sa[positions] where positions is an increasing
+        array of positions in sa that covers whole groups and levels[p] > 0 where a group
+        of suffixes that have the same rank starts at sa[p]
+        The rank of a group is the position in sa where it starts
+    """
+    return np.maximum.accumulate(np.where(levels[positions] > 0, positions, 0)).astype(
+        np.int32, copy=False)
+
+
+def sort_suffixes(tokens, ends, max_len=None):
+    """Return sa, levels where
+            sa: the int32 suffix array of tokens from get_tokens()
+            levels: uint8 array where levels[i] is 0 if suffixes sa[i - 1] and sa[i] are the
+                same for their first max_len tokens, otherwise k + 1 where they are the same
+                for their first 2 ** (k - 1) tokens, none for k == 0. levels[0] = 1
+            ends: ends[d] is offset of the separator at the end of text d
+        This is prefix doubling: sort suffixes by their first h tokens, then by their
+        first 2h tokens using the ranks of the first h tokens, until all ranks differ.
+        As in qsufsort (sa/qsufsort/qsufsort.c) only the groups of suffixes whose first h
+        tokens are the same are sorted in each pass, so the passes get faster as the groups
+        are split, and they are sorted CHUNK_SIZE suffixes at a time with the ranks
+        updated as each chunk is sorted
+        max_len: if not None, stop once the suffixes are sorted by their first max_len or
+            more tokens. Suffixes that are still equal are in offset order
+    """
+    n = ends[-1] + 1 if len(ends) else 0
+    num_keys = 256 + len(ends)
+
+    def get_keys(base):
+        """Return the first tokens of the suffixes in chunk base..base + CHUNK_SIZE"""
+        keys = tokens[base:min(base + CHUNK_SIZE, n)].astype(np.int32)
+        for d, end in enumerate(ends):
+            if base <= end < base + CHUNK_SIZE:
+                keys[end - base] = 256 + d
+        return keys
+
+    # Counting sort by the first token. The suffixes of each chunk are placed after those
+    # of the previous chunks with the same first token so that equal suffixes stay in
+    # offset order
+    counts = np.zeros(num_keys, dtype=np.int64)
+    for base in range(0, n, CHUNK_SIZE):
+        counts += np.bincount(get_keys(base), minlength=num_keys)
+    # The rank of a suffix is the position in sa where its group starts
+    group_starts = np.cumsum(counts) - counts
+    placed = group_starts.copy()
+    rank = np.empty(n, dtype=np.int32)
+    levels = np.zeros(n, dtype=np.uint8)
+    levels[group_starts[counts > 0]] = 1
+    sa = np.empty(n, dtype=np.int32)
+    for base in range(0, n, CHUNK_SIZE):
+        keys = get_keys(base)
+        rank[base:base + len(keys)] = group_starts[keys]
+        order = np.argsort(keys, kind='mergesort')
+        keys = keys[order]
+        chunk_counts = np.bincount(keys, minlength=num_keys)
+        # Position of each suffix in its group in this chunk
+        offsets = np.arange(len(keys)) - (np.cumsum(chunk_counts) - chunk_counts)[keys]
+        sa[placed[keys] + offsets] = base + order
+        placed += chunk_counts
+        del keys, order, offsets
+
+    h, level = 1, 2
+    while max_len is None or h < max_len:
+        num_sorted = 0
+        # The suffixes are sorted in chunks of whole groups that end at the first group
+        # start after CHUNK_SIZE suffixes
+        base = 0
+        while base < n:
+            stop = get_group_start(levels, base + CHUNK_SIZE)
+            # Positions in sa of the suffixes in groups of more than one suffix
+            grouped = levels[base:stop] == 0
+            grouped[:-1] |= levels[base + 1:stop] == 0
+            chunk = get_nonzero(grouped) + base
+            del grouped
+            base = stop
+            if not len(chunk):
+                continue
+            num_sorted += len(chunk)
+            suffixes = sa[chunk]
+            # Suffixes in the same group are the same for their first h tokens, which
+            # don't include their separators, so suffix + h < n. Groups are contiguous and
+            # in increasing order so sorting by group, then by the rank of the next h
+            # tokens, sorts the suffixes in each group. Ranks that have been updated in
+            # this pass sort the same way
+            keys = rank[suffixes].astype(np.int64)
+            keys *= n
+            keys += rank[suffixes + h]
+            order = np.argsort(keys, kind='mergesort')
+            suffixes = suffixes[order]
+            keys = keys[order]
+            del order
+            sa[chunk] = suffixes
+            split = chunk[1:][(keys[1:] != keys[:-1]) & (levels[chunk[1:]] == 0)]
+            del keys
+            levels[split] = level
+            rank[suffixes] = get_groups(levels, chunk)
+            del suffixes, split, chunk
+        if not num_sorted:
+            break
+        h, level = 2 * h, level + 1
+    return sa, levels
+
+
+def get_suffix_array(tokens, ends, max_len=None):
+    """Return the int32 suffix array of tokens from get_tokens(). See sort_suffixes()"""
+    return sort_suffixes(tokens, ends, max_len)[0]
+
+
+def get_docs(sa, starts):
+    """Return array docs where docs[i] is the document that suffix sa[i] is in"""
+    starts = np.array(starts)
+    docs = np.empty(len(sa), dtype=np.int16 if len(starts) < 2 ** 15 else np.int32)
+    for base in range(0, len(sa), CHUNK_SIZE):
+        docs[base:base + CHUNK_SIZE] = np.searchsorted(starts, sa[base:base + CHUNK_SIZE],
+                                                       side='right') - 1
+    return docs
+
+
+def get_lcp_array(tokens, sa, levels, docs, ends, max_len):
+    """Return int16 or int32 array lcp of length len(sa) + 1 where lcp[i] is the length of
+        the longest common prefix of suffixes sa[i - 1] and sa[i], up to max_len, and
+        lcp[0] = lcp[len(sa)] = 0
+            tokens, docs, ends: as in get_tokens(), get_docs() and sort_suffixes()
+            sa, levels: from sort_suffixes(tokens, ends, max_len)
+        The suffixes of each pair are compared WORD_LEN bytes at a time from the number of
+        tokens that sort_suffixes() found they share until they differ so this takes at
+        most max_len / 2 / WORD_LEN vectorized steps
+    """
+    n = len(sa)
+    ends = np.array(ends)
+    # words[i] is the WORD_LEN bytes of tokens starting at i as a big-endian integer
+    words = np.ndarray((n,), dtype='>u8', buffer=tokens, strides=(1,))
+    lcp = np.zeros(n + 1, dtype=np.int16 if max_len < 2 ** 15 else np.int32)
+    for base in range(1, n, CHUNK_SIZE):
+        a = sa[base - 1:base - 1 + CHUNK_SIZE]
+        b = sa[base:base + CHUNK_SIZE]
+        a = a[:len(b)]
+        # No common prefix extends past the end of a document
+        limits = np.minimum(ends[docs[base - 1:base - 1 + len(b)]] - a,
+                            ends[docs[base:base + len(b)]] - b)
+        np.minimum(limits, max_len, out=limits)
+        # Suffixes that sort_suffixes() did not tell apart share max_len tokens
+        level = levels[base:base + len(b)].astype(np.int32)
+        h = np.where(level > 1, 2 ** np.maximum(level - 2, 0), 0).astype(np.int32)
+        h[level == 0] = max_len
+        alive = np.flatnonzero(h < limits)
+        while len(alive):
+            diff = (words[a[alive] + h[alive]] ^ words[b[alive] + h[alive]]).astype(np.uint64)
+            same = WORD_LEN - np.searchsorted(BYTE_LIMITS, diff, side='right')
+            h[alive] += same
+            alive = alive[(same == WORD_LEN) & (h[alive] < limits[alive])]
+        lcp[base:base + len(b)] = np.minimum(h, limits)
+    return lcp
+
+
+def get_nearest_smaller(lcp, step):
+    """Return array near where near[i] is the nearest k in direction step (-1 or 1) from i
+        with lcp[k] < lcp[i] for all i with lcp[i] > 0
+        lcp must start and end with 0
+        This is pointer jumping: near[i] starts as i + step and jumps to near[near[i]] while
+        lcp[near[i]] >= lcp[i]. Everything it jumps over is >= lcp[i] too. The values are
+        done CHUNK_SIZE at a time in direction -step so that they jump through the values
+        that have been done
+    """
+    n = len(lcp)
+    near = np.arange(step, n + step, dtype=np.int32)
+    bases = range(0, n, CHUNK_SIZE)
+    for base in (bases if step < 0 else reversed(bases)):
+        # lcp starts and ends with 0 so the neighbours of the values > 0 are in lcp. Only
+        # the values whose neighbours are not smaller jump
+        alive = get_nonzero(lcp[base:base + CHUNK_SIZE] > 0) + base
+        alive = alive[lcp[alive + step] >= lcp[alive]]
+        while len(alive):
+            nearest = near[alive]
+            jump = lcp[nearest] >= lcp[alive]
+            alive = alive[jump]
+            near[alive] = near[nearest[jump]]
+    return near
+
+
+def get_lcp_intervals(lcp, min_size, lengths):
+    """Return arrays top, parent, lb, rb of all LCP intervals sa[lb:rb + 1] with at least
+        min_size suffixes
+            top is length of the prefix shared by all suffixes in the interval
+            parent is the length of the prefix shared by the enclosing interval
+        The intervals are the internal nodes of the suffix tree. The substrings of length
+        parent + 1 .. top that start the suffixes in an interval occur at exactly the
+        offsets of the suffixes in the interval
+        An interval of suffixes that share top bytes starts at the nearest lcp value
+        before it that is smaller than top and ends before the nearest one after it. It is
+        found from the first lcp value in it that is top, the one whose nearest lcp value
+        before it that is not bigger than top is smaller than top
+        If min_size is 1 then the leaves are returned too. lengths[i] is the length of
+        suffix sa[i] up to the end of its document
+    """
+    n = len(lcp) - 1
+    previous = get_nearest_smaller(lcp, -1)
+    following = get_nearest_smaller(lcp, 1)
+    intervals = []
+    for base in range(1, n, CHUNK_SIZE):
+        boundaries = get_nonzero(lcp[base:base + CHUNK_SIZE] > 0) + base
+        # not_bigger[j] becomes the nearest k before boundaries[j] with
+        # lcp[k] <= lcp[boundaries[j]]. Everything from previous[k] to k is >= lcp[k] so bigger values are jumped over
+        not_bigger = boundaries - 1
+        alive = get_nonzero(lcp[not_bigger] > lcp[boundaries])
+        while len(alive):
+            alive = alive[lcp[not_bigger[alive]] > lcp[boundaries[alive]]]
+            not_bigger[alive] = previous[not_bigger[alive]]
+        first = boundaries[lcp[not_bigger] < lcp[boundaries]]
+        del boundaries, not_bigger, alive
+        lb, rb = previous[first], following[first] - 1
+        keep = rb - lb + 1 >= min_size
+        first, lb, rb = first[keep], lb[keep], rb[keep]
+        intervals.append((lcp[first], np.maximum(lcp[lb], lcp[rb + 1]), lb, rb))
+    del previous, following
+    if min_size <= 1:
+        leaves = np.arange(n, dtype=np.int32)
+        intervals.append((lengths, np.maximum(lcp[:-1], lcp[1:]), leaves, leaves))
+    if not intervals:
+        return tuple(np.empty(0, dtype=np.int32) for _ in range(4))
+    return tuple(np.concatenate(arrays) for arrays in zip(*intervals))
+
+
+def get_counts(offsets_list, m):
+    """Return list of non-overlapping counts of length m strings at offsets_list[d] in each
+        document d
+    """
+    return [get_non_overlapping_count(offsets, m) for offsets in offsets_list]
+
+
+def get_repeats(corpus, max_len):
+    """Return longest, exact for corpus
+            longest: list of longest strings that occur num[d] or more times in each
+                document d
+            exact: list of longest strings that occur num[d] + i times in each document d
+                for the smallest intercept i in 0..19 at that length
+        corpus is a list of (filename, numrepeats, text)
+        Strings are limited to max_len bytes
+
+        These are the nstrings and exact_nstrings that find_repeats.analyze() finds round by
+        round
+    """
+    texts = [text for _, _, text in corpus]
+    nums = np.array([numrepeats for _, numrepeats, _ in corpus])
+    D = len(corpus)
+
+    tokens, starts = get_tokens(texts)
+    ends = [start + len(text) for start, text in zip(starts, texts)]
+    # Strings longer than max_len are not looked for so the suffixes only need to be
+    # sorted by their first max_len bytes and the lcp values stop at max_len
+    sa, levels = sort_suffixes(tokens, ends, max_len)
+    docs = get_docs(sa, starts)
+    lcp = get_lcp_array(tokens, sa, levels, docs, ends, max_len)
+    del levels
+    lengths = np.array(ends)[docs] - sa if nums.sum() <= 1 else None
+
+    # Intervals whose suffixes occur num[d] or more times in each document d. The
+    # number of suffixes from document d in sa[lb:rb + 1] is in_doc[rb + 1] - in_doc[lb]
+    top, parent, lb, rb = get_lcp_intervals(lcp, nums.sum(), lengths)
+    del lcp, lengths
+    in_doc = np.zeros(len(sa) + 1, dtype=np.int32)
+    for d in np.argsort(-nums, kind='mergesort'):
+        np.cumsum(docs == d, dtype=np.int32, out=in_doc[1:])
+        keep = in_doc[rb + 1] - in_doc[lb] >= nums[d]
+        top, parent, lb, rb = top[keep], parent[keep], lb[keep], rb[keep]
+    del in_doc
+    nodes = sorted(zip(np.minimum(top, max_len).tolist(), parent.tolist(), lb.tolist(),
+                       rb.tolist()), reverse=True)
+    del top, parent
+
+    def get_offsets_list(lb, rb):
+        """Return sorted offsets in each document of the suffixes in sa[lb:rb + 1]"""
+        suffixes = sa[lb:rb + 1]
+        suffix_docs = docs[lb:rb + 1]
+        return [np.sort(suffixes[suffix_docs == d]) for d in range(D)]
+
+    def is_valid(offsets_list, m):
+        return all(n >= num for n, num in zip(get_counts(offsets_list, m), nums))
+
+    def get_intercept(offsets_list, m):
+        """Return intercept i if strings of length m at offsets_list occur num[d] + i times
+            in each document d, otherwise None. Return 20 if they occur num[d] + 20 or more
+            times in some document d, as they do for all shorter lengths
+        """
+        diffs = set(n - num for n, num in zip(get_counts(offsets_list, m), nums))
+        if max(diffs) >= 20:
+            return 20
+        if len(diffs) == 1:
+            i = diffs.pop()
+            if i >= 0:
+                return i
+        return None
+
+    def overlaps(offsets_list, m):
+        return any(len(offsets) > 1 and np.diff(offsets).min() < m for offsets in offsets_list)
+
+    longest, longest_len = [], 0
+    exact, exact_len, exact_i = [], 0, None
+    for top, parent, lb, rb in nodes:
+        if top <= parent or top < min(longest_len, exact_len):
+            continue
+        offsets_list = get_offsets_list(lb, rb)
+        string = lambda m: tokens[sa[lb]:sa[lb] + m].tostring()
+
+        # Non-overlapping counts decrease as m increases so binary search for the longest
+        # valid m in parent + 1 .. top
+        lo, hi = parent, top
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if is_valid(offsets_list, mid):
+                lo = mid
+            else:
+                hi = mid - 1
+        if lo > parent and lo >= longest_len:
+            if lo > longest_len:
+                longest, longest_len = [], lo
+            longest.append(string(lo))
+
+        # Counts only change with m where occurrences overlap. analyze() only looks for
+        # exact matches of 2 or more bytes
+        exact_lengths = range(top, parent, -1) if overlaps(offsets_list, top) else [top]
+        for m in exact_lengths:
+            if m < max(exact_len, 2):
+                break
+            i = get_intercept(offsets_list, m)
+            if i is None:
+                continue
+            if i == 20:
+                break
+            if m > exact_len or i < exact_i:
+                exact, exact_len, exact_i = [], m, i
+            if i == exact_i:
+                exact.append(string(m))
+            break
+
+    return sorted(longest), sorted(exact)
@@ -0,0 +1,395 @@
+"""
+    Check that every engine and search mode of find_repeats.py finds the same strings as a
+    search that validates every candidate with str.count, as fr.py and the original
+    find_repeats.py do
+
+    python -m unittest test_find_repeats
+"""
+from __future__ import division, print_function
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+from StringIO import StringIO
+import numpy as np
+from candidates import CandidateSet
+from checkpoint import Checkpoint
+from collapse import CollapsingCounter
+from count_units import count_units, load_patterns, save_patterns
+from find_repeats import (make_counter, search, get_capped_count, CountCache, ENGINES,
+                          DOUBLING_ENGINES, SPILL_ENGINES, CHECKPOINT_ENGINES, COLLAPSE_ENGINES,
+                          GROWTH_MODES, MAX_SUBSTRING_LEN, CAPPED_BLOCK_SIZE)
+from histograms import get_suffix_byte_counts
+from index_store import find_subset_store, get_added_rounds, get_manifest
+from mapped_text import MappedText, read_text
+import parallel
+from spill import SpillingCounter
+from parallel import ParallelCounter, PARALLEL_ENGINES
+
+# Candidate budgets that stop a search part way through
+BUDGETS = [300, 1000]
+
+MBYTE = 1024 * 1024
+
+# Strings counted in the large documents of make_large_text()
+LARGE_STRINGS = ['a', 'aaa', 'a' * 7, 'a' * 40, 'ab', 'aab', 'ba' * 5, 'c', 'cc', 'ca']
+
+
+def make_corpus(seed, alphabet, marker=None):
+    """Return a corpus, a list of (filename, numrepeats, text), of 1 to 3 random documents
+        of the bytes in alphabet. If marker is not None it is added numrepeats + intercept
+        times to each document for a random intercept
+    """
+    rnd = random.Random(seed)
+    intercept = rnd.randint(0, 3)
+    corpus = []
+    for d in range(rnd.randint(1, 3)):
+        numrepeats = rnd.randint(1, 6)
+        parts = [''.join(rnd.choice(alphabet) for _ in range(rnd.randint(20, 300)))]
+        if marker is not None:
+            for _ in range(numrepeats + intercept):
+                parts.append(marker)
+                parts.append(''.join(rnd.choice(alphabet) for _ in range(rnd.randint(0, 20))))
+        corpus.append(('repeats=%d.%d.txt' % (numrepeats, d), numrepeats, ''.join(parts)))
+    return corpus
+
+
+def make_large_text(size, seed):
+    """Return a document of `size` bytes of random a's and b's with a run of 50 a's across
+        each MBYTE boundary and 'cc' at the start
+    """
+    rng = np.random.RandomState(seed)
+    data = (rng.randint(0, 2, size) + ord('a')).astype(np.uint8)
+    for boundary in range(MBYTE, size, MBYTE):
+        data[boundary - 25:boundary + 25] = ord('a')
+    data[:2] = ord('c')
+    return data.tostring()
+
+
+def get_counted_offsets(text, s):
+    """Return list of the offsets of the occurrences of s in text that str.count counts"""
+    offsets = []
+    ofs = text.find(s)
+    while ofs >= 0:
+        offsets.append(ofs)
+        ofs = text.find(s, ofs + len(s))
+    return offsets
+
+
+def get_corpora():
+    """Return list of the corpora that the engines are checked on"""
+    corpora = [[('repeats=3.txt', 3, 'a' * 40), ('repeats=5.txt', 5, 'a' * 70)],
+               [('repeats=2.txt', 2, 'ab' * 30 + 'aab' * 10)]]
+    # The longest exact strings of seeds 19 and 73 are at lengths that doubling growth skips
+    corpora.extend(make_corpus(seed, 'ab') for seed in [0, 1, 2, 19, 73])
+    corpora.extend(make_corpus(seed, 'abc', 'the marker') for seed in range(4, 8))
+    return corpora
+
+
+def get_repeats(corpus):
+    """Return longest, exact, intercept for corpus, found by growing strings one byte at a
+        time and counting them with str.count
+            longest: sorted list of the longest strings that are repeated at least
+                numrepeats times in each document
+            exact: sorted list of the longest strings that are repeated numrepeats + i
+                times in each document for the smallest i in 0..19
+            intercept: i, or None if there are no exact strings
+    """
+    def valid(s):
+        return all(text.count(s) >= numrepeats for _, numrepeats, text in corpus)
+
+    bytes = [chr(b) for b in range(256) if valid(chr(b))]
+    strings = bytes
+    longest, exact, intercept = [], [], None
+    while strings and len(strings[0]) <= MAX_SUBSTRING_LEN:
+        longest = strings
+        found = {}
+        for s in strings:
+            diffs = set(text.count(s) - numrepeats for _, numrepeats, text in corpus)
+            if len(diffs) == 1 and 0 <= min(diffs) < 20:
+                found.setdefault(min(diffs), []).append(s)
+        if found:
+            intercept = min(found)
+            exact = found[intercept]
+        strings = [s + b for s in strings for b in bytes if valid(s + b)]
+    return sorted(longest), sorted(exact), intercept
+
+
+def run_search(corpus, engine, counter=None, **kwargs):
+    """Return longest, exact, intercept for corpus found by find_repeats.search() with
+        `engine` and the search options in kwargs
+    """
+    if counter is None:
+        counter = make_counter(engine, corpus)
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        result = None
+        for result in search(corpus, counter, engine=engine, **kwargs):
+            pass
+    finally:
+        sys.stdout = stdout
+    if result is None:
+        return [], [], None
+    _, nstrings, exact_nstrings, intercept = result
+    return sorted(nstrings), sorted(exact_nstrings) if exact_nstrings else [], intercept
+
+
+def get_growth_modes(engine):
+    """Return list of the growth modes that `engine` can search with"""
+    return GROWTH_MODES if engine in DOUBLING_ENGINES else ['linear']
+
+
+class TestFindRepeats(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.corpora = [(corpus, get_repeats(corpus)) for corpus in get_corpora()]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_engines(self):
+        for corpus, expected in self.corpora:
+            for engine in ENGINES:
+                if engine == 'suffix':
+                    from suffix_array import get_repeats as get_suffix_repeats
+                    longest, exact = get_suffix_repeats(corpus, MAX_SUBSTRING_LEN)
+                    self.assertEqual((sorted(longest), sorted(exact)), expected[:2],
+                                     (engine, corpus))
+                else:
+                    self.assertEqual(run_search(corpus, engine), expected, (engine, corpus))
+
+    def test_doubling(self):
+        for corpus, expected in self.corpora:
+            for engine in DOUBLING_ENGINES:
+                self.assertEqual(run_search(corpus, engine, growth='doubling'), expected,
+                                 (engine, corpus))
+
+    def test_index_store_resume(self):
+        for i, (corpus, expected) in enumerate(self.corpora):
+            for engine in ENGINES:
+                if engine == 'suffix':
+                    continue
+                for growth in get_growth_modes(engine):
+                    index_dir = os.path.join(self.directory, '%s.%s.%d' % (engine, growth, i))
+                    # A stopped search, the search that resumes it and a search of the
+                    #  complete store
+                    for budget in BUDGETS + [None, None]:
+                        result = run_search(corpus, engine, growth=growth, index_dir=index_dir,
+                                            max_candidates=budget)
+                    self.assertEqual(result, expected, (engine, growth, corpus))
+
+    def test_added_documents(self):
+        for i, (corpus, expected) in enumerate(self.corpora):
+            if len(corpus) < 2:
+                continue
+            # The store of all the documents but the first, in reverse order
+            stored_corpus = corpus[:0:-1]
+            for engine in ['count', 'kmer', 'aho']:
+                index_dir = os.path.join(self.directory, '%s.%d' % (engine, i))
+                run_search(stored_corpus, engine, index_dir=index_dir)
+                stored, order = find_subset_store(index_dir, get_manifest(corpus))
+                self.assertEqual(order, list(range(len(corpus) - 1, 0, -1)))
+                added_counter = make_counter(engine, corpus[:1])
+                for strings, counts in get_added_rounds(stored, order, len(corpus),
+                                                        added_counter):
+                    self.assertEqual(counts.tolist(),
+                                     [[text.count(s) for _, _, text in corpus]
+                                      for s in strings], (engine, strings.m, corpus))
+                    self.assertTrue((counts >= [numrepeats for _, numrepeats, _
+                                                in corpus]).all())
+                self.assertEqual(run_search(corpus, engine, index_dir=index_dir), expected,
+                                 (engine, corpus))
+
+    def test_checkpoint_resume(self):
+        for i, (corpus, expected) in enumerate(self.corpora):
+            for engine in CHECKPOINT_ENGINES:
+                for growth in get_growth_modes(engine):
+                    for budget in BUDGETS:
+                        path = os.path.join(self.directory, '%s.%s.%d.%d.npz'
+                                            % (engine, growth, i, budget))
+                        checkpoint = Checkpoint(path, get_manifest(corpus))
+                        run_search(corpus, engine, growth=growth, checkpoint=checkpoint,
+                                   max_candidates=budget)
+                        # The search that resumes the stopped search and a search resumed
+                        #  from the finished search
+                        for _ in range(2):
+                            checkpoint = Checkpoint(path, get_manifest(corpus))
+                            result = run_search(corpus, engine, growth=growth,
+                                                checkpoint=checkpoint, resume=True)
+                            self.assertEqual(result, expected,
+                                             (engine, growth, budget, corpus))
+
+    def test_spilling_counter(self):
+        num_spilled = 0
+        for corpus, expected in self.corpora:
+            for engine in SPILL_ENGINES:
+                for growth in get_growth_modes(engine):
+                    # A budget of a few candidates spills every round past the first few,
+                    #  and a cache of one round lets the files of earlier rounds be deleted
+                    counter = SpillingCounter(make_counter(engine, corpus), 2000, len(corpus),
+                                              self.directory)
+                    try:
+                        self.assertEqual(run_search(corpus, engine, counter, growth=growth,
+                                                    cache=CountCache(corpus, max_bytes=1)),
+                                         expected, (engine, growth, corpus))
+                        num_spilled += counter.num_spilled
+                        # The rounds that linear growth still references are the last
+                        #  round and the round of the exact strings. Doubling growth keeps
+                        #  the rounds it searches back through
+                        if growth == 'linear':
+                            self.assertLessEqual(len(os.listdir(counter.directory)), 4)
+                    finally:
+                        counter.close()
+                    self.assertFalse(os.path.exists(counter.directory))
+        self.assertGreater(num_spilled, 0)
+
+    def test_collapsing_counter(self):
+        for corpus, expected in self.corpora:
+            for engine in COLLAPSE_ENGINES:
+                counter = CollapsingCounter(make_counter(engine, corpus), corpus)
+                try:
+                    self.assertEqual(run_search(corpus, engine, counter), expected,
+                                     (engine, corpus))
+                finally:
+                    counter.close()
+
+    def test_parallel_counter(self):
+        # Validate every round with more than one candidate in the pool
+        min_parallel = parallel.MIN_PARALLEL
+        parallel.MIN_PARALLEL = 1
+        try:
+            for corpus, expected in self.corpora:
+                for engine in PARALLEL_ENGINES:
+                    counter = ParallelCounter(make_counter(engine, corpus), 2, engine,
+                                              [filename for filename, _, _ in corpus])
+                    try:
+                        self.assertEqual(run_search(corpus, engine, counter), expected,
+                                         (engine, corpus))
+                    finally:
+                        counter.close()
+        finally:
+            parallel.MIN_PARALLEL = min_parallel
+
+    def test_parallel_slices(self):
+        # Split the documents into slices of a few bytes so that repeated bytes and pairs
+        #  have overlapping occurrences across the slice boundaries that must be recounted
+        min_parallel, min_slice_size = parallel.MIN_PARALLEL, parallel.MIN_SLICE_SIZE
+        parallel.MIN_PARALLEL, parallel.MIN_SLICE_SIZE = 1, 8
+        try:
+            for corpus, expected in self.corpora:
+                for engine in PARALLEL_ENGINES:
+                    counter = ParallelCounter(make_counter(engine, corpus), 2, engine,
+                                              [filename for filename, _, _ in corpus])
+                    try:
+                        self.assertEqual(run_search(corpus, engine, counter), expected,
+                                         (engine, corpus))
+                        strings = CandidateSet.from_strings(['aaa', 'aba', 'bab', 'bbb'])
+                        counts = counter.get_corpus_counts(strings)
+                        # Each string is counted up to the first document it is not valid in
+                        alive = np.ones(len(strings), dtype=bool)
+                        for d, (_, numrepeats, text) in enumerate(corpus):
+                            self.assertEqual(list(counts[d][alive]),
+                                             [text.count(s) for s, a in zip(strings, alive)
+                                              if a], (engine, text))
+                            alive &= counts[d] >= numrepeats
+                    finally:
+                        counter.close()
+        finally:
+            parallel.MIN_PARALLEL, parallel.MIN_SLICE_SIZE = min_parallel, min_slice_size
+
+    def test_count_units(self):
+        markers = ['aaa', 'aab', 'aba', 'bab', 'the']
+        path = os.path.join(self.directory, 'markers.json')
+        save_patterns(path, markers, 2)
+        self.assertEqual(load_patterns(path), (markers, 2))
+        documents = [(os.path.join(self.directory, '%d.%d.txt' % (i, j)), text)
+                     for i, (corpus, _) in enumerate(self.corpora)
+                     for j, (_, _, text) in enumerate(corpus)]
+        for filename, text in documents:
+            with open(filename, 'wb') as f:
+                f.write(text)
+        filenames = [filename for filename, _ in documents]
+        for jobs in [1, 2]:
+            for offsets in [False, True]:
+                records = list(count_units(filenames, markers, 2, jobs, offsets))
+                self.assertEqual([r['filename'] for r in records], filenames)
+                for record, (_, text) in zip(records, documents):
+                    counts = [text.count(s) for s in markers]
+                    self.assertEqual(record['counts'], counts, text)
+                    self.assertEqual(record['units'], min(counts) - 2)
+                    if offsets:
+                        self.assertEqual(record['offsets'],
+                                         [get_counted_offsets(text, s) for s in markers])
+        missing = list(count_units([os.path.join(self.directory, 'missing.txt')], markers, 2))
+        self.assertIn('error', missing[0])
+
+
+class TestLargeDocuments(unittest.TestCase):
+    """Checks of the code paths that only large documents take"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        # Larger than mapped_text.MIN_MAPPED_SIZE and mapped_text.BLOCK_SIZE
+        cls.text = make_large_text(17 * MBYTE + 12345, 0)
+        cls.path = os.path.join(cls.directory, 'repeats=1.txt')
+        with open(cls.path, 'wb') as f:
+            f.write(cls.text)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def test_mapped_text(self):
+        mapped = read_text(self.path)
+        try:
+            self.assertIsInstance(mapped, MappedText)
+            self.assertEqual(len(mapped), len(self.text))
+            for s in LARGE_STRINGS:
+                self.assertEqual(mapped.count(s), self.text.count(s), s)
+                for start, end in [(1, None), (16 * MBYTE - 10, 16 * MBYTE + 10),
+                                   (3, 16 * MBYTE + 20), (MBYTE, len(self.text) + 5)]:
+                    self.assertEqual(mapped.count(s, start, end),
+                                     self.text.count(s, start, end), (s, start, end))
+        finally:
+            mapped.close()
+
+    def test_capped_count(self):
+        suffix_byte_counts = get_suffix_byte_counts(self.text, CAPPED_BLOCK_SIZE)
+        for s in LARGE_STRINGS:
+            count = self.text.count(s)
+            for numrepeats in [1, count, count + 1]:
+                n, scanned = get_capped_count(self.text, s, numrepeats, suffix_byte_counts)
+                if count >= numrepeats:
+                    self.assertEqual((n, scanned), (count, len(self.text)), (s, numrepeats))
+                else:
+                    self.assertLess(n, numrepeats, (s, numrepeats))
+        # There are no c's after the first block, so counting stops after it
+        n, scanned = get_capped_count(self.text, 'cc', 2, suffix_byte_counts)
+        self.assertEqual((n, scanned), (1, CAPPED_BLOCK_SIZE))
+
+    def test_text_counter(self):
+        # TextCounter counts documents of several blocks with get_capped_count()
+        corpus = [('repeats=%d.txt' % numrepeats, numrepeats, make_large_text(3 * MBYTE, seed))
+                  for seed, numrepeats in enumerate([2, 3])]
+        # The strings that start with 'cc' occur at most once so they are rejected
+        strings = CandidateSet.from_strings(sorted([s for s in LARGE_STRINGS if len(s) == 3] +
+                                                   ['abb', 'bba', 'bbb', 'cca', 'ccb']))
+        counter = make_counter('count', corpus)
+        valid_strings = counter.valid(strings)
+        expected = [s for s in strings
+                    if all(text.count(s) >= numrepeats for _, numrepeats, text in corpus)]
+        self.assertEqual(list(valid_strings), expected)
+        self.assertEqual(counter.valid_counts().tolist(),
+                         [[text.count(s) for _, _, text in corpus] for s in expected])
+
+
+if __name__ == '__main__':
+    unittest.main()